@@ -0,0 +1,123 @@
+'''
+assembly.py: benchmark of building records and items from TIND data
+
+This reports, for a synthetic corpus of MARC XML records and item JSON
+documents, the number per second of:
+
+  * XML trees parsed by lxml, as the lower bound on the cost of a record;
+  * records parsed into field values, and records built as TindRecord
+    objects (as Tind.record() and the pipeline of Tind.records() do);
+  * field cleanups done with a call of cleaned() per value, and done one
+    field at a time across all records (as Tind.records_table() does);
+  * item JSON documents decoded from the text of HTTPX responses, read
+    beforehand as commonpy's net() does, and from the bytes of the
+    responses, using the standard json module and, if it is installed,
+    orjson;
+  * TindItem objects built with keyword arguments and from the decoded
+    field dictionaries (as Topi does).
+
+Usage: python3 dev/benchmarks/assembly.py [number of records]
+'''
+
+import gc
+import httpx
+import json
+import os
+import sys
+from   copy import deepcopy
+from   time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from corpus import marc_record, items_json
+from lxml import etree
+from topi import Tind, TindItem
+from topi.tind import _CLEANED_FIELDS, _clean_fields, cleaned
+
+
+def rate(count, func):
+    # Collections of the large heap of the corpus would dominate the timing.
+    gc.collect()
+    gc.disable()
+    try:
+        start = perf_counter()
+        func()
+        return count / (perf_counter() - start)
+    finally:
+        gc.enable()
+
+
+def report(label, value, baseline = None):
+    change = f'  ({value / baseline - 1:+.1%})' if baseline else ''
+    print(f'  {label:<24} {value:>12,.0f}{change}')
+
+
+def cleaned_one_at_a_time(records):
+    for fields in records:
+        if fields and fields.get('title', '') is not None:
+            for field in _CLEANED_FIELDS:
+                fields[field] = cleaned(fields.get(field, ''))
+
+
+def main(count):
+    tind = Tind('https://caltech.tind.io')
+    xmls = [marc_record(n) for n in range(count)]
+    jsons = [items_json(n) for n in range(count)]
+    print(f'{count:,} records, {count * 2:,} items')
+    print()
+
+    print('Records per second:')
+    report('XML tree only', rate(count, lambda: [etree.fromstring(x) for x in xmls]))
+    report('field values', rate(count, lambda: [tind._fields_from_xml(x) for x in xmls]))
+    report('records', rate(count, lambda: [tind._record_from_xml(x) for x in xmls]))
+    print()
+
+    print('Field cleanups per second:')
+    raw = [tind._raw_fields_from_xml(x) for x in xmls]
+    for fields in raw:
+        # Give the values something to clean up.
+        fields['title'] += ' /'
+        fields['author'] = ' ' + fields['author'] + ','
+    first, second = deepcopy(raw), deepcopy(raw)
+    values = count * len(_CLEANED_FIELDS)
+    per_value = rate(values, lambda: cleaned_one_at_a_time(first))
+    report('cleaned() per value', per_value)
+    report('per field, batched', rate(values, lambda: _clean_fields(second)),
+           per_value)
+    assert first == second
+    print()
+
+    print('Item documents decoded per second:')
+    responses = [httpx.Response(200, content = data) for data in jsons]
+    # net() reads resp.text for every response, so that cost is paid anyway.
+    for r in responses:
+        r.text
+    from_text = rate(count, lambda: [json.loads(r.text) for r in responses])
+    report('json, from resp.text', from_text)
+    report('json, from resp.content',
+           rate(count, lambda: [json.loads(r.content) for r in responses]), from_text)
+    try:
+        import orjson
+        report('orjson, from resp.text',
+               rate(count, lambda: [orjson.loads(r.text) for r in responses]), from_text)
+        report('orjson, from resp.content',
+               rate(count, lambda: [orjson.loads(r.content) for r in responses]), from_text)
+    except ImportError:
+        print('  (orjson is not installed)')
+    print()
+
+    print('Items built per second:')
+    fields = [tind._item_fields_from_json(data) for data in jsons]
+    items = count * 2
+    kwargs = rate(items, lambda: [[TindItem(**f) for f in fs] for fs in fields])
+    report('TindItem(**fields)', kwargs)
+    report('from field values', rate(items, lambda: [[TindItem._from_fields(f)
+                                                      for f in fs] for fs in fields]),
+           kwargs)
+    report('from JSON bytes', rate(items, lambda: [tind._items_from_json(d)
+                                                   for d in jsons]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,91 @@
+'''
+compression.py: benchmark of compressed transfer and storage of MARC XML
+
+This reports, for a synthetic corpus of MARC XML records:
+
+  * the bytes transferred without compression and with gzip transfer
+    encoding (which httpx asks for by default);
+  * the bytes needed to keep the records in memory as plain bytes, as zlib
+    data compressed one record at a time, and as zlib data compressed using
+    Topi's preset MARC dictionary (which is how TindRecord stores _xml);
+  * the parse throughput for records held as plain bytes, for records
+    decompressed from gzip transfer encoding and then parsed, for records
+    decompressed from Topi's storage format and then parsed, and for the
+    same decompressed incrementally and fed straight into the XML parser.
+
+Usage: python3 dev/benchmarks/compression.py [number of records]
+'''
+
+import gzip
+import os
+import sys
+import zlib
+from   time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from corpus import marc_record
+from lxml import etree
+from topi import Tind
+from topi.compression import MARC_DICTIONARY, compress_marc, decompress_marc
+
+
+def fed_to_parser(data, chunk_size = 4096):
+    '''Decompress Topi-compressed "data" incrementally into an XML parser.'''
+    parser = etree.XMLParser(recover = True)
+    decompressor = zlib.decompressobj(zdict = MARC_DICTIONARY)
+    for start in range(0, len(data), chunk_size):
+        parser.feed(decompressor.decompress(data[start : start + chunk_size]))
+    parser.feed(decompressor.flush())
+    return parser.close()
+
+
+def rate(count, func):
+    start = perf_counter()
+    func()
+    return count / (perf_counter() - start)
+
+
+def main(count):
+    tind = Tind('https://caltech.tind.io')
+    corpus = [marc_record(n) for n in range(count)]
+    gzipped = [gzip.compress(xml) for xml in corpus]
+    plain_zlib = [zlib.compress(xml) for xml in corpus]
+    stored = [compress_marc(xml) for xml in corpus]
+
+    raw = sum(len(xml) for xml in corpus)
+    print(f'{count} records, {raw:,} bytes of MARC XML ({raw / count:.0f} per record)')
+    print()
+    print('Bytes transferred:')
+    print(f'  uncompressed          {raw:>12,}')
+    transfer = sum(len(g) for g in gzipped)
+    print(f'  gzip encoding         {transfer:>12,}  ({1 - transfer / raw:.1%} saved)')
+    print()
+    print('Bytes held in memory:')
+    print(f'  plain bytes           {raw:>12,}')
+    single = sum(len(z) for z in plain_zlib)
+    print(f'  zlib, per record      {single:>12,}  ({1 - single / raw:.1%} saved)')
+    shared = sum(len(z) for z in stored)
+    print(f'  zlib + MARC dict      {shared:>12,}  ({1 - shared / raw:.1%} saved)')
+    print()
+    print('Records parsed per second:')
+    plain = rate(count, lambda: [tind._fields_from_xml(xml) for xml in corpus])
+    print(f'  from plain bytes      {plain:>12,.0f}')
+    from_gzip = rate(count, lambda: [tind._fields_from_xml(gzip.decompress(g))
+                                     for g in gzipped])
+    print(f'  from gzip             {from_gzip:>12,.0f}  ({from_gzip / plain - 1:+.1%})')
+    from_stored = rate(count, lambda: [tind._fields_from_xml(decompress_marc(z))
+                                       for z in stored])
+    print(f'  from zlib + dict      {from_stored:>12,.0f}  ({from_stored / plain - 1:+.1%})')
+    fed = rate(count, lambda: [fed_to_parser(z) for z in stored])
+    bare = rate(count, lambda: [etree.fromstring(xml) for xml in corpus])
+    print(f'  XML tree only, plain  {bare:>12,.0f}')
+    print(f'  XML tree only, fed    {fed:>12,.0f}  ({fed / bare - 1:+.1%})')
+    print()
+    compress = rate(count, lambda: [compress_marc(xml) for xml in corpus])
+    print(f'Records compressed per second: {compress:,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
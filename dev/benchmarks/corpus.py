@@ -0,0 +1,115 @@
+'''
+corpus.py: synthetic TIND data for the benchmarks in this directory
+
+The functions here produce MARC XML records and item JSON documents shaped
+like those returned by Caltech's TIND server, with values that vary from one
+record to the next.  They are deterministic, so that every run of a
+benchmark uses the same data.
+'''
+
+import json
+
+_TITLES = ['Vector calculus', 'Principles of quantum mechanics',
+           'Introduction to electrodynamics', 'Molecular biology of the cell',
+           'The art of computer programming', 'Classical mechanics',
+           'Linear algebra done right', 'Thermal physics']
+
+_AUTHORS = [('Marsden, Jerrold E', 'Jerrold E. Marsden, Anthony Tromba'),
+            ('Shankar, R', 'R. Shankar'),
+            ('Griffiths, David J', 'by David J. Griffiths'),
+            ('Alberts, Bruce', 'edited by Bruce Alberts [and others]'),
+            ('Knuth, Donald Ervin', 'Donald E. Knuth'),
+            ('Goldstein, Herbert', 'Herbert Goldstein, Charles Poole, John Safko'),
+            ('Axler, Sheldon Jay', 'Sheldon Axler'),
+            ('Kittel, Charles', 'Charles Kittel, Herbert Kroemer')]
+
+_MARC = '''<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+<record>
+  <controlfield tag="000">01059cam\\a2200361Ia\\4500</controlfield>
+  <controlfield tag="001">{id}</controlfield>
+  <controlfield tag="005">20201028221548.0</controlfield>
+  <controlfield tag="008">120118s{year}\\\\\\\\nyua\\\\\\\\\\b\\\\\\\\001\\0\\eng\\d</controlfield>
+  <datafield tag="010" ind1=" " ind2=" ">
+    <subfield code="a">2011{id}</subfield>
+  </datafield>
+  <datafield tag="020" ind1=" " ind2=" ">
+    <subfield code="a">14292{id:05d}</subfield>
+  </datafield>
+  <datafield tag="020" ind1=" " ind2=" ">
+    <subfield code="a">97814292{id:05d} (hbk.)</subfield>
+  </datafield>
+  <datafield tag="035" ind1=" " ind2=" ">
+    <subfield code="a">(OCoLC)77{id}</subfield>
+  </datafield>
+  <datafield tag="040" ind1=" " ind2=" ">
+    <subfield code="a">IPL</subfield>
+    <subfield code="c">IPL</subfield>
+    <subfield code="d">YDXCP</subfield>
+    <subfield code="d">CIT</subfield>
+  </datafield>
+  <datafield tag="050" ind1=" " ind2="4">
+    <subfield code="a">QA{shelf}</subfield>
+    <subfield code="b">.M338 {year}</subfield>
+  </datafield>
+  <datafield tag="100" ind1="1" ind2=" ">
+    <subfield code="a">{main_author}</subfield>
+  </datafield>
+  <datafield tag="245" ind1="1" ind2="0">
+    <subfield code="a">{title} /</subfield>
+    <subfield code="c">{author}</subfield>
+  </datafield>
+  <datafield tag="250" ind1=" " ind2=" ">
+    <subfield code="a">{edition}th ed</subfield>
+  </datafield>
+  <datafield tag="260" ind1=" " ind2=" ">
+    <subfield code="a">New York :</subfield>
+    <subfield code="b">W.H. Freeman,</subfield>
+    <subfield code="c">c{year}</subfield>
+  </datafield>
+  <datafield tag="300" ind1=" " ind2=" ">
+    <subfield code="a">xxv, {pages} p. :</subfield>
+    <subfield code="b">ill. (some col.) ;</subfield>
+    <subfield code="c">26 cm</subfield>
+  </datafield>
+  <datafield tag="504" ind1=" " ind2=" ">
+    <subfield code="a">Includes bibliographical references and index</subfield>
+  </datafield>
+  <datafield tag="650" ind1=" " ind2="0">
+    <subfield code="a">Calculus</subfield>
+  </datafield>
+  <datafield tag="700" ind1="1" ind2=" ">
+    <subfield code="a">Tromba, Anthony</subfield>
+  </datafield>
+  <datafield tag="909" ind1="C" ind2="O">
+    <subfield code="o">oai:caltech.tind.io:{id}</subfield>
+    <subfield code="p">caltech:bibliographic</subfield>
+  </datafield>
+  <datafield tag="980" ind1=" " ind2=" ">
+    <subfield code="a">BIB</subfield>
+  </datafield>
+</record>
+</collection>'''
+
+
+def marc_record(n):
+    '''Return the MARC XML (as bytes) of synthetic record number "n".'''
+    main_author, author = _AUTHORS[n % len(_AUTHORS)]
+    return _MARC.format(id = 700000 + n, year = 1990 + n % 30,
+                        shelf = 100 + n % 800, main_author = main_author,
+                        title = f'{_TITLES[n % len(_TITLES)]} {n}',
+                        author = author, edition = 2 + n % 7,
+                        pages = 200 + n % 600).encode()
+
+
+def items_json(n, count = 2):
+    '''Return the item JSON (as bytes) of synthetic record number "n".'''
+    items = [{'barcode'     : f'35047{700000 + n}{i:02d}',
+              'item_type'   : 'Book',
+              'call_number' : f'QA{100 + n % 800} .M338',
+              'description' : f'c.{i + 1}',
+              'library'     : 'Sherman Fairchild Library',
+              'location'    : 'SFL basement books',
+              'status'      : 'on shelf' if (n + i) % 5 else 'on loan'}
+             for i in range(count)]
+    return json.dumps({'items': items}).encode()
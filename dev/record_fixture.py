@@ -0,0 +1,142 @@
+'''
+record_fixture.py: record TIND responses into an archive for offline tests
+
+Usage: python3 dev/record_fixture.py SERVER ARCHIVE ID [ID ...]
+
+This retrieves the records with the given TIND ids from SERVER, along with
+their items and thumbnails, and looks up the first item of each record by
+barcode, using a RecordingTransport (see topi/replay.py) that saves every
+response in ARCHIVE.  An id of the form N-M stands for the ids N to M.
+
+If SERVER is "fake", the fake TIND server used by the tests in the tests/
+directory is started and used instead of a real server.
+
+If SERVER is "seed", no server is contacted.  The responses are made from
+the real TIND record kept in tests/test_tind.py: its MARC XML (record
+735973), and item data in the shape TIND returns, holding the item values
+that the tests in that file check.  Record 735973 is answered as it is;
+every other id is answered with a copy of it in which the record id and
+the item barcodes are changed, so that throughput tests can use many ids
+while parsing real responses.  Thumbnails are not requested in this mode.
+The archive used by tests/test_regression.py was made this way, with the
+ids 735973, 1000-1199 and 99 (for which there is no record).
+'''
+
+import json
+import os
+import re
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from topi import Tind, TindError, NotFound
+from topi.replay import RecordingTransport
+
+
+# The real record in tests/test_tind.py and the values of its items.
+SEED_ID = '735973'
+SEED_ITEMS = [{'barcode'     : '35047018228114',
+               'item_type'   : 'Book',
+               'item_volume' : None,
+               'call_number' : 'QA303 .M338 2012',
+               'description' : 'c.1',
+               'library'     : 'Sherman Fairchild Library',
+               'location'    : 'SFL basement books',
+               'status'      : 'on shelf'},
+              {'barcode'     : '35047019492099',
+               'item_type'   : 'Book',
+               'item_volume' : None,
+               'call_number' : 'QA303 .M338 2012',
+               'description' : 'c.2',
+               'library'     : 'Sherman Fairchild Library',
+               'location'    : 'SFL basement books',
+               'status'      : 'on shelf'}]
+
+
+def expanded(ids):
+    for id in ids:
+        if '-' in id:
+            first, last = id.split('-')
+            yield from (str(n) for n in range(int(first), int(last) + 1))
+        else:
+            yield id
+
+
+def seed_barcode(id, copy):
+    '''Return the barcode of item "copy" (from 1) of a copy of the seed.'''
+    if id == SEED_ID:
+        return SEED_ITEMS[copy - 1]['barcode']
+    return f'3504701{int(id):05d}{copy:02d}'
+
+
+def seed_transport(ids):
+    '''Return an httpx transport answering for "ids" from the seed record.'''
+    from test_tind import MARC_XML
+    ids = set(ids)
+    by_barcode = {seed_barcode(id, n): id for id in ids for n in [1, 2]}
+
+    def marc(id):
+        if id not in ids or id == '99':
+            return b''
+        return MARC_XML.replace(SEED_ID.encode(), id.encode())
+
+    def items(id):
+        if id not in ids or id == '99':
+            return {'items': []}
+        return {'items': [dict(item, barcode = seed_barcode(id, n))
+                          for n, item in enumerate(SEED_ITEMS, 1)]}
+
+    def handler(request):
+        path = request.url.raw_path.decode()
+        if m := re.search(r'recid=(\d+)&of=xm', path):
+            return httpx.Response(200, content = marc(m.group(1)),
+                                  headers = {'content-type': 'application/xml'})
+        if m := re.search(r'barcode%3A\+(\d+)&of=xm', path):
+            id = by_barcode.get(m.group(1), '99')
+            return httpx.Response(200, content = marc(id),
+                                  headers = {'content-type': 'application/xml'})
+        if m := re.search(r'/nanna/bibcirc/(\d+)/details', path):
+            return httpx.Response(200, content = json.dumps(items(m.group(1))).encode(),
+                                  headers = {'content-type': 'application/json'})
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+def main(server, archive, ids):
+    ids = list(expanded(ids))
+    fake = None
+    transport = None
+    if server == 'fake':
+        from conftest import FakeTind
+        from threading import Thread
+        fake = FakeTind()
+        Thread(target = fake.server.serve_forever, daemon = True).start()
+        server = fake.url
+    elif server == 'seed':
+        transport = seed_transport(ids)
+        server = 'https://caltech.tind.io'
+
+    client = httpx.Client(transport = RecordingTransport(archive, transport))
+    tind = Tind(server, client = client)
+    for id in ids:
+        try:
+            record = tind.record(id, thumbnails = transport is None)
+            if record.items:
+                tind.item(record.items[0].barcode)
+        except (TindError, NotFound) as ex:
+            print(f'{id}: {ex}', file = sys.stderr)
+    client.close()
+    if fake:
+        fake.server.shutdown()
+    print(f'wrote {archive}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(__doc__.strip(), file = sys.stderr)
+        sys.exit(2)
+    main(sys.argv[1], sys.argv[2], sys.argv[3:])
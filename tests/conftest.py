@@ -0,0 +1,175 @@
+import gzip
+import json
+import os
+import pytest
+import re
+import sys
+import threading
+import time
+from   http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '..'))
+except:
+    sys.path.append('..')
+
+
+# Fake TIND server.
+# .............................................................................
+# This imitates the three TIND endpoints used by Topi, so that tests can be
+# run without access to a real TIND server.  Records exist for every TIND id
+# between 1000 and 9999; the record with id N has two items with barcodes
+# "35047N01" and "35047N02".  Any other id produces an HTTP 404 response.
+
+FAKE_MARC = '''<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+<record>
+  <controlfield tag="001">{id}</controlfield>
+  <controlfield tag="008">120118s2012\\\\nyua\\\\\\b\\\\001\\0\\eng\\d</controlfield>
+  <datafield tag="020" ind1=" " ind2=" ">
+    <subfield code="a">1429215089</subfield>
+  </datafield>
+  <datafield tag="100" ind1="1" ind2=" ">
+    <subfield code="a">Marsden, Jerrold E</subfield>
+  </datafield>
+  <datafield tag="245" ind1="1" ind2="0">
+    <subfield code="a">Vector calculus {id} /</subfield>
+    <subfield code="c">Jerrold E. Marsden, Anthony Tromba</subfield>
+  </datafield>
+  <datafield tag="250" ind1=" " ind2=" ">
+    <subfield code="a">6th ed</subfield>
+  </datafield>
+  <datafield tag="260" ind1=" " ind2=" ">
+    <subfield code="b">W.H. Freeman,</subfield>
+  </datafield>
+</record>
+</collection>'''
+
+FAKE_BLANK_MARC = '''<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+</collection>'''
+
+
+def fake_items(id, status = 'on shelf'):
+    return {'items': [{'barcode': f'35047{id}01', 'item_type': 'Book',
+                       'call_number': 'QA303 .M338 2012', 'description': 'c.1',
+                       'library': 'Sherman Fairchild Library',
+                       'location': 'SFL basement books', 'status': status},
+                      {'barcode': f'35047{id}02', 'item_type': 'Book',
+                       'call_number': 'QA303 .M338 2012', 'description': 'c.2',
+                       'library': 'Sherman Fairchild Library',
+                       'location': 'SFL basement books', 'status': 'on shelf'}]}
+
+
+class FakeTind():
+    '''State and settings of a running fake TIND server.'''
+
+    def __init__(self):
+        self.latency = 0
+        self.delays = []                # Per-request delays, used up in order.
+        self.hits = {}
+        self.status = {}
+        self.blank = set()
+        self.throttle = 0               # Number of requests to answer with 429.
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = _FakeServer(('127.0.0.1', 0), _handler_for(self))
+        self.server.daemon_threads = True
+        # Clients that give up on slow requests close their connections.
+        self.server.handle_error = lambda request, address: None
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def count(self, kind):
+        with self.lock:
+            return self.hits.get(kind, 0)
+
+
+class _FakeServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 overflows when many threads open
+    # connections at once, and the kernel then drops connection attempts,
+    # which clients retry only after a second.
+    request_queue_size = 128
+
+
+def _handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections open, so that clients can reuse them.
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with fake.lock:
+                fake.connections += 1
+
+        def do_GET(self):
+            with fake.lock:
+                delay = fake.delays.pop(0) if fake.delays else fake.latency
+            if delay:
+                time.sleep(delay)
+            path = self.path
+            if m := re.search(r'recid=(\d+)&of=xm', path):
+                kind, id = 'marc', m.group(1)
+            elif m := re.search(r'barcode%3A\+35047(\d{4})0\d&of=xm', path):
+                kind, id = 'marc', m.group(1)
+            elif m := re.search(r'/nanna/bibcirc/(\d+)/details', path):
+                kind, id = 'items', m.group(1)
+            elif m := re.search(r'/nanna/thumbnail/(\d+)', path):
+                kind, id = 'thumbnail', m.group(1)
+            else:
+                return self._reply(404, b'')
+            with fake.lock:
+                fake.hits[kind] = fake.hits.get(kind, 0) + 1
+                throttled = fake.throttle > 0
+                fake.throttle -= int(throttled)
+            if throttled:
+                return self._reply(429, b'')
+            if not (1000 <= int(id) <= 9999):
+                return self._reply(404, b'')
+            if kind == 'marc':
+                marc = FAKE_BLANK_MARC if id in fake.blank else FAKE_MARC.format(id = id)
+                return self._reply(200, marc.encode(), 'application/xml')
+            elif kind == 'items':
+                body = json.dumps(fake_items(id, fake.status.get(id, 'on shelf')))
+                return self._reply(200, body.encode(), 'application/json')
+            else:
+                if int(id) % 2:
+                    body = '{}'
+                else:
+                    body = json.dumps({'big': f'https://covers.example/{id}.jpg'})
+                return self._reply(200, body.encode(), 'application/json')
+
+        def _reply(self, code, body, content_type = 'text/plain'):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def _running_fake_tind():
+    fake = FakeTind()
+    thread = threading.Thread(target = fake.server.serve_forever, daemon = True)
+    thread.start()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+@pytest.fixture
+def fake_tind():
+    yield from _running_fake_tind()
+
+
+@pytest.fixture
+def other_fake_tind():
+    yield from _running_fake_tind()
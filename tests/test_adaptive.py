@@ -0,0 +1,77 @@
+import topi.tind_utils
+from   topi import Tind
+from   topi.tind_utils import AdaptiveLimit
+
+
+def _window(limit, latency):
+    '''Run one window of requests that all take "latency" seconds.'''
+    count = limit.limit
+    for _ in range(count):
+        assert limit.acquire(timeout = 1)
+    for _ in range(count):
+        limit.release()
+        limit.observe(latency)
+
+
+def test_increase_while_latency_flat():
+    limit = AdaptiveLimit(initial = 4, maximum = 10)
+    for _ in range(20):
+        _window(limit, 0.05)
+    stats = limit.stats()
+    assert stats['limit'] == 10
+    assert stats['increases'] == 6
+    assert stats['decisions'][-1]['decision'] == 'increase'
+
+
+def test_decrease_when_latency_rises():
+    limit = AdaptiveLimit(initial = 16, maximum = 16)
+    _window(limit, 0.05)
+    for _ in range(3):
+        _window(limit, 0.2)
+    assert limit.limit == 13
+    assert limit.stats()['decreases'] == 3
+
+
+def test_no_increase_when_limit_unused():
+    limit = AdaptiveLimit(initial = 4)
+    for _ in range(10):
+        assert limit.acquire()
+        limit.release()
+        limit.observe(0.05)
+    assert limit.limit == 4
+    assert limit.stats()['holds'] > 0
+
+
+def test_backoff_once_per_burst():
+    limit = AdaptiveLimit(initial = 16, maximum = 16)
+    _window(limit, 0.05)
+    for _ in range(8):
+        limit.observe(0.05, rate_limited = True)
+    stats = limit.stats()
+    assert stats['limit'] == 8
+    assert stats['backoffs'] == 1
+    assert stats['decisions'][-1]['reason'] == 'rate limit exceeded'
+
+
+def test_acquire_waits_for_limit():
+    limit = AdaptiveLimit(initial = 1, maximum = 1)
+    assert limit.acquire()
+    assert not limit.acquire(timeout = 0.05)
+    limit.release()
+    assert limit.acquire(timeout = 0.05)
+
+
+def test_bulk_retrieval_adapts(fake_tind, monkeypatch):
+    monkeypatch.setattr(topi.tind_utils, '_RATE_LIMIT_SLEEP', 0.2)
+    fake_tind.latency = 0.02
+    tind = Tind(fake_tind.url, adaptive_concurrency = True, max_concurrency = 12)
+    assert len(list(tind.records(range(1000, 1150)))) == 150
+    stats = tind.stats()['concurrency']
+    assert stats['limit'] > 4
+    assert stats['in_flight'] == 0
+    fake_tind.throttle = 6
+    assert len(list(tind.records(range(2000, 2020)))) == 20
+    stats = tind.stats()['concurrency']
+    assert stats['backoffs'] >= 1
+    assert any(d['decision'] == 'backoff' for d in stats['decisions'])
+    assert Tind(fake_tind.url).stats()['concurrency'] is None
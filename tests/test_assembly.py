@@ -0,0 +1,47 @@
+import topi.tind
+from   topi import Tind, TindRecord, TindItem
+from   topi.tind import _clean_fields, cleaned, parsed_title_and_author
+
+
+def test_batch_cleanup_matches_cleaned():
+    values = ['Title /', ' Author, ', 'x. .', '', None, ' ./ ', 'Plain']
+    records = [{'title': value, 'author': value, 'publisher': value}
+               for value in values if value is not None]
+    _clean_fields(records)
+    for fields, value in zip(records, [v for v in values if v is not None]):
+        assert fields['title'] == cleaned(value)
+        assert fields['subtitle'] == ''
+    skipped = {'title': None, 'author': 'Someone,'}
+    _clean_fields([skipped, {}])
+    assert skipped == {'title': None, 'author': 'Someone,'}
+
+
+def test_title_and_author():
+    assert parsed_title_and_author('Title') == ('Title', None)
+    assert parsed_title_and_author('Title /') == ('Title', '')
+    assert parsed_title_and_author('Title [by] Jo Smith') == ('Title', 'Jo Smith')
+    assert parsed_title_and_author('A, by B, by Jo Smith:') == ('A, by B', 'Jo Smith:')
+    assert parsed_title_and_author('/Title [by] Jo') == ('/Title', 'Jo')
+    assert parsed_title_and_author('A, by B [by] Jo') == ('A, by B', 'Jo')
+    assert parsed_title_and_author('[by] A, by Jo') == ('[by] A', 'Jo')
+    assert parsed_title_and_author('A [by] B /') == ('A [by] B', '')
+
+
+def test_objects_from_fields():
+    fields = {'tind_id': '12', 'title': 'T', 'isbn_issn': ['1']}
+    record = TindRecord._from_fields('https://x.tind.io', dict(fields))
+    assert record.__dict__ == TindRecord('https://x.tind.io', **fields).__dict__
+    assert record.tind_url == 'https://x.tind.io/record/12'
+    assert TindRecord._from_fields(None, {}).__dict__ == TindRecord().__dict__
+    assert TindItem._from_fields({'barcode': '3'}) == TindItem(barcode = '3')
+
+
+def test_items_from_bytes(monkeypatch):
+    tind = Tind('https://x.tind.io')
+    data = b'{"items": [{"barcode": "35047", "item_type": "Book"}]}'
+    items = tind._items_from_json(data)
+    assert items == [TindItem(barcode = '35047', type = 'Book')]
+    # The standard json module is used when orjson is not installed.
+    import json
+    monkeypatch.setattr(topi.tind, '_loads', json.loads)
+    assert tind._items_from_json(data) == items
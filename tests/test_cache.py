@@ -0,0 +1,68 @@
+import pytest
+import time
+
+from topi import Tind, NotFound
+from topi.cache import TTLCache
+
+
+def test_ttl_cache():
+    cache = TTLCache(maxsize = 2, ttl = 0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)                   # Evicts 'b', the least recently used.
+    assert cache.get('b') is None
+    assert 'a' in cache and 'c' in cache
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 1
+
+
+def test_negative_cache_not_found(fake_tind):
+    tind = Tind(fake_tind.url)
+    for _ in range(3):
+        with pytest.raises(NotFound):
+            tind.record(42)
+    assert fake_tind.count('marc') == 1
+    # The pipeline shares the same cache.
+    pipeline = tind.pipeline()
+    assert list(pipeline.records([42])) == []
+    assert isinstance(pipeline.failures['42'], NotFound)
+    assert fake_tind.count('marc') == 1
+    assert tind.negative_cache.stats()['hits'] == 3
+
+    tind.purge_negative_cache(tind_ids = [42])
+    with pytest.raises(NotFound):
+        tind.record(42)
+    assert fake_tind.count('marc') == 2
+
+
+def test_negative_cache_barcode(fake_tind):
+    tind = Tind(fake_tind.url)
+    for _ in range(2):
+        with pytest.raises(NotFound):
+            tind.item(35047000101)
+    assert fake_tind.count('marc') == 1
+
+
+def test_negative_cache_blank_record(fake_tind):
+    fake_tind.blank.add('1234')
+    tind = Tind(fake_tind.url)
+    first = tind.record(1234)
+    assert tind.record(1234) is first
+    assert list(tind.records([1234])) == [first]
+    assert fake_tind.count('marc') == 1
+    tind.purge_negative_cache()
+    assert len(tind.negative_cache) == 0
+
+
+def test_negative_cache_disabled(fake_tind):
+    tind = Tind(fake_tind.url, negative_cache_size = 0)
+    for _ in range(2):
+        with pytest.raises(NotFound):
+            tind.record(42)
+    assert fake_tind.count('marc') == 2
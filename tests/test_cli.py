@@ -0,0 +1,81 @@
+import csv
+import json
+
+import pytest
+
+from topi.__main__ import main
+
+
+def test_fetch_jsonl(fake_tind, tmp_path):
+    ids = tmp_path / 'ids.txt'
+    ids.write_text('1001\n1002\n\n# comment\n7\n')
+    out = tmp_path / 'out.jsonl'
+    code = main(['fetch', '-s', fake_tind.url, '-i', str(ids), '-o', str(out), '-q'])
+    assert code == 1                    # Because id 7 does not exist.
+    records = [json.loads(line) for line in out.read_text().splitlines()]
+    assert sorted(r['tind_id'] for r in records) == ['1001', '1002']
+    assert len(records[0]['items']) == 2
+
+
+def test_export_csv_with_checkpoint(fake_tind, tmp_path):
+    ids = tmp_path / 'ids.txt'
+    ids.write_text('1001\n1002\n')
+    out = tmp_path / 'out.csv'
+    checkpoint = tmp_path / 'done.txt'
+    args = ['export', '-s', fake_tind.url, '-i', str(ids), '-o', str(out),
+            '-c', str(checkpoint), '-j', '2', '-r', '100', '-q']
+    assert main(args) == 0
+    assert sorted(checkpoint.read_text().split()) == ['1001', '1002']
+
+    # Resuming with more ids only fetches the new ones and appends to output.
+    ids.write_text('1001\n1002\n1003\n')
+    before = fake_tind.count('marc')
+    assert main(args) == 0
+    assert fake_tind.count('marc') == before + 1
+    with open(out) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 6
+    assert sorted(set(row['tind_id'] for row in rows)) == ['1001', '1002', '1003']
+    assert rows[0]['item_barcode'].startswith('35047')
+
+
+def test_fetch_barcodes(fake_tind, tmp_path):
+    ids = tmp_path / 'ids.txt'
+    ids.write_text('35047100101\n')
+    out = tmp_path / 'out.jsonl'
+    assert main(['fetch', '-b', '-s', fake_tind.url, '-i', str(ids), '-o', str(out), '-q']) == 0
+    item = json.loads(out.read_text())
+    assert item['barcode'] == '35047100101'
+    assert item['parent']['tind_id'] == '1001'
+
+
+def test_fetch_adaptive(fake_tind, tmp_path, capsys):
+    ids = tmp_path / 'ids.txt'
+    ids.write_text('\n'.join(str(id) for id in range(1000, 1040)))
+    out = tmp_path / 'out.jsonl'
+    assert main(['fetch', '-s', fake_tind.url, '-i', str(ids), '-o', str(out),
+                 '-a', '-j', '8']) == 0
+    assert len(out.read_text().splitlines()) == 40
+    assert 'concurrency limit ended at' in capsys.readouterr().err
+
+
+def test_blank_records_checkpointed(fake_tind, tmp_path):
+    fake_tind.blank.add('1002')
+    ids = tmp_path / 'ids.txt'
+    ids.write_text('1001\n1002\n')
+    out = tmp_path / 'out.jsonl'
+    checkpoint = tmp_path / 'done.txt'
+    args = ['fetch', '-s', fake_tind.url, '-i', str(ids), '-o', str(out),
+            '-c', str(checkpoint), '-q']
+    assert main(args) == 1              # Because 1002 is blank.
+    assert sorted(checkpoint.read_text().split()) == ['1001', '1002']
+    before = fake_tind.count('marc')
+    assert main(args) == 0
+    assert fake_tind.count('marc') == before
+    assert len(out.read_text().splitlines()) == 1
+
+
+def test_rate_must_be_positive(fake_tind, capsys):
+    with pytest.raises(SystemExit):
+        main(['fetch', '-s', fake_tind.url, '-r', '0'])
+    assert 'must be greater than 0' in capsys.readouterr().err
@@ -0,0 +1,26 @@
+from topi import Tind
+from topi.compression import compress_marc, decompress_marc
+
+from conftest import FAKE_MARC
+
+
+def test_compressed_xml_storage():
+    xml = FAKE_MARC.format(id = 1234).encode()
+    data = compress_marc(xml)
+    assert decompress_marc(data) == xml
+    assert len(data) < len(xml) / 3
+    record = Tind('https://example.tind.io')._record_from_xml(xml)
+    assert record._compressed_xml is None
+    copy = Tind('https://example.tind.io')._record_from_xml(xml)
+    record._compress_xml()
+    assert record._xml == xml
+    assert record._compressed_xml == data
+    assert record == copy
+
+
+def test_cached_records_compressed(fake_tind):
+    tind = Tind(fake_tind.url)
+    record = tind.record(1001)
+    assert record._compressed_xml is not None
+    assert record._xml == FAKE_MARC.format(id = 1001).encode()
+    assert all(r._compressed_xml is None for r in tind.records([1002, 1003]))
@@ -0,0 +1,132 @@
+import pytest
+import time
+
+from topi import Tind, TindRecord, TimedOut
+
+
+def test_record_timeout(fake_tind):
+    fake_tind.latency = 1
+    tind = Tind(fake_tind.url)
+    start = time.perf_counter()
+    with pytest.raises(TimedOut):
+        tind.record(1001, timeout = 0.2)
+    assert time.perf_counter() - start < 0.6
+
+
+def test_item_timeout(fake_tind):
+    fake_tind.latency = 1
+    tind = Tind(fake_tind.url)
+    with pytest.raises(TimedOut):
+        tind.item(35047100101, timeout = 0.2)
+
+
+def test_stale_value_on_timeout(fake_tind):
+    tind = Tind(fake_tind.url)
+    fresh = tind.record(1001, timeout = 5)
+    fake_tind.latency = 1
+    assert tind.record(1001, timeout = 0.2, stale = True) is fresh
+    with pytest.raises(TimedOut):
+        tind.record(1002, timeout = 0.2, stale = True)
+
+
+def test_thumbnail_timeout(fake_tind):
+    fake_tind.latency = 1
+    tind = Tind(fake_tind.url)
+    records = [TindRecord(server_url = fake_tind.url, tind_id = '3000')]
+    start = time.perf_counter()
+    tind.prefetch_thumbnails(records, timeout = 0.2)
+    assert time.perf_counter() - start < 0.6
+    assert records[0]._saved_thumbnail_url is None
+
+
+def test_hedged_request(fake_tind):
+    tind = Tind(fake_tind.url, hedge = True)
+    # Build up a latency history of fast responses.
+    for id in range(1000, 1025):
+        tind._items_json_for_tind_id(id)
+    # The next response is slow, but the hedged duplicate is fast.
+    fake_tind.delays = [2]
+    start = time.perf_counter()
+    assert tind._items_json_for_tind_id(1100)
+    assert time.perf_counter() - start < 1
+    # Some of the fast requests above may have been hedged too.
+    stats = tind.stats()['latency']['items']
+    assert stats['hedges'] >= 1
+    assert stats['hedge_wins'] >= 1
+
+
+def test_recovery_after_burst_of_timeouts(fake_tind):
+    from concurrent.futures import ThreadPoolExecutor
+    fake_tind.latency = 1
+    tind = Tind(fake_tind.url)
+
+    def timed_out(id):
+        try:
+            tind.record(id, timeout = 0.2)
+            return False
+        except TimedOut:
+            return True
+
+    with ThreadPoolExecutor(40) as executor:
+        assert all(executor.map(timed_out, range(1000, 1040)))
+    # Abandoned requests end at their deadlines and free their threads.
+    fake_tind.latency = 0
+    time.sleep(0.1)
+    start = time.perf_counter()
+    assert tind.record(1500, timeout = 1).tind_id == '1500'
+    assert time.perf_counter() - start < 0.5
+
+
+def test_slot_held_until_abandoned_request_ends():
+    from threading import BoundedSemaphore
+    from topi.tind_utils import Deadline, _get
+
+    class SlowClient():
+        def get(self, url, **kwargs):
+            time.sleep(0.3)
+            raise RuntimeError('too slow')
+
+    slots = BoundedSemaphore(1)
+    assert slots.acquire()
+    with pytest.raises(TimedOut):
+        _get('https://example.tind.io', Deadline(0.05), None, False,
+             client = SlowClient(), concurrency = slots)
+    assert not slots.acquire(timeout = 0)
+    assert slots.acquire(timeout = 1)
+
+
+def test_hedging_waits_for_latency_history(fake_tind, monkeypatch):
+    import topi.tind_utils
+
+    def direct_get(*args):
+        raise AssertionError('direct request made without a hedge delay')
+
+    monkeypatch.setattr(topi.tind_utils, '_direct_get', direct_get)
+    tind = Tind(fake_tind.url, hedge = True)
+    assert tind._items_json_for_tind_id(1001)
+
+
+def test_hedged_not_found_returns_at_once(fake_tind):
+    tind = Tind(fake_tind.url, hedge = True)
+    for id in range(1000, 1025):
+        tind._items_json_for_tind_id(id)
+    # The first request is slow; the hedged duplicate finds nothing.
+    fake_tind.delays = [2]
+    start = time.perf_counter()
+    assert tind._items_json_for_tind_id(99999) is None
+    assert time.perf_counter() - start < 1
+
+
+def test_direct_get_errors():
+    import httpx
+    from topi.tind_utils import _direct_get
+
+    class Client():
+        def get(self, url, **kwargs):
+            self.timeout = kwargs['timeout']
+            raise RuntimeError('unexpected')
+
+    client = Client()
+    (resp, error) = _direct_get('https://example.tind.io', client)
+    assert resp is None and isinstance(error, RuntimeError)
+    assert client.timeout == httpx.Timeout(15)
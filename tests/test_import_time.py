@@ -0,0 +1,48 @@
+import os
+import re
+import subprocess
+import sys
+
+# Modules that "import topi" must not load.  They are loaded when a code path
+# that needs them first runs.
+HEAVY = ['lxml', 'commonpy', 'sidetrack', 'json', 'httpx', 'concurrent']
+
+# Maximum cumulative time in microseconds for "import topi", as reported by
+# "python -X importtime".  Importing Topi's own modules takes ~1-2 ms; before
+# the dependencies were loaded lazily, it took ~70 ms.
+BUDGET_USEC = 20000
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def run_python(code, *options):
+    return subprocess.run([sys.executable, *options, '-c', code], cwd = ROOT,
+                          capture_output = True, text = True, check = True)
+
+
+def new_modules(statement):
+    code = ('import sys; before = set(sys.modules); ' + statement + '; '
+            'print(" ".join(sorted(set(sys.modules) - before)))')
+    return run_python(code).stdout.split()
+
+
+def heavy(modules):
+    return [m for m in modules if m.split('.')[0] in HEAVY]
+
+
+def test_import_loads_no_heavy_modules():
+    assert heavy(new_modules('import topi')) == []
+
+
+def test_creating_tind_loads_no_heavy_modules():
+    assert heavy(new_modules('import topi; topi.Tind("https://example.org")')) == []
+
+
+def test_import_time_budget():
+    # Take the best of several runs to reduce noise from the machine.
+    times = []
+    for _ in range(5):
+        stderr = run_python('import topi', '-X', 'importtime').stderr
+        match = re.search(r'\|\s*(\d+)\s*\|\s*topi\s*$', stderr, re.MULTILINE)
+        times.append(int(match.group(1)))
+    assert min(times) < BUDGET_USEC
@@ -0,0 +1,51 @@
+from topi import Tind, TindRecord, NotFound
+
+
+def test_pipeline_records(fake_tind):
+    fake_tind.latency = 0.01
+    tind = Tind(fake_tind.url)
+    pipeline = tind.pipeline(fetchers = 4, item_fetchers = 4, queue_size = 2)
+    ids = list(range(1000, 1040)) + [42]
+    records = list(pipeline.records(ids))
+    assert len(records) == 40
+    assert sorted(r.tind_id for r in records) == [str(id) for id in range(1000, 1040)]
+    for r in records:
+        assert r.title == f'Vector calculus {r.tind_id}'
+        assert len(r.items) == 2
+        assert all(item.parent is r for item in r.items)
+    assert isinstance(pipeline.failures['42'], NotFound)
+
+    stats = pipeline.stats()
+    assert stats['stages']['fetch']['processed'] == 41
+    assert stats['stages']['fetch']['failed'] == 1
+    assert stats['stages']['assemble']['processed'] == 40
+    assert all(q['max_depth'] <= 2 for q in stats['queues'].values())
+
+
+def test_pipeline_items(fake_tind):
+    tind = Tind(fake_tind.url)
+    items = list(tind.pipeline().items(['35047100502', '35047100601']))
+    assert sorted(item.barcode for item in items) == ['35047100502', '35047100601']
+    assert all(isinstance(item.parent, TindRecord) for item in items)
+
+
+def test_records_convenience(fake_tind):
+    tind = Tind(fake_tind.url)
+    assert len(list(tind.records(['1001', '1002']))) == 2
+
+
+def test_pipeline_early_exit(fake_tind):
+    tind = Tind(fake_tind.url)
+    pipeline = tind.pipeline(queue_size = 1)
+    for record in pipeline.records(range(1000, 2000)):
+        break
+    assert fake_tind.count('marc') < 1000
+
+
+def test_pipeline_dropped_before_start(fake_tind):
+    import threading
+    threads = threading.active_count()
+    generator = Tind(fake_tind.url).records(range(1000, 1100))
+    del generator
+    assert threading.active_count() == threads
+    assert fake_tind.count('marc') == 0
@@ -0,0 +1,79 @@
+import pytest
+import time
+from   concurrent.futures import ThreadPoolExecutor
+
+from topi import TindPool, TindError
+
+
+def test_pool_clients(fake_tind, other_fake_tind):
+    with TindPool(cache_size = 100, max_rate = 50) as pool:
+        first = pool.client(fake_tind.url)
+        assert pool.client(fake_tind.url + '/') is first
+        second = pool.client(other_fake_tind.url, max_rate = 5)
+        assert second is not first and len(pool) == 2
+        assert fake_tind.url in pool
+        assert first._limiter.rate == 50 and second._limiter.rate == 5
+        assert first._recent.maxsize == second._recent.maxsize == 50
+        with pytest.raises(ValueError):
+            pool.client(fake_tind.url, max_rate = 1)
+
+
+def test_shared_connections(fake_tind):
+    with TindPool() as pool:
+        tind = pool.client(fake_tind.url)
+        for id in range(1000, 1010):
+            tind.record(id)
+    assert fake_tind.count('marc') == 10
+    assert fake_tind.connections == 1
+
+
+def test_per_host_concurrency(fake_tind, other_fake_tind):
+    fake_tind.latency = other_fake_tind.latency = 0.1
+    with TindPool(max_concurrency = 2) as pool:
+        slow = pool.client(fake_tind.url)
+        fast = pool.client(other_fake_tind.url, max_concurrency = 8)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(fast._items_json_for_tind_id, range(1000, 1008)))
+        fast_time = time.perf_counter() - start
+        start = time.perf_counter()
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(slow._items_json_for_tind_id, range(1000, 1008)))
+        slow_time = time.perf_counter() - start
+    assert fast_time < 0.3
+    assert slow_time >= 0.4
+
+
+def test_aggregate_stats(fake_tind, other_fake_tind):
+    with TindPool() as pool:
+        pool.client(fake_tind.url).record(1001)
+        pool.client(other_fake_tind.url).record(1002)
+        pool.client(other_fake_tind.url).item(35047100301)
+        stats = pool.stats()
+    assert set(stats['hosts']) == {fake_tind.url, other_fake_tind.url}
+    assert stats['total']['hosts'] == 2
+    assert stats['total']['latency']['marc']['requests'] == 3
+    assert stats['total']['latency']['items']['requests'] == 3
+
+
+def test_thumbnail_through_pool(fake_tind):
+    with TindPool() as pool:
+        tind = pool.client(fake_tind.url)
+        record = tind.record(1002)
+        assert record.thumbnail_url == 'https://covers.example/1002.jpg'
+        assert tind.stats()['latency']['thumbnail']['requests'] == 1
+    assert fake_tind.connections == 1
+
+
+def test_use_after_close(fake_tind):
+    with TindPool() as pool:
+        tind = pool.client(fake_tind.url)
+        record = tind.record(1004)
+    with pytest.raises(TindError):
+        tind.record(1003)
+    with pytest.raises(TindError):
+        record.thumbnail_url
+    with pytest.raises(ValueError):
+        pool.client(fake_tind.url)
+    assert fake_tind.count('marc') == 1
+    assert fake_tind.count('thumbnail') == 0
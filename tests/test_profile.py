@@ -0,0 +1,52 @@
+import pstats
+
+from topi import Tind
+
+
+def test_profile_phases(fake_tind):
+    tind = Tind(fake_tind.url)
+    with tind.profile() as p:
+        for id in range(1000, 1010):
+            tind.record(id)
+        tind.item(35047200001)
+    stats = p.stats()
+    assert stats['network']['calls'] == 22
+    for name in ['parse', 'cleanup', 'decode', 'construct']:
+        assert stats[name]['calls'] >= 11
+        assert stats[name]['allocated'] is not None
+    total = sum(values['time'] for values in stats.values())
+    assert total <= p.elapsed
+    assert 'network' in p.report()
+    assert p.allocation_sites(3)
+
+
+def test_profile_inactive(fake_tind):
+    tind = Tind(fake_tind.url)
+    with tind.profile(memory = False) as p:
+        pass
+    tind.record(1001)
+    assert p.stats() == {}
+
+
+def test_profile_files(fake_tind, tmp_path):
+    fake_tind.latency = 0.02
+    tind = Tind(fake_tind.url)
+    cprofile, stacks = tmp_path / 'batch.prof', tmp_path / 'batch.folded'
+    with tind.profile(memory = False, cprofile = str(cprofile), stacks = str(stacks)):
+        list(tind.records(range(1000, 1020)))
+    assert pstats.Stats(str(cprofile)).total_calls > 0
+    lines = stacks.read_text().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_profile_ending_during_phase(monkeypatch):
+    import topi.profile
+
+    class Ending(list):
+        # Another thread ends the profile between any test and any use.
+        def __bool__(self):
+            return True
+
+    monkeypatch.setattr(topi.profile, '_active', Ending())
+    with topi.profile.phase('parse'):
+        pass
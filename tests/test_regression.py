@@ -0,0 +1,120 @@
+# Regression tests that replay responses recorded in tests/data, so that they
+# run without a network and measure Topi itself rather than a server.  The
+# budgets are several times lower than what a laptop achieves, so that they
+# only fail on real regressions.  The responses are those of the real TIND
+# record in test_tind.py (id 735973) and of copies of it under the ids in
+# IDS; see dev/record_fixture.py for how the archive was made.
+
+import os
+import time
+import tracemalloc
+
+import httpx
+import pytest
+
+from   topi import Tind, NotFound
+from   topi.replay import ReplayTransport
+
+
+ARCHIVE = os.path.join(os.path.dirname(__file__), 'data', 'tind-archive.json.gz')
+
+IDS = range(1000, 1200)
+
+# Minimum calls per second with no simulated latency.
+RECORDS_PER_SECOND = 200
+ITEMS_PER_SECOND = 200
+
+# Minimum records per second for the bulk methods with 10 ms of latency per
+# request.  Fetching one record at a time, the limit would be about 50.
+BULK_RECORDS_PER_SECOND = 150
+
+# Maximum bytes retained per record, and peak bytes while getting IDS.
+RETAINED_BYTES_PER_RECORD = 8000
+PEAK_BYTES = 4_000_000
+
+
+def _tind(**kwargs):
+    transport = ReplayTransport(ARCHIVE, **kwargs)
+    client = httpx.Client(transport = transport)
+    return Tind('https://caltech.tind.io', client = client), transport
+
+
+def _rate(count, func):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def test_replayed_values():
+    tind, transport = _tind()
+    record = tind.record(735973)
+    assert record.tind_id == '735973'
+    assert record.title   == 'Vector calculus'
+    assert record.author  == 'Jerrold E. Marsden, Anthony Tromba'
+    assert record.year    == '2012'
+    assert record.edition == '6th ed'
+    assert [i.barcode for i in record.items] == ['35047018228114', '35047019492099']
+    assert record.items[0].parent is record
+    item = tind.item(35047018228114)
+    assert item.call_number == 'QA303 .M338 2012'
+    assert item.location == 'SFL basement books'
+    assert item.parent.tind_id == '735973'
+    assert tind.record(1000).title == 'Vector calculus'
+    with pytest.raises(NotFound):
+        tind.record(99)
+    assert transport.hits['marc'] >= 2
+
+
+def test_record_throughput():
+    tind, transport = _tind()
+    rate = _rate(len(IDS), lambda: [tind.record(id) for id in IDS])
+    assert transport.hits['marc'] == len(IDS)
+    assert rate > RECORDS_PER_SECOND
+
+
+def test_item_throughput():
+    tind, transport = _tind()
+    barcodes = [f'3504701{id:05d}01' for id in IDS]
+    rate = _rate(len(IDS), lambda: [tind.item(b) for b in barcodes])
+    assert transport.hits['items'] == len(IDS)
+    assert rate > ITEMS_PER_SECOND
+
+
+def test_bulk_throughput():
+    tind, _ = _tind(latency = 0.01)
+    rate = _rate(len(IDS), lambda: list(tind.records(IDS, fetchers = 8,
+                                                     item_fetchers = 8)))
+    assert rate > BULK_RECORDS_PER_SECOND
+    tind, _ = _tind(latency = 0.01)
+    rate = _rate(len(IDS), lambda: tind.records_table(IDS, jobs = 8))
+    assert rate > BULK_RECORDS_PER_SECOND
+
+
+def test_allocation_budget():
+    tind, _ = _tind()
+    tind.record(IDS[0])
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        records = [tind.record(id) for id in IDS]
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(records) == len(IDS)
+    assert (current - before) / len(IDS) < RETAINED_BYTES_PER_RECORD
+    assert peak - before < PEAK_BYTES
+
+
+def test_record_and_replay(fake_tind, tmp_path):
+    from topi.replay import RecordingTransport
+    archive = str(tmp_path / 'archive.json.gz')
+    client = httpx.Client(transport = RecordingTransport(archive))
+    recorded = Tind(fake_tind.url, client = client).record(1234)
+    client.close()
+    count = fake_tind.count('marc')
+    replay = httpx.Client(transport = ReplayTransport(archive, strict = True))
+    tind = Tind(fake_tind.url, client = replay)
+    replayed = tind.record(1234)
+    assert replayed.title == recorded.title
+    assert [i.barcode for i in replayed.items] == [i.barcode for i in recorded.items]
+    assert fake_tind.count('marc') == count
@@ -0,0 +1,80 @@
+import pytest
+import time
+
+from topi import Tind, TindError, TindRecord
+
+
+def _wait_for(condition, limit = 5):
+    start = time.perf_counter()
+    while not condition() and time.perf_counter() - start < limit:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_fresh_hit(fake_tind):
+    tind = Tind(fake_tind.url, soft_ttl = 60)
+    record = tind.record(1001)
+    assert tind.record(1001) is record
+    assert tind.item(35047100101) is tind.item(35047100101)
+    assert fake_tind.count('marc') == 2
+    serving = tind.stats()['serving']
+    assert serving['fresh_hits'] == 2
+    assert serving['misses'] == 2
+
+
+def test_stale_hit_refreshes_once(fake_tind):
+    tind = Tind(fake_tind.url, soft_ttl = 0.1)
+    old = tind.record(1001)
+    time.sleep(0.15)
+    fake_tind.latency = 0.3
+    start = time.perf_counter()
+    for _ in range(5):
+        assert tind.record(1001) is old
+    assert time.perf_counter() - start < 0.2
+    assert _wait_for(lambda: tind.stats()['serving']['refreshes'] == 1)
+    fake_tind.latency = 0
+    new = tind.record(1001)
+    assert new is not old and new.tind_id == old.tind_id
+    serving = tind.stats()['serving']
+    assert serving['stale_hits'] == 5
+    assert serving['deduplicated'] == 4
+    assert serving['fresh_hits'] == 1
+    assert fake_tind.count('marc') == 2
+
+
+def test_failed_refresh_keeps_value(fake_tind):
+    tind = Tind(fake_tind.url, soft_ttl = 0.1, hard_ttl = 2)
+    old = tind.record(1001)
+    start = time.perf_counter()
+    fake_tind.server.shutdown()
+    fake_tind.server.server_close()
+    time.sleep(max(0, 0.15 - (time.perf_counter() - start)))
+    assert tind.record(1001) is old
+    assert _wait_for(lambda: tind.stats()['serving']['refresh_failures'] == 1)
+    assert tind.record(1001) is old
+    # After the hard TTL, the value is no longer served.
+    time.sleep(2 - (time.perf_counter() - start))
+    with pytest.raises(TindError):
+        tind.record(1001)
+
+
+def test_invalid_ttls(fake_tind):
+    with pytest.raises(ValueError):
+        Tind(fake_tind.url, soft_ttl = 10, hard_ttl = 5)
+    with pytest.raises(ValueError):
+        Tind(fake_tind.url, soft_ttl = 10, recent_cache_size = 0)
+
+
+def test_refreshes_do_not_delay_thumbnails(fake_tind):
+    tind = Tind(fake_tind.url, soft_ttl = 0.1)
+    records = [tind.record(id) for id in range(1000, 1020)]
+    time.sleep(0.15)
+    fake_tind.latency = 2
+    for id in range(1000, 1020):
+        tind.record(id)                 # Stale hits start refreshes.
+    fresh = [TindRecord(server_url = fake_tind.url, tind_id = str(id))
+             for id in range(3000, 3020)]
+    start = time.perf_counter()
+    tind.prefetch_thumbnails(fresh, timeout = 0.2)
+    assert time.perf_counter() - start < 0.6
+    assert all(r._saved_thumbnail_url is None for r in fresh)
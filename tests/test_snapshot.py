@@ -0,0 +1,81 @@
+import pytest
+import time
+
+from topi import Tind
+from topi.snapshot import Snapshot
+
+
+@pytest.fixture
+def snapshot_path(fake_tind, tmp_path):
+    path = str(tmp_path / 'hot.snap')
+    tind = Tind(fake_tind.url)
+    records = list(tind.records(range(1000, 1100)))
+    tind.prefetch_thumbnails(records)
+    assert tind.save_snapshot(path, records) == 100
+    return path
+
+
+def test_snapshot_lookup(fake_tind, snapshot_path):
+    with Snapshot(snapshot_path) as snapshot:
+        assert len(snapshot) == 100
+        assert '1042' in snapshot and '2000' not in snapshot
+        assert snapshot.tind_ids()[:2] == ['1000', '1001']
+        record = snapshot.record(1042)
+        assert record.title == 'Vector calculus 1042'
+        assert record.isbn_issn == ['1429215089']
+        assert record.tind_url == f'{fake_tind.url}/record/1042'
+        assert record.thumbnail_url == 'https://covers.example/1042.jpg'
+        assert [item.parent for item in record.items] == [record, record]
+        item = snapshot.item(35047104202)
+        assert item.description == 'c.2' and item.parent.tind_id == '1042'
+        assert snapshot.record(2000) is None
+        assert snapshot.item(35047200001) is None
+
+
+def test_tind_uses_snapshot(fake_tind, snapshot_path):
+    hits = fake_tind.count('marc')
+    tind = Tind(fake_tind.url)
+    tind.load_snapshot(snapshot_path)
+    assert tind.record(1010).title == 'Vector calculus 1010'
+    assert tind.item(35047101001).parent.tind_id == '1010'
+    assert fake_tind.count('marc') == hits
+    # Records not in the snapshot come from the server.
+    assert tind.record(2000).tind_id == '2000'
+    assert fake_tind.count('marc') == hits + 1
+    assert tind.stats()['serving']['snapshot_hits'] == 2
+
+
+def test_old_snapshot_is_revalidated(fake_tind, snapshot_path):
+    time.sleep(0.2)
+    hits = fake_tind.count('marc')
+    tind = Tind(fake_tind.url, soft_ttl = 0.1)
+    tind.load_snapshot(snapshot_path)
+    assert tind.record(1010).tind_id == '1010'
+    start = time.perf_counter()
+    while tind.stats()['serving']['refreshes'] < 1 and time.perf_counter() - start < 5:
+        time.sleep(0.01)
+    assert fake_tind.count('marc') == hits + 1
+    assert tind.stats()['serving']['stale_hits'] == 1
+
+
+def test_stale_index(snapshot_path):
+    with open(snapshot_path, 'ab') as f:
+        f.write(b'x')
+    with pytest.raises(ValueError):
+        Snapshot(snapshot_path)
+
+
+def test_snapshot_values_decoded_once(fake_tind, snapshot_path):
+    tind = Tind(fake_tind.url)
+    tind.load_snapshot(snapshot_path)
+    first = tind.record(1010)
+    assert tind.record(1010) is first
+    assert tind.stats()['serving']['snapshot_hits'] == 1
+    # Values fetched from TIND are not served from the recent cache.
+    hits = fake_tind.count('marc')
+    tind.record(2000)
+    tind.record(2000)
+    assert fake_tind.count('marc') == hits + 2
+    # Nor are values from a snapshot that has been removed.
+    tind.load_snapshot(None)
+    assert tind.record(1010) is not first
@@ -0,0 +1,57 @@
+import pytest
+
+from topi import Tind, TindTable, NotFound
+from topi.table import RECORD_COLUMNS, ITEM_COLUMNS
+
+
+def test_records_table(fake_tind):
+    tind = Tind(fake_tind.url)
+    table = tind.records_table([1001, 1002, 99, 1003], jobs = 2)
+    assert isinstance(table, TindTable)
+    assert len(table) == 3
+    assert table.records['tind_id'] == ['1001', '1002', '1003']
+    assert table.records['title'][1] == 'Vector calculus 1002'
+    assert table.records['isbn_issn'][0] == ['1429215089']
+    assert table.records['tind_url'][2] == f'{fake_tind.url}/record/1003'
+    assert len(table.items['barcode']) == 6
+    assert table.items['tind_id'] == ['1001', '1001', '1002', '1002', '1003', '1003']
+    assert table.items['barcode'][:2] == ['35047100101', '35047100102']
+    assert isinstance(table.failures['99'], NotFound)
+
+
+def test_table_matches_records(fake_tind):
+    tind = Tind(fake_tind.url)
+    table = tind.records_table([1004])
+    record = tind.record(1004)
+    for column in RECORD_COLUMNS:
+        assert table.records[column][0] == getattr(record, column)
+    for column in ITEM_COLUMNS[1:]:
+        assert table.items[column] == [getattr(i, column) for i in record.items]
+
+
+def test_to_arrow(fake_tind, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = Tind(fake_tind.url).records_table([1001, 1002])
+    records, items = table.to_arrow()
+    assert records.num_rows == 2 and items.num_rows == 4
+    table.to_parquet(tmp_path / 'records.parquet', tmp_path / 'items.parquet')
+    assert pq.read_table(tmp_path / 'items.parquet').column('tind_id').to_pylist() \
+        == ['1001', '1001', '1002', '1002']
+
+
+def test_to_numpy(fake_tind):
+    pytest.importorskip('numpy')
+    records, items = Tind(fake_tind.url).records_table([1001]).to_numpy()
+    assert records['isbn_issn'][0] == '1429215089'
+    assert list(items['barcode']) == ['35047100101', '35047100102']
+
+
+def test_blank_records_cached(fake_tind):
+    fake_tind.blank.add('1002')
+    tind = Tind(fake_tind.url)
+    table = tind.records_table([1001, 1002])
+    assert len(table) == 2
+    count = fake_tind.count('marc')
+    record = tind.record(1002)
+    assert record.title is None or not record.tind_id
+    assert fake_tind.count('marc') == count
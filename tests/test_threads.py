@@ -0,0 +1,44 @@
+import time
+from   concurrent.futures import ThreadPoolExecutor
+
+import topi.tind_utils
+from   topi import Tind, TindRecord
+
+
+def _throughput(tind, ids, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        records = list(executor.map(tind.record, ids))
+    assert [r.tind_id for r in records] == [str(id) for id in ids]
+    return len(ids) / (time.perf_counter() - start)
+
+
+def test_throughput_scales_with_threads(fake_tind):
+    fake_tind.latency = 0.02
+    tind = Tind(fake_tind.url)
+    one = _throughput(tind, range(1000, 1020), 1)
+    eight = _throughput(tind, range(2000, 2080), 8)
+    assert eight > 4 * one
+
+
+def test_shared_thumbnail_lookup(fake_tind):
+    fake_tind.latency = 0.1
+    record = TindRecord(server_url = fake_tind.url, tind_id = '4000')
+    with ThreadPoolExecutor(8) as executor:
+        urls = list(executor.map(lambda _: record.thumbnail_url, range(8)))
+    assert urls == ['https://covers.example/4000.jpg'] * 8
+    assert fake_tind.count('thumbnail') == 1
+
+
+def test_coordinated_rate_limit(fake_tind, monkeypatch):
+    monkeypatch.setattr(topi.tind_utils, '_RATE_LIMIT_SLEEP', 0.3)
+    fake_tind.latency = 0.02
+    fake_tind.throttle = 8
+    tind = Tind(fake_tind.url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(8) as executor:
+        records = list(executor.map(tind.record, range(1000, 1016)))
+    assert len(records) == 16
+    gate = topi.tind_utils.rate_limit_gate(fake_tind.url)
+    assert gate.closures == 1
+    assert 0.3 < time.perf_counter() - start < 1.5
@@ -0,0 +1,31 @@
+from topi import Tind, TindRecord
+
+
+def test_prefetch_thumbnails(fake_tind):
+    tind = Tind(fake_tind.url)
+    records = [TindRecord(server_url = fake_tind.url, tind_id = str(id))
+               for id in range(2000, 2010)]
+    tind.prefetch_thumbnails(records)
+    assert fake_tind.count('thumbnail') == 10
+    assert records[0].thumbnail_url == 'https://covers.example/2000.jpg'
+    assert records[1].thumbnail_url == ''
+    assert fake_tind.count('thumbnail') == 10
+
+
+def test_no_thumbnail_is_shared(fake_tind):
+    first = TindRecord(server_url = fake_tind.url, tind_id = '2101')
+    second = TindRecord(server_url = fake_tind.url, tind_id = '2101')
+    assert first.thumbnail_url == ''
+    assert second.thumbnail_url == ''
+    assert fake_tind.count('thumbnail') == 1
+
+
+def test_thumbnails_flag(fake_tind):
+    tind = Tind(fake_tind.url)
+    record = tind.record(2200, thumbnails = True)
+    assert record._saved_thumbnail_url == 'https://covers.example/2200.jpg'
+    item = tind.item(35047220301, thumbnails = True)
+    assert item.parent._saved_thumbnail_url == ''
+    records = list(tind.records([2300, 2302], thumbnails = True))
+    assert all(r._saved_thumbnail_url for r in records)
+    assert fake_tind.count('thumbnail') == 4
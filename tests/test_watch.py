@@ -0,0 +1,51 @@
+import pytest
+
+from topi import Tind
+
+
+def test_watch_items(fake_tind):
+    tind = Tind(fake_tind.url)
+    seen = []
+    watcher = tind.watch_items([1001, 1002], callback = seen.append,
+                               min_interval = 0, max_interval = 10, backoff = 2)
+    assert watcher.poll() == []         # Baseline.
+    assert watcher.poll() == []         # Unchanged; response not parsed.
+    assert watcher.stats()['unchanged'] == 4
+
+    fake_tind.status['1001'] = 'checked out'
+    changes = watcher.poll()
+    assert len(changes) == 1
+    change = changes[0]
+    assert change.tind_id == '1001'
+    assert change.barcode == '35047100101'
+    assert change.kind == 'changed'
+    assert change.fields == ('status',)
+    assert change.old.status == 'on shelf'
+    assert change.new.status == 'checked out'
+    assert seen == changes
+    assert watcher.stats()['intervals']['1001'] == 0
+
+
+def test_watch_iteration_and_backoff(fake_tind):
+    tind = Tind(fake_tind.url)
+    watcher = tind.watch_items([1001], min_interval = 0.01, max_interval = 0.04)
+    watcher.poll()
+    polls = fake_tind.count('items')
+    fake_tind.status['1001'] = 'in transit'
+    for change in watcher:
+        assert change.new.status == 'in transit'
+        watcher.stop()
+    assert fake_tind.count('items') > polls
+    assert watcher.stats()['intervals']['1001'] == 0.01
+
+
+def test_watch_threads_reused(fake_tind):
+    tind = Tind(fake_tind.url)
+    with tind.watch_items(range(1001, 1005), min_interval = 0) as watcher:
+        watcher.poll()
+        threads = set(watcher._executor._threads)
+        watcher.poll()
+        assert set(watcher._executor._threads) == threads
+    assert all(not thread.is_alive() for thread in threads)
+    with pytest.raises(ValueError):
+        watcher.poll()
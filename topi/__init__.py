@@ -31,16 +31,42 @@ __license__     = 'BSD 3-clause'
 
 # Exports.
 # .............................................................................
+# The classes are imported from their modules the first time they are used,
+# not when this package is imported.  This keeps "import topi" fast for short
+# programs, by not loading lxml, commonpy and other dependencies until a code
+# path that needs them first runs.  (See PEP 562 for how this works.)
 
-from .exceptions import TindError, DataMismatchError, NotFound
-from .item       import TindItem
-from .record     import TindRecord
-from .tind       import Tind
+from .exceptions import TindError, DataMismatchError, NotFound, TimedOut
+
+_LAZY_EXPORTS = {
+    'Tind'         : '.tind',
+    'TindRecord'   : '.record',
+    'TindItem'     : '.item',
+    'TindPipeline' : '.pipeline',
+    'ItemWatcher'  : '.watch',
+    'ItemChange'   : '.watch',
+    'TindTable'    : '.table',
+    'TindPool'     : '.pool',
+}
+
+__all__ = ['Tind', 'TindRecord', 'TindItem', 'TindPipeline',
+           'ItemWatcher', 'ItemChange', 'TindTable', 'TindPool',
+           'TindError', 'DataMismatchError', 'NotFound', 'TimedOut']
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        from importlib import import_module
+        value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_EXPORTS))
 
-__all__ = ['Tind', 'TindRecord', 'TindItem',
-           'TindError', 'DataMismatchError', 'NotFound']
 
-
 # Miscellaneous utilities.
 # .............................................................................
 
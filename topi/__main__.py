@@ -0,0 +1,326 @@
+'''
+__main__.py: command-line interface for Topi
+
+The "topi" command retrieves records or items in bulk from a TIND server and
+writes the results as JSON Lines or CSV.  It has two subcommands:
+
+  topi fetch   one output line per record (or per item, if given barcodes),
+               with nested values for items and parent records
+  topi export  one flat output row per item, combining the item's fields
+               with the fields of the record it belongs to
+
+Identifiers are read one per line from a file or from standard input.
+Retrieval uses a TindPipeline with a configurable number of parallel jobs and
+an optional limit on the request rate.  With --adaptive, the number of
+requests in progress is adjusted to what the server can handle, up to the
+number of jobs (default 32 in that case).  If a checkpoint file is given, every
+identifier that has been completed is appended to it, and a later run with
+the same checkpoint file skips those identifiers and appends to the output.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+from   time import perf_counter
+
+import topi
+from   topi import Tind, NotFound
+from   topi.tind import _is_blank
+
+
+# Internal constants.
+# .............................................................................
+
+# Minimum time in seconds between updates of the progress line.
+_PROGRESS_INTERVAL = 0.5
+
+_RECORD_COLUMNS = ['tind_id', 'tind_url', 'title', 'subtitle', 'author',
+                   'edition', 'publisher', 'year', 'isbn_issn', 'description',
+                   'bib_note', 'thumbnail_url']
+
+_ITEM_COLUMNS = ['barcode', 'type', 'volume', 'call_number', 'description',
+                 'library', 'location', 'status']
+
+
+# Main entry point.
+# .............................................................................
+
+def main(argv = None):
+    '''Run the "topi" command with the arguments in "argv".'''
+    args = _parser().parse_args(argv)
+    if args.version:
+        topi.print_version()
+        return 0
+    if not args.command:
+        _parser().print_help(sys.stderr)
+        return 2
+    if not args.server:
+        print('topi: a server URL must be given using --server', file = sys.stderr)
+        return 2
+
+    done = _read_checkpoint(args.checkpoint)
+    ids = (id for id in _read_ids(args.input) if id not in done)
+    fmt = args.format or ('jsonl' if args.command == 'fetch' else 'csv')
+    resuming = bool(done) and args.output != '-'
+    out = _open_output(args.output, append = resuming)
+    checkpoint = open(args.checkpoint, 'a') if args.checkpoint else None
+    writer = _Writer(out, fmt, args.command, args.barcodes,
+                     write_header = not (resuming and os.path.getsize(args.output)))
+    progress = _Progress(enabled = not args.quiet and sys.stderr.isatty())
+
+    if args.adaptive:
+        # The workers wait for the adaptive limit, which stays below --jobs.
+        tind = Tind(args.server, max_rate = args.rate, adaptive_concurrency = True,
+                    max_concurrency = args.jobs)
+        pipeline = tind.pipeline(thumbnails = args.thumbnails)
+    else:
+        tind = Tind(args.server, max_rate = args.rate)
+        jobs = args.jobs or 4
+        pipeline = tind.pipeline(fetchers = jobs, item_fetchers = jobs,
+                                 thumbnails = args.thumbnails)
+    # The ids are paired with the results so that the checkpoint records the
+    # ids as they were given, which can differ from the parsed values.
+    if args.barcodes:
+        results = pipeline.items(ids, with_ids = True)
+    else:
+        results = pipeline.records(ids, with_ids = True)
+    # Records that TIND returns blank are reported like ids that don't exist.
+    blank = {}
+    interrupted = False
+    try:
+        for id, result in results:
+            if not args.barcodes and _is_blank(result):
+                blank[id] = NotFound(f'Record {id} is blank in {args.server}')
+            else:
+                writer.write(result)
+                out.flush()
+            if checkpoint:
+                checkpoint.write(id + '\n')
+                checkpoint.flush()
+            progress.update(writer.count, len(pipeline.failures) + len(blank))
+    except KeyboardInterrupt:
+        interrupted = True
+        results.close()
+    finally:
+        progress.finish()
+        failures = {**pipeline.failures, **blank}
+        # Ids that don't exist are done too; don't retry them on resumption.
+        # (Blank records have been written to the checkpoint already.)
+        for id, error in failures.items():
+            if isinstance(error, NotFound) and checkpoint and id not in blank:
+                checkpoint.write(id + '\n')
+            if not args.quiet:
+                print(f'topi: {id}: {error}', file = sys.stderr)
+        if checkpoint:
+            checkpoint.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if not args.quiet:
+        elapsed = pipeline.stats()['elapsed']
+        rate = (writer.count / elapsed) if elapsed else 0
+        kind = 'items' if args.barcodes else 'records'
+        print(f'topi: retrieved {writer.count} {kind} ({len(failures)}'
+              f' failed) in {elapsed:.1f} s ({rate:.1f} {kind}/s)', file = sys.stderr)
+        if args.adaptive:
+            limit = tind.stats()['concurrency']
+            print(f'topi: concurrency limit ended at {limit["limit"]} after'
+                  f' {limit["increases"]} increases, {limit["decreases"]} decreases'
+                  f' and {limit["backoffs"]} backoffs', file = sys.stderr)
+        if interrupted and args.checkpoint:
+            print(f'topi: interrupted; rerun with --checkpoint {args.checkpoint}'
+                  ' to resume', file = sys.stderr)
+    if interrupted:
+        return 130
+    return 1 if failures else 0
+
+
+def console_scripts_main():
+    '''Entry point for the "topi" console script created by setuptools.'''
+    sys.exit(main())
+
+
+# Helper functions.
+# .............................................................................
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog = 'topi', description = 'Retrieve records or items from a TIND server.')
+    parser.add_argument('-V', '--version', action = 'store_true',
+                        help = 'print version information and exit')
+    commands = parser.add_subparsers(dest = 'command', metavar = 'COMMAND')
+    for name, text in [('fetch', 'write one JSON object (or CSV row) per record'),
+                       ('export', 'write one CSV row (or JSON object) per item')]:
+        cmd = commands.add_parser(name, help = text, description = text)
+        cmd.add_argument('-s', '--server', metavar = 'URL',
+                         default = os.environ.get('TOPI_SERVER'),
+                         help = 'base URL of the TIND server (default: $TOPI_SERVER)')
+        cmd.add_argument('-i', '--input', default = '-', metavar = 'FILE',
+                         help = 'file of identifiers, one per line (default: stdin)')
+        cmd.add_argument('-o', '--output', default = '-', metavar = 'FILE',
+                         help = 'file to write (default: stdout)')
+        cmd.add_argument('-b', '--barcodes', action = 'store_true',
+                         help = 'the identifiers are item barcodes, not TIND ids')
+        cmd.add_argument('-f', '--format', choices = ['jsonl', 'csv'],
+                         help = 'output format (default: jsonl for fetch, csv for export)')
+        cmd.add_argument('-j', '--jobs', type = _positive_int,
+                         help = 'number of parallel network requests per stage'
+                         ' (default: 4, or 32 with --adaptive)')
+        cmd.add_argument('-a', '--adaptive', action = 'store_true',
+                         help = 'adjust the number of parallel requests to the server')
+        cmd.add_argument('-r', '--rate', type = _positive_float, metavar = 'N',
+                         help = 'maximum number of requests per second')
+        cmd.add_argument('-t', '--thumbnails', action = 'store_true',
+                         help = 'also get the thumbnail URL of every record')
+        cmd.add_argument('-c', '--checkpoint', metavar = 'FILE',
+                         help = 'record completed identifiers here; resume from it')
+        cmd.add_argument('-q', '--quiet', action = 'store_true',
+                         help = 'do not print progress, errors or a summary')
+    return parser
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
+
+
+def _positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return number
+
+
+def _read_ids(path):
+    source = sys.stdin if path == '-' else open(path, 'r')
+    try:
+        for line in source:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def _read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def _open_output(path, append = False):
+    if path == '-':
+        return sys.stdout
+    return open(path, 'a' if append else 'w', newline = '')
+
+
+class _Writer():
+    '''Write results in JSON Lines or CSV format, shaped for the command.'''
+
+    def __init__(self, out, fmt, command, barcodes, write_header = True):
+        self.count = 0
+        self._out = out
+        self._fmt = fmt
+        self._flat = (command == 'export')
+        self._barcodes = barcodes
+        self._csv = None
+        if fmt == 'csv':
+            if self._flat or barcodes:
+                columns = _RECORD_COLUMNS + ['item_' + c for c in _ITEM_COLUMNS]
+            else:
+                columns = _RECORD_COLUMNS + ['items']
+            self._csv = csv.DictWriter(out, fieldnames = columns)
+            if write_header:
+                self._csv.writeheader()
+
+
+    def write(self, result):
+        self.count += 1
+        for row in self._rows(result):
+            if self._csv:
+                self._csv.writerow({k: _flattened(v) for k, v in row.items()})
+            else:
+                self._out.write(json.dumps(row, ensure_ascii = False) + '\n')
+
+
+    def _rows(self, result):
+        if self._barcodes:
+            item = result.as_dict()
+            record = result.parent.as_dict()
+            del record['items']
+            if self._flat or self._csv:
+                yield _joined(record, item)
+            else:
+                item['parent'] = record
+                yield item
+        elif self._flat:
+            record = result.as_dict()
+            items = record.pop('items')
+            for item in (items or [{}]):
+                yield _joined(record, item)
+        else:
+            record = result.as_dict()
+            if self._csv:
+                record['items'] = [item['barcode'] for item in record['items']]
+            yield record
+
+
+def _joined(record, item):
+    row = dict(record)
+    for column in _ITEM_COLUMNS:
+        row['item_' + column] = item.get(column, '')
+    return row
+
+
+def _flattened(value):
+    if isinstance(value, list):
+        return ';'.join(str(v) for v in value)
+    return '' if value is None else value
+
+
+class _Progress():
+    '''Show a one-line progress indicator on the terminal.'''
+
+    def __init__(self, enabled = True):
+        self._enabled = enabled
+        self._start = perf_counter()
+        self._last = 0
+        self._shown = False
+
+    def update(self, done, failed):
+        if not self._enabled:
+            return
+        now = perf_counter()
+        if now - self._last < _PROGRESS_INTERVAL:
+            return
+        self._last = now
+        rate = done / (now - self._start)
+        sys.stderr.write(f'\r{done} done, {failed} failed, {rate:.1f}/s ')
+        sys.stderr.flush()
+        self._shown = True
+
+    def finish(self):
+        if self._shown:
+            sys.stderr.write('\n')
+
+
+if __name__ == '__main__':
+    console_scripts_main()
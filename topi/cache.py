@@ -0,0 +1,118 @@
+'''
+cache.py: bounded in-memory caches used by Topi
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import OrderedDict
+from   threading import Lock
+from   time import monotonic
+
+
+# Class definitions.
+# .............................................................................
+
+class TTLCache():
+    '''A bounded, thread-safe cache whose entries expire after a time.
+
+    The cache holds at most "maxsize" entries; when it is full, adding an
+    entry evicts the least recently used one.  Entries expire "ttl" seconds
+    after they are stored, unless a different time is given to set().  A
+    "ttl" of None means entries never expire.  The cache counts hits,
+    misses, evictions and expirations; stats() returns the counts.
+    '''
+
+    def __init__(self, maxsize = 1024, ttl = None):
+        if maxsize < 1:
+            raise ValueError('Cache size must be at least 1.')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+
+    def get(self, key, default = None):
+        '''Return the value for "key", or "default" if it's absent or expired.'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > monotonic():
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._data[key]
+                self._expirations += 1
+            self._misses += 1
+            return default
+
+
+    def set(self, key, value, ttl = None):
+        '''Store "value" under "key", to expire after "ttl" (or the default).'''
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+                self._evictions += 1
+
+
+    def resize(self, maxsize):
+        '''Change the maximum size, evicting entries if there are too many.'''
+        if maxsize < 1:
+            raise ValueError('Cache size must be at least 1.')
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+                self._evictions += 1
+
+
+    def discard(self, key):
+        '''Remove the entry for "key", if there is one.'''
+        with self._lock:
+            self._data.pop(key, None)
+
+
+    def clear(self):
+        '''Remove all entries.'''
+        with self._lock:
+            self._data.clear()
+
+
+    def stats(self):
+        '''Return a dictionary of the size of the cache and its counters.'''
+        with self._lock:
+            return {'size'        : len(self._data),
+                    'maxsize'     : self.maxsize,
+                    'hits'        : self._hits,
+                    'misses'      : self._misses,
+                    'evictions'   : self._evictions,
+                    'expirations' : self._expirations}
+
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > monotonic())
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
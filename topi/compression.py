@@ -0,0 +1,83 @@
+'''
+compression.py: compact in-memory storage of MARC XML
+
+MARC XML records returned by TIND repeat the same element names, attribute
+names and namespace declaration many times, and every record starts with the
+same preamble.  Compressing a record on its own with zlib leaves much of that
+redundancy in place, because each record is too short for the compressor to
+learn it.  The functions in this module compress records using a preset
+dictionary of the strings that are common to MARC XML records, which makes
+the compressed form of a typical record several times smaller than the
+original.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import zlib
+
+
+# Internal constants.
+# .............................................................................
+
+# Tags of the MARC data fields that occur most often in TIND records.  The
+# ones that occur most often are last, because zlib encodes matches with the
+# end of the dictionary most compactly.
+_COMMON_TAGS = ['998', '980', '948', '909', '907', '856', '830', '740', '690',
+                '505', '520', '490', '338', '337', '336', '264', '082', '049',
+                '040', '035', '019', '016', '015', '010', '700', '650', '504',
+                '300', '260', '250', '245', '100', '050', '020']
+
+
+def _dictionary():
+    parts = ['<datafield tag="{}" ind1=" " ind2=" ">\n    <subfield code="a">'
+             .format(tag) for tag in _COMMON_TAGS]
+    parts += ['<datafield tag="245" ind1="1" ind2="0">\n',
+              '<datafield tag="650" ind1=" " ind2="0">\n',
+              '<datafield tag="100" ind1="1" ind2=" ">\n',
+              '<datafield tag="909" ind1="C" ind2="O">\n',
+              '    <subfield code="o">oai:caltech.tind.io:',
+              '    <subfield code="p">caltech:bibliographic</subfield>\n',
+              '<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<collection xmlns="http://www.loc.gov/MARC21/slim">\n<record>\n'
+              '  <controlfield tag="000">',
+              '</controlfield>\n  <controlfield tag="001">',
+              '</controlfield>\n  <controlfield tag="005">',
+              '</controlfield>\n  <controlfield tag="008">',
+              '</subfield>\n  </datafield>\n</record>\n</collection>',
+              '</subfield>\n    <subfield code="c">',
+              '</subfield>\n    <subfield code="b">',
+              '</subfield>\n  </datafield>\n  <datafield tag="',
+              '" ind1=" " ind2=" ">\n    <subfield code="a">']
+    return ''.join(parts).encode()
+
+# The preset dictionary.  Changing it makes data compressed with the old
+# dictionary unreadable, so compressed data must not be kept across versions.
+MARC_DICTIONARY = _dictionary()
+
+# Compression level; level 6 is zlib's default tradeoff of speed and size.
+_LEVEL = 6
+
+
+# Exported functions.
+# .............................................................................
+
+def compress_marc(xml):
+    '''Return the bytes "xml" compressed using the MARC preset dictionary.'''
+    compressor = zlib.compressobj(_LEVEL, zdict = MARC_DICTIONARY)
+    return compressor.compress(xml) + compressor.flush()
+
+
+def decompress_marc(data):
+    '''Return the original bytes given the result of compress_marc().'''
+    decompressor = zlib.decompressobj(zdict = MARC_DICTIONARY)
+    return decompressor.decompress(data) + decompressor.flush()
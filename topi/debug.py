@@ -0,0 +1,41 @@
+'''
+debug.py: debug logging for Topi without importing Sidetrack up front
+
+Topi uses Sidetrack for debug logging, but importing Sidetrack takes a
+noticeable amount of time compared to the rest of Topi.  Debug logging can
+only be turned on by a program that has imported Sidetrack itself (to call
+its set_debug() function), so there is no need for Topi to import it: the
+log() function here writes a message only if Sidetrack is already loaded
+and debugging has been turned on.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import sys
+
+
+# Exported functions.
+# .............................................................................
+
+def log(msg):
+    '''Log the debug message "msg" if Sidetrack debugging is turned on.'''
+    sidetrack = sys.modules.get('sidetrack')
+    if sidetrack is None or not getattr(sidetrack, '_debugging', False):
+        return
+    # Use Sidetrack's internal writer if possible, so that the log shows the
+    # file, line and function of our caller rather than of this function.
+    writer = getattr(sys.modules.get('sidetrack.debug'), '__write_log', None)
+    if writer:
+        writer(msg, sys._getframe(1))
+    else:
+        sidetrack.log(msg)
@@ -32,6 +32,10 @@ class TindError(TopiException):
     '''Unrecoverable problem involving interactions with the TIND server.'''
     pass
 
+class TimedOut(TindError):
+    '''The TIND server did not respond within the time allowed.'''
+    pass
+
 class DataMismatchError(TopiException):
     '''Unrecoverable problem involving Topi.'''
     pass
@@ -0,0 +1,364 @@
+'''
+pipeline.py: staged, overlapped bulk retrieval of records from TIND
+
+Retrieving a record from TIND involves four steps that are done one after
+the other by Tind.record(): download the MARC XML, parse it, download the
+item data for the record, and assemble the TindRecord and TindItem objects.
+The TindPipeline class in this module runs each of those steps in its own
+stage of worker threads.  The stages are connected by bounded queues, so that
+(for example) the network I/O for record N+1 overlaps with the parsing of
+record N, and a slow downstream stage makes the upstream stages wait instead
+of piling up results in memory.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   queue import Queue, Empty, Full
+from   threading import Thread, Event, Lock
+from   time import perf_counter
+
+if __debug__:
+    from .debug import log
+
+from .exceptions import NotFound, DataMismatchError
+from .tind import _MARCXML_FOR_BARCODE, _MARCXML_FOR_TIND_ID, _NOT_FOUND, _is_blank
+
+
+# Internal constants.
+# .............................................................................
+
+# Marker placed in a queue to tell the workers of a stage to finish.
+_DONE = object()
+
+# How often (in seconds) blocked workers wake up to check for cancellation.
+_POLL_INTERVAL = 0.1
+
+
+# Class definitions.
+# .............................................................................
+
+class TindPipeline():
+    '''Pipelined bulk retrieval of TindRecord and TindItem objects.
+
+    The pipeline has four stages: "fetch" (download MARC XML), "parse"
+    (create a TindRecord from the XML), "items" (download the item data for
+    the record) and "assemble" (create the TindItem objects and attach them
+    to the record).  The number of worker threads in the network-bound
+    stages and the size of the queues between stages can be set using the
+    constructor arguments.  A pipeline object can be run more than once;
+    the statistics returned by stats() describe the most recent run.
+    '''
+
+    def __init__(self, tind, fetchers = None, parsers = 1, item_fetchers = None,
+                 queue_size = 16, thumbnails = False):
+        '''Create a pipeline that uses the Tind interface object "tind".
+
+        The default number of workers in each of the "fetch" and "items"
+        stages is 4, or if "tind" uses adaptive concurrency, the highest
+        limit it can reach, so that the limit decides how many requests are
+        made at a time.  If "thumbnails" is True, the "items" stage also
+        obtains the thumbnail URL of every record (see
+        Tind.prefetch_thumbnails()).
+        '''
+        if fetchers is None:
+            fetchers = tind._bulk_workers()
+        if item_fetchers is None:
+            item_fetchers = tind._bulk_workers()
+        if min(fetchers, parsers, item_fetchers, queue_size) < 1:
+            raise ValueError('Worker counts and queue size must be at least 1.')
+        self._tind = tind
+        self._workers = {'fetch'    : fetchers,
+                         'parse'    : parsers,
+                         'items'    : item_fetchers,
+                         'assemble' : 1}
+        self._queue_size = queue_size
+        self._thumbnails = thumbnails
+        self._stop = Event()
+        self._stages = {}
+        self._queues = {}
+        self._start_time = None
+        self._end_time = None
+        # Exceptions for ids that could not be retrieved, keyed by the id.
+        self.failures = {}
+
+
+    def records(self, tind_ids, with_ids = False):
+        '''Yield TindRecord objects for the TIND record ids in "tind_ids".
+
+        Records are produced in the order they finish, which is not
+        necessarily the order of "tind_ids".  The retrieval starts when the
+        first record is requested from the generator returned.  Ids that
+        cannot be retrieved are skipped; the exception for each is stored in
+        the "failures" dictionary of this pipeline object, keyed by the id.
+        If "with_ids" is True, the values produced are pairs of the id as
+        given in "tind_ids" (converted to a string) and the record.
+        '''
+        return self._run(tind_ids, by_barcode = False, with_ids = with_ids)
+
+
+    def items(self, barcodes, with_ids = False):
+        '''Yield TindItem objects for the barcodes in "barcodes".
+
+        This behaves like records(), except that the inputs are item barcodes
+        and the values produced are the TindItem objects whose "parent" field
+        points to the TindRecord containing them.
+        '''
+        return self._run(barcodes, by_barcode = True, with_ids = with_ids)
+
+
+    def stats(self):
+        '''Return a dictionary of statistics about the most recent run.
+
+        The dictionary has two keys, "stages" and "queues".  For each stage
+        of the pipeline, "stages" gives the number of workers, the number of
+        jobs processed and failed, the total time spent working, the
+        throughput in jobs per second of elapsed time, and the utilization
+        (the fraction of the available worker time spent working).  For each
+        queue, "queues" gives the capacity, the current depth and the maximum
+        depth observed.  A stage whose queue is frequently full is a
+        bottleneck; one whose input queue is always empty has too many
+        workers.
+        '''
+        end = self._end_time or perf_counter()
+        elapsed = (end - self._start_time) if self._start_time else 0
+        stages = {}
+        for name, stage in self._stages.items():
+            stages[name] = stage.summary(elapsed)
+        queues = {}
+        for name, queue in self._queues.items():
+            queues[name] = {'capacity'  : queue.maxsize,
+                            'depth'     : queue.qsize(),
+                            'max_depth' : queue.max_depth}
+        return {'elapsed': elapsed, 'stages': stages, 'queues': queues}
+
+
+    def cancel(self):
+        '''Stop a run that is in progress.'''
+        self._stop.set()
+
+
+    # Internal methods.
+    # .........................................................................
+
+    def _run(self, ids, by_barcode, with_ids = False):
+        # This is a generator, so that no threads are started until the
+        # caller asks for the first result.  A generator that is dropped
+        # before then has nothing to shut down.
+        self._stop.clear()
+        self.failures = {}
+        self._start_time = perf_counter()
+        self._end_time = None
+        self._queues = {name: _Queue(self._queue_size)
+                        for name in ['input', 'fetched', 'parsed', 'items', 'output']}
+        self._stages = {name: _Stage(name, count)
+                        for name, count in self._workers.items()}
+        q = self._queues
+        stage_plan = [('fetch',    q['input'],   q['fetched'], self._fetch,    'parse'),
+                      ('parse',    q['fetched'], q['parsed'],  self._parse,    'items'),
+                      ('items',    q['parsed'],  q['items'],   self._get_items, 'assemble'),
+                      ('assemble', q['items'],   q['output'],  self._assemble, None)]
+        threads = [Thread(target = self._feed, args = (ids, by_barcode), daemon = True)]
+        for name, inbox, outbox, func, next_stage in stage_plan:
+            downstream = self._workers[next_stage] if next_stage else 1
+            for _ in range(self._workers[name]):
+                args = (self._stages[name], func, inbox, outbox, downstream)
+                threads.append(Thread(target = self._work, args = args, daemon = True))
+        if __debug__: log(f'starting pipeline with {len(threads)} threads')
+        for thread in threads:
+            thread.start()
+        yield from self._results(threads, with_ids)
+
+
+    def _results(self, threads, with_ids):
+        try:
+            while True:
+                result = self._get(self._queues['output'])
+                if result is _DONE or result is None:
+                    break
+                yield result if with_ids else result[1]
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._end_time = perf_counter()
+            if __debug__: log(f'pipeline finished; {len(self.failures)} failures')
+
+
+    def _feed(self, ids, by_barcode):
+        inbox = self._queues['input']
+        try:
+            for id in ids:
+                if not self._put(inbox, _Job(str(id), by_barcode)):
+                    return
+        finally:
+            for _ in range(self._workers['fetch']):
+                self._put(inbox, _DONE)
+
+
+    def _work(self, stage, func, inbox, outbox, downstream):
+        while True:
+            job = self._get(inbox)
+            if job is _DONE or job is None:
+                break
+            start = perf_counter()
+            try:
+                result = func(job)
+            except Exception as ex:
+                if __debug__: log(f'pipeline stage {stage.name} failed on {job.id}: {ex}')
+                self.failures[job.id] = ex
+                result = None
+            stage.count(perf_counter() - start, failed = result is None)
+            if result is not None and not self._put(outbox, result):
+                break
+        if stage.finish():
+            for _ in range(downstream):
+                self._put(outbox, _DONE)
+
+
+    def _get(self, queue):
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout = _POLL_INTERVAL)
+            except Empty:
+                continue
+        return None
+
+
+    def _put(self, queue, value):
+        while not self._stop.is_set():
+            try:
+                queue.put(value, timeout = _POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+
+    # Stage functions.  Each takes a _Job and returns it, or raises an error.
+
+    def _fetch(self, job):
+        if not job.id.isdigit():
+            raise ValueError(f'Invalid argument: {job.id} is not a number.')
+        # The negative cache is shared with Tind.record() and Tind.item().
+        cached = self._tind._negative_lookup(job.kind, job.id)
+        if cached is not None:
+            job.record = cached
+            return job
+        template = _MARCXML_FOR_BARCODE if job.by_barcode else _MARCXML_FOR_TIND_ID
+        job.xml = self._tind._marc_from_server(template, job.id)
+        if not job.xml:
+            self._tind._remember_missing(job.kind, job.id, _NOT_FOUND)
+            raise NotFound(f'No record found for {job.id} in {self._tind.server_url}')
+        return job
+
+
+    def _parse(self, job):
+        if not job.record:
+            job.record = self._tind._record_from_xml(job.xml)
+        return job
+
+
+    def _get_items(self, job):
+        if job.xml is None:             # Record came from the negative cache.
+            return job
+        tind_id = job.record.tind_id if job.by_barcode else job.id
+        job.items_json = self._tind._items_json_for_tind_id(tind_id)
+        if self._thumbnails:
+            self._tind.prefetch_thumbnails([job.record])
+        return job
+
+
+    def _assemble(self, job):
+        # The output is paired with the id, as given, for _results().
+        return job.id, self._assembled(job)
+
+
+    def _assembled(self, job):
+        record = job.record
+        if job.xml is None:
+            return record
+        record.items = self._tind._items_from_json(job.items_json)
+        for item in record.items:
+            item.parent = record
+        if not job.by_barcode:
+            if _is_blank(record):
+                self._tind._remember_missing(job.kind, job.id, record)
+            return record
+        for item in record.items:
+            if item.barcode == job.id:
+                return item
+        raise DataMismatchError('Unable to match item to record from TIND.')
+
+
+# Internal helper classes.
+# .............................................................................
+
+class _Job():
+    '''The unit of work that moves through the stages of the pipeline.'''
+    __slots__ = ('id', 'by_barcode', 'kind', 'xml', 'record', 'items_json')
+
+    def __init__(self, id, by_barcode):
+        self.id = id
+        self.by_barcode = by_barcode
+        self.kind = 'barcode' if by_barcode else 'tind_id'
+        self.xml = None
+        self.record = None
+        self.items_json = None
+
+
+class _Queue(Queue):
+    '''A bounded queue that remembers the largest depth it has reached.'''
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.max_depth = 0
+
+    def _put(self, item):
+        # Called by Queue.put() with the queue's lock held.
+        super()._put(item)
+        self.max_depth = max(self.max_depth, len(self.queue))
+
+
+class _Stage():
+    '''Bookkeeping for one stage of the pipeline.'''
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self._finished = 0
+        self._lock = Lock()
+
+    def count(self, duration, failed = False):
+        with self._lock:
+            self.processed += 1
+            self.failed += int(failed)
+            self.busy += duration
+
+    def finish(self):
+        '''Note that a worker has ended; return True if it was the last one.'''
+        with self._lock:
+            self._finished += 1
+            return self._finished == self.workers
+
+    def summary(self, elapsed):
+        with self._lock:
+            return {'workers'     : self.workers,
+                    'processed'   : self.processed,
+                    'failed'      : self.failed,
+                    'busy_time'   : self.busy,
+                    'throughput'  : (self.processed / elapsed) if elapsed else 0,
+                    'utilization' : (self.busy / (elapsed * self.workers))
+                                    if elapsed else 0}
@@ -0,0 +1,200 @@
+'''
+pool.py: shared resources for Tind objects of several TIND servers
+
+An application that works with more than one TIND server can create a
+TindPool and obtain the Tind object for each server from it.  The Tind
+objects of a pool share one HTTP connection pool, and the caches of recent
+records and of NotFound results are sized from one budget for the whole
+pool, divided into equal partitions for the servers.  Each server has its
+own rate limit and limit on concurrent requests, so a slow or heavily-used
+server does not hold up requests to the others.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   threading import Lock
+
+if __debug__:
+    from .debug import log
+
+from .tind import Tind
+from .tind_utils import _NETWORK_TIMEOUT
+
+
+# Class definitions.
+# .............................................................................
+
+class TindPool():
+    '''A registry of Tind objects for several servers, with shared resources.
+
+    The method client() returns the Tind object for a server URL, creating
+    it the first time.  Example of use:
+
+        with TindPool(max_rate = 10, max_concurrency = 8) as pool:
+            caltech = pool.client('https://caltech.tind.io')
+            other = pool.client('https://other.tind.io', max_rate = 2)
+            ...
+            print(pool.stats()['total'])
+    '''
+
+    def __init__(self, cache_size = 10000, negative_cache_size = 30000,
+                 max_connections = 100, max_rate = None, max_concurrency = None,
+                 **kwargs):
+        '''Create a pool.
+
+        The Tind objects of the pool keep a total of at most "cache_size"
+        recent records and items and at most "negative_cache_size" NotFound
+        results and blank records (see the Tind constructor), divided evenly
+        between the servers; the division is adjusted when a server is
+        added.  The shared HTTP client keeps at most "max_connections" open
+        connections in total.  The values of "max_rate" and
+        "max_concurrency" are the default limits for each server, and other
+        keyword arguments are default arguments for the Tind constructor;
+        all of them can be overridden for individual servers by client().
+        '''
+        if cache_size < 1 or negative_cache_size < 0 or max_connections < 1:
+            raise ValueError('Invalid cache size or number of connections.')
+        self._cache_size = cache_size
+        self._negative_cache_size = negative_cache_size
+        self._max_connections = max_connections
+        self._defaults = dict(kwargs, max_rate = max_rate,
+                              max_concurrency = max_concurrency)
+        self._tinds = {}
+        self._http = None
+        self._closed = False
+        self._lock = Lock()
+
+
+    def client(self, server_url, **kwargs):
+        '''Return the Tind object of this pool for the server "server_url".
+
+        The first time a server is requested, its Tind object is created
+        using the defaults given to the pool constructor, overridden by the
+        keyword arguments given here (such as "max_rate", "max_concurrency"
+        or "soft_ttl").  Later calls return the same object; passing keyword
+        arguments for a server that already exists raises ValueError, as
+        does calling this after close().
+        '''
+        server_url = server_url.rstrip('/')
+        with self._lock:
+            if self._closed:
+                raise ValueError('Pool has been closed')
+            tind = self._tinds.get(server_url)
+            if tind is not None:
+                if kwargs:
+                    raise ValueError(f'Pool already has a client for {server_url}')
+                return tind
+            settings = dict(self._defaults, **kwargs)
+            settings['recent_cache_size'] = self._cache_size
+            settings['negative_cache_size'] = self._negative_cache_size
+            if __debug__: log(f'adding {server_url} to pool')
+            tind = Tind(server_url, client = self._http_client(), **settings)
+            self._tinds[server_url] = tind
+            self._rebalance()
+            return tind
+
+
+    def __contains__(self, server_url):
+        return server_url.rstrip('/') in self._tinds
+
+
+    def __len__(self):
+        return len(self._tinds)
+
+
+    def __iter__(self):
+        return iter(list(self._tinds))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        '''Close the connections of the shared HTTP client.
+
+        After this, the Tind objects obtained from the pool raise TindError
+        instead of contacting their servers, including to get thumbnails of
+        records they have returned.
+        '''
+        with self._lock:
+            self._closed = True
+            for tind in self._tinds.values():
+                tind._closed = True
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+
+    def stats(self):
+        '''Return a dictionary of statistics for each server and in total.
+
+        The value of "hosts" is a dictionary of the values returned by the
+        stats() method of each Tind object, keyed by server URL.  The value of
+        "total" is the sum over all servers of the serving counts, of the
+        cache counters, and of the number of requests and hedged requests of
+        each kind.
+        '''
+        hosts = {url: tind.stats() for url, tind in list(self._tinds.items())}
+        total = {'hosts'          : len(hosts),
+                 'serving'        : {},
+                 'negative_cache' : {},
+                 'recent_cache'   : {},
+                 'latency'        : {}}
+        for values in hosts.values():
+            _add_counts(total['serving'], values['serving'])
+            _add_counts(total['negative_cache'], values['negative_cache'] or {})
+            _add_counts(total['recent_cache'], values['recent_cache'] or {})
+            for kind, latency in values['latency'].items():
+                counts = {k: latency[k] for k in ['requests', 'hedges', 'hedge_wins']}
+                _add_counts(total['latency'].setdefault(kind, {}), counts)
+        return {'hosts': hosts, 'total': total}
+
+
+    # Internal methods.
+    # .........................................................................
+
+    def _http_client(self):
+        if self._http is None:
+            # Imported here to make "import topi" fast.
+            import httpx
+            limits = httpx.Limits(max_connections = self._max_connections,
+                                  max_keepalive_connections = self._max_connections)
+            # These settings match the ones used by the network library.
+            self._http = httpx.Client(timeout = httpx.Timeout(_NETWORK_TIMEOUT),
+                                      http2 = True, verify = False, limits = limits)
+        return self._http
+
+
+    def _rebalance(self):
+        '''Divide the cache budgets evenly among the servers.'''
+        count = len(self._tinds)
+        recent_share = max(1, self._cache_size // count)
+        negative_share = max(1, self._negative_cache_size // count)
+        for tind in self._tinds.values():
+            if tind._recent is not None:
+                tind._recent.resize(recent_share)
+            if tind.negative_cache is not None:
+                tind.negative_cache.resize(negative_share)
+
+
+# Helper functions.
+# .............................................................................
+
+def _add_counts(total, counts):
+    for key, value in counts.items():
+        total[key] = total.get(key, 0) + value
@@ -0,0 +1,275 @@
+'''
+profile.py: opt-in profiling of the work done by Topi
+
+The Profile class in this module measures the time spent, and the memory
+allocated, in each phase of the work done by Tind.record(), Tind.item() and
+the bulk retrieval methods: waiting for the network, pausing for rate
+limits, parsing XML, decoding JSON, cleaning up field values, and creating
+TindRecord and TindItem objects.  The code of those phases is marked using
+the function phase(), which does nothing unless a profile is active.
+
+A profile can also run Python's cProfile on the calling thread and write
+the result to a file, and can periodically sample the stacks of all
+threads and write them to a file in the "folded" format read by flame graph
+tools such as flamegraph.pl and speedscope.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import sys
+from   contextlib import nullcontext
+from   threading import Event, Lock, Thread, local, get_ident
+from   time import perf_counter
+
+if __debug__:
+    from .debug import log
+
+
+# Internal constants and variables.
+# .............................................................................
+
+# Profiles that are currently active.  Phases are recorded in the last one.
+_active = []
+
+# Returned by phase() when no profile is active.
+_NO_PHASE = nullcontext()
+
+
+# Exported functions.
+# .............................................................................
+
+def phase(name):
+    '''Return a context manager that marks the code it wraps as "name".'''
+    # Take one copy, because another thread may end a profile at any time.
+    active = _active[-1:]
+    return active[0].phase(name) if active else _NO_PHASE
+
+
+# Class definitions.
+# .............................................................................
+
+class Profile():
+    '''Measurements of time and memory use per phase of Topi's work.
+
+    A Profile is used as a context manager; see Tind.profile().  Phases are
+    recorded for the work done in all threads while the profile is active.
+    Time is measured exclusively: when one phase occurs inside another (for
+    example, "cleanup" inside "parse"), the time of the inner phase is not
+    counted in the outer one.  Memory allocations are measured using
+    tracemalloc as the net increase in traced memory during each phase; when
+    several threads are working at once, the allocations of one thread can
+    be counted in a phase of another, so the values are approximate.
+    '''
+
+    def __init__(self, memory = True, cprofile = None, stacks = None,
+                 interval = 0.005):
+        '''Create a profile.
+
+        If "memory" is True, allocations are traced using tracemalloc.  If
+        "cprofile" is a file name, the calling thread is profiled using
+        cProfile and the statistics are written to the file at the end; the
+        work done in other threads, such as the worker threads of the bulk
+        retrieval methods, is not included.  If
+        "stacks" is a file name, the stacks of all threads are sampled every
+        "interval" seconds and written to the file in folded format.
+        '''
+        self.elapsed = 0
+        self._memory = memory
+        self._cprofile_file = cprofile
+        self._stacks_file = stacks
+        self._interval = interval
+        self._phases = {}
+        self._lock = Lock()
+        self._local = local()
+        self._start = None
+        self._started_tracing = False
+        self._snapshot = None
+        self._cprofile = None
+        self._sampler = None
+        self._stop_sampling = Event()
+        self._samples = {}
+
+
+    def __enter__(self):
+        if self._memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        if self._stacks_file:
+            self._stop_sampling.clear()
+            self._sampler = Thread(target = self._sample, daemon = True,
+                                   name = 'topi-profile-sampler')
+            self._sampler.start()
+        if self._cprofile_file:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        _active.append(self)
+        self._start = perf_counter()
+        return self
+
+
+    def __exit__(self, *args):
+        self.elapsed = perf_counter() - self._start
+        _active.remove(self)
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._cprofile_file)
+        if self._sampler:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._write_samples()
+        if self._memory:
+            import tracemalloc
+            self._snapshot = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+        if __debug__: log(f'profile finished after {self.elapsed:.3f}s')
+
+
+    def phase(self, name):
+        '''Return a context manager that records a phase called "name".'''
+        return _Phase(self, name)
+
+
+    def stats(self):
+        '''Return a dictionary of measurements for each phase.
+
+        For every phase, the dictionary gives the number of times it was
+        entered ("calls"), the total time spent in it ("time"), and the net
+        number of bytes allocated in it ("allocated", or None if memory was
+        not traced).  The phases are "network", "rate_limit", "parse",
+        "cleanup", "decode" and "construct"; phases that did not occur are
+        omitted.
+        '''
+        with self._lock:
+            return {name: dict(values) for name, values in self._phases.items()}
+
+
+    def allocation_sites(self, limit = 10):
+        '''Return the "limit" source lines holding the most traced memory.
+
+        The result is a list of (location, size in bytes, number of blocks)
+        tuples, taken when the profile ended.  Returns an empty list if
+        memory was not traced.
+        '''
+        if self._snapshot is None:
+            return []
+        top = self._snapshot.statistics('lineno')[:limit]
+        return [(str(stat.traceback[0]), stat.size, stat.count) for stat in top]
+
+
+    def report(self):
+        '''Return a printable table of the measurements, slowest phase first.'''
+        lines = [f'{"phase":<12} {"calls":>8} {"time (s)":>10} {"share":>7}'
+                 f' {"allocated":>12}']
+        total = self.elapsed or 1
+        phases = sorted(self.stats().items(), key = lambda p: -p[1]['time'])
+        for name, values in phases:
+            allocated = values['allocated']
+            allocated = '' if allocated is None else f'{allocated:,}'
+            lines.append(f'{name:<12} {values["calls"]:>8} {values["time"]:>10.4f}'
+                         f' {values["time"] / total:>7.1%} {allocated:>12}')
+        lines.append(f'{"elapsed":<12} {"":>8} {self.elapsed:>10.4f}')
+        return '\n'.join(lines)
+
+
+    # Internal methods.
+    # .........................................................................
+
+    def _charge(self, frame, now, memory):
+        '''Add the time and memory used since "frame" last started.'''
+        with self._lock:
+            values = self._phases.setdefault(
+                frame.name, {'calls': 0, 'time': 0.0,
+                             'allocated': 0 if self._memory else None})
+            values['time'] += now - frame.start
+            if self._memory:
+                values['allocated'] += memory - frame.memory
+
+
+    def _count(self, name):
+        with self._lock:
+            values = self._phases.setdefault(
+                name, {'calls': 0, 'time': 0.0,
+                       'allocated': 0 if self._memory else None})
+            values['calls'] += 1
+
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+    def _sample(self):
+        own = get_ident()
+        while not self._stop_sampling.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                folded = ';'.join(reversed(names))
+                self._samples[folded] = self._samples.get(folded, 0) + 1
+
+
+    def _write_samples(self):
+        with open(self._stacks_file, 'w') as f:
+            for stack, count in sorted(self._samples.items()):
+                f.write(f'{stack} {count}\n')
+
+
+class _Phase():
+    '''Context manager for one occurrence of a phase.'''
+    __slots__ = ('profile', 'name', 'start', 'memory')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+
+    def __enter__(self):
+        profile = self.profile
+        now, memory = perf_counter(), _traced(profile)
+        stack = profile._stack()
+        if stack:
+            # Pause the enclosing phase.
+            profile._charge(stack[-1], now, memory)
+        profile._count(self.name)
+        stack.append(self)
+        self.start, self.memory = perf_counter(), _traced(profile)
+        return self
+
+
+    def __exit__(self, *args):
+        profile = self.profile
+        now, memory = perf_counter(), _traced(profile)
+        profile._charge(self, now, memory)
+        stack = profile._stack()
+        stack.pop()
+        if stack:
+            # Resume the enclosing phase.
+            stack[-1].start, stack[-1].memory = perf_counter(), _traced(profile)
+
+
+def _traced(profile):
+    if not profile._memory:
+        return 0
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0]
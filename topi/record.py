@@ -14,14 +14,14 @@ is open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
-import json
-from   json import JSONDecodeError
+from   threading import Event, Lock
 
 if __debug__:
-    from sidetrack import log
+    from .debug import log
 
+from .cache import TTLCache
 from .tind_utils import result_from_api
-from .exceptions import DataMismatchError
+from .exceptions import TindError, DataMismatchError, TimedOut
 
 
 # Constants.
@@ -32,6 +32,23 @@ from .exceptions import DataMismatchError
 # Use Python .format() to substitute the relevant values into the string.
 _THUMBNAIL_FOR_TIND_ID = '{}/nanna/thumbnail/{}'
 
+# Thumbnail URLs obtained from TIND, keyed by (server URL, TIND id).  This
+# is shared by all TindRecord objects, so that a thumbnail is requested once
+# per record id rather than once per TindRecord object.  The value '' means
+# TIND has no thumbnail for the record.
+_THUMBNAIL_CACHE_SIZE = 50000
+_THUMBNAIL_CACHE_TTL  = 24 * 60 * 60
+_thumbnail_cache = TTLCache(_THUMBNAIL_CACHE_SIZE, _THUMBNAIL_CACHE_TTL)
+
+# Thumbnail lookups in progress, keyed like _thumbnail_cache.  A thread that
+# needs a thumbnail that another thread is already requesting waits for that
+# request to finish instead of making its own.
+_thumbnail_lookups = {}
+_thumbnail_lookups_lock = Lock()
+
+# Internal attributes of TindRecord objects that __eq__() does not compare.
+_UNCOMPARED = {'_tind', '_raw_xml', '_compressed_xml'}
+
 
 # Class definitions.
 # .............................................................................
@@ -58,10 +75,16 @@ class TindRecord():
     }
 
 
+    # Initial values of the fields that are strings, for _from_fields().
+    __defaults = {field: '' for field, field_type in __fields.items()
+                  if field_type != list}
+
+
     def __init__(self, server_url = None, **kwargs):
         # Internal variables.  Need to set these first.
         self._server_url = server_url
         self._saved_thumbnail_url = None
+        self._tind = None
 
         # Always first initialize every field.
         for field, field_type in self.__fields.items():
@@ -71,13 +94,40 @@ class TindRecord():
             setattr(self, field, value)
 
 
+    @classmethod
+    def _from_fields(cls, server_url, fields):
+        '''Return a new record with the values in the dictionary "fields".
+
+        This gives the same result as TindRecord(server_url, **fields), but
+        stores the values directly instead of setting one attribute at a
+        time, which makes it faster for creating many records.
+        '''
+        record = cls.__new__(cls)
+        values = record.__dict__
+        values['_server_url'] = server_url
+        values['_saved_thumbnail_url'] = None
+        values['_tind'] = None
+        values.update(cls.__defaults)
+        values['isbn_issn'] = []
+        values['items'] = []
+        values.update(fields)
+        if server_url and 'tind_id' in fields:
+            values['tind_url'] = f'{server_url}/record/{fields["tind_id"]}'
+        return record
+
+
     def __getattribute__(self, attr):
         if attr == 'thumbnail_url':
-            if self._saved_thumbnail_url is not None:
-                return self._saved_thumbnail_url
-            if __debug__: log(f'getting thumbnail url')
-            self._saved_thumbnail_url = self._thumbnail_for_record()
-            return self._saved_thumbnail_url
+            # Read the value once, in case another thread is setting it.
+            url = self._saved_thumbnail_url
+            if url is None:
+                if __debug__: log(f'getting thumbnail url')
+                # Records made by a Tind object use its network settings.
+                tind = self._tind
+                options = tind._net_options('thumbnail') if tind else {}
+                url = self._thumbnail_for_record(**options)
+                self._saved_thumbnail_url = url
+            return url
         return object.__getattribute__(self, attr)
 
 
@@ -87,6 +137,36 @@ class TindRecord():
         object.__setattr__(self, attr, value)
 
 
+    @property
+    def _xml(self):
+        '''The MARC XML this record was created from, or None.'''
+        xml = self.__dict__.get('_raw_xml')
+        if xml is not None:
+            return xml
+        data = self.__dict__.get('_compressed_xml')
+        if data is None:
+            return None
+        from .compression import decompress_marc
+        return decompress_marc(data)
+
+
+    @_xml.setter
+    def _xml(self, xml):
+        # The XML is compressed by _compress_xml() only if the record is kept.
+        self.__dict__['_raw_xml'] = xml or None
+        self.__dict__['_compressed_xml'] = None
+
+
+    def _compress_xml(self):
+        '''Compress the MARC XML of this record, for keeping it in a cache.'''
+        # Read the value once, in case another thread is compressing it too.
+        xml = self.__dict__.get('_raw_xml')
+        if xml is not None:
+            from .compression import compress_marc
+            self.__dict__['_compressed_xml'] = compress_marc(xml)
+            self.__dict__['_raw_xml'] = None
+
+
     def __str__(self):
         details = f' {self.tind_id}' if self.tind_id else ''
         return f'TindRecord{details}'
@@ -101,9 +181,33 @@ class TindRecord():
         return 'TindRecord(' + ', '.join(field_values) + ')'
 
 
+    def as_dict(self):
+        '''Return the fields of this record as a dictionary.
+
+        The items are included as a list of dictionaries produced by the
+        TindItem as_dict() method.  The thumbnail URL is only included if it
+        has already been obtained from TIND; otherwise its value is None.
+        This method does not contact the TIND server.
+        '''
+        result = {}
+        for field in self.__fields:
+            if field == 'thumbnail_url':
+                result[field] = self._saved_thumbnail_url
+            elif field == 'items':
+                result[field] = [item.as_dict() for item in self.items]
+            else:
+                value = getattr(self, field)
+                result[field] = list(value) if isinstance(value, list) else value
+        return result
+
+
     def __eq__(self, other):
         if isinstance(other, type(self)):
-            return self.__dict__ == other.__dict__
+            # The Tind object that made a record is not part of its value,
+            # and the XML is compared whether or not it is compressed.
+            mine = {k: v for k, v in self.__dict__.items() if k not in _UNCOMPARED}
+            theirs = {k: v for k, v in other.__dict__.items() if k not in _UNCOMPARED}
+            return mine == theirs and self._xml == other._xml
         return NotImplemented
 
 
@@ -138,8 +242,47 @@ class TindRecord():
         return NotImplemented
 
 
-    def _thumbnail_for_record(self, retry = 0):
-        '''Return the URL for the thumbnail in TIND for this record.'''
+    def _thumbnail_for_record(self, **options):
+        '''Return the URL for the thumbnail in TIND for this record.
+
+        The value is looked up in the thumbnail cache shared by all records
+        first, and only requested from TIND if it is not there.  If another
+        thread is already requesting the same thumbnail, this waits for its
+        result.  The keyword arguments are passed to result_from_api().
+        '''
+        key = (self._server_url, self.tind_id)
+        url = _thumbnail_cache.get(key)
+        if url is not None:
+            return url
+        with _thumbnail_lookups_lock:
+            url = _thumbnail_cache.get(key)
+            if url is not None:
+                return url
+            lookup = _thumbnail_lookups.get(key)
+            owner = lookup is None
+            if owner:
+                lookup = _thumbnail_lookups[key] = _Lookup()
+        if not owner:
+            deadline = options.get('deadline')
+            return lookup.result(deadline.remaining() if deadline else None)
+        try:
+            url = self._thumbnail_from_server(**options)
+            _thumbnail_cache.set(key, url)
+            lookup.finish(url, None)
+            return url
+        except Exception as ex:
+            lookup.finish(None, ex)
+            raise
+        finally:
+            with _thumbnail_lookups_lock:
+                del _thumbnail_lookups[key]
+
+
+    def _thumbnail_from_server(self, **options):
+        '''Ask TIND for the URL of the thumbnail image for this record.'''
+        import json
+        from json import JSONDecodeError
+
         def response_handler(resp):
             if not resp:
                 if __debug__: log(f'got empty json for thumbnail for {self.tind_id}')
@@ -165,4 +308,26 @@ class TindRecord():
                 return ''
 
         endpoint = _THUMBNAIL_FOR_TIND_ID.format(self._server_url, self.tind_id)
-        return result_from_api(endpoint, response_handler)
+        return result_from_api(endpoint, response_handler, **options)
+
+
+class _Lookup():
+    '''The eventual result of a lookup done by another thread.'''
+
+    def __init__(self):
+        self._done = Event()
+        self._value = None
+        self._error = None
+
+
+    def finish(self, value, error):
+        self._value, self._error = value, error
+        self._done.set()
+
+
+    def result(self, timeout = None):
+        if not self._done.wait(timeout):
+            raise TimedOut('Out of time waiting for a thumbnail lookup')
+        if self._error:
+            raise self._error
+        return self._value
@@ -0,0 +1,187 @@
+'''
+replay.py: recording and replaying TIND responses for offline use
+
+The classes in this module are transports for the HTTPX network library.
+A RecordingTransport passes requests to a real server and saves every
+response to the MARC, item and thumbnail endpoints of TIND in an archive
+file.  A ReplayTransport answers requests using the responses in such an
+archive, without any network access, optionally pausing before each answer
+to simulate the latency of a real server.  To use either one with Topi, give
+a Tind object an httpx.Client that uses the transport:
+
+    client = httpx.Client(transport = ReplayTransport('tind.json.gz'))
+    tind = Tind('https://caltech.tind.io', client = client)
+
+Responses are keyed by the path and query of the request URL, so that an
+archive recorded from one server can be replayed for a Tind object with a
+different server URL.  Archives are gzip-compressed JSON files.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import gzip
+import json
+import random
+import re
+from   threading import Lock
+from   time import monotonic, sleep
+
+import httpx
+
+if __debug__:
+    from .debug import log
+
+
+# Internal constants.
+# .............................................................................
+
+_ARCHIVE_VERSION = 1
+
+# Patterns for recognizing the kinds of requests made by Topi.
+_KINDS = [('marc',      re.compile(r'/search\?.*&of=xm')),
+          ('items',     re.compile(r'/nanna/bibcirc/\d+/details')),
+          ('thumbnail', re.compile(r'/nanna/thumbnail/\d+'))]
+
+
+# Class definitions.
+# .............................................................................
+
+class RecordingTransport(httpx.BaseTransport):
+    '''An HTTPX transport that records the responses of a server.
+
+    Requests are passed to "transport" (by default, a new HTTPTransport).
+    Responses to requests of the kinds made by Topi are kept and written to
+    the archive "path" by save(), which is also called when the transport is
+    closed (for example, when the httpx.Client using it is closed).
+    '''
+
+    def __init__(self, path, transport = None):
+        self.path = path
+        self._transport = transport or httpx.HTTPTransport(http2 = True, verify = False)
+        self._entries = {}
+        self._lock = Lock()
+
+
+    def handle_request(self, request):
+        start = monotonic()
+        response = self._transport.handle_request(request)
+        # Reading the response decodes any transfer compression.
+        body = response.read()
+        elapsed = monotonic() - start
+        response.close()
+        key = _key(request.url)
+        kind = _kind(key)
+        if kind:
+            entry = {'kind'         : kind,
+                     'status'       : response.status_code,
+                     'content_type' : response.headers.get('content-type', ''),
+                     'elapsed'      : round(elapsed, 4),
+                     'body'         : body.decode('utf-8', errors = 'replace')}
+            with self._lock:
+                self._entries[key] = entry
+        headers = [(k, v) for k, v in response.headers.items()
+                   if k.lower() not in ('content-encoding', 'content-length',
+                                        'transfer-encoding')]
+        return httpx.Response(response.status_code, headers = headers,
+                              content = body, request = request)
+
+
+    def save(self):
+        '''Write the responses recorded so far to the archive file.'''
+        with self._lock:
+            archive = {'version': _ARCHIVE_VERSION, 'responses': self._entries}
+            with gzip.open(self.path, 'wt', encoding = 'utf-8') as f:
+                json.dump(archive, f, indent = 1, sort_keys = True)
+        if __debug__: log(f'saved {len(self._entries)} responses to {self.path}')
+
+
+    def close(self):
+        self.save()
+        self._transport.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    '''An HTTPX transport that answers requests from a recorded archive.
+
+    If "latency" is a number, every response is delayed by that many
+    seconds, varied at random by up to the fraction "jitter" of it; if it
+    is "recorded", the time each response took when it was recorded is
+    used.  Requests that are not in the archive get a 404 (not found)
+    response, which is what TIND returns for unknown ids, unless "strict"
+    is True, in which case they raise KeyError.  The attribute "hits" counts
+    the responses served of each kind ("marc", "items" and "thumbnail").
+    '''
+
+    def __init__(self, path, latency = 0, jitter = 0, strict = False, seed = None):
+        with gzip.open(path, 'rt', encoding = 'utf-8') as f:
+            archive = json.load(f)
+        if archive.get('version') != _ARCHIVE_VERSION:
+            raise ValueError(f'Unsupported archive version in {path}')
+        self._entries = archive['responses']
+        self._latency = latency
+        self._jitter = jitter
+        self._strict = strict
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self.hits = {}
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def keys(self, kind = None):
+        '''Return the request keys in the archive, optionally of one kind.'''
+        return [key for key, entry in self._entries.items()
+                if kind is None or entry['kind'] == kind]
+
+
+    def handle_request(self, request):
+        key = _key(request.url)
+        entry = self._entries.get(key)
+        if entry is None and self._strict:
+            raise KeyError(f'No recorded response for {key}')
+        self._pause(entry)
+        if entry is None:
+            return httpx.Response(404, request = request)
+        with self._lock:
+            self.hits[entry['kind']] = self.hits.get(entry['kind'], 0) + 1
+        return httpx.Response(entry['status'], request = request,
+                              headers = {'content-type': entry['content_type']},
+                              content = entry['body'].encode('utf-8'))
+
+
+    def _pause(self, entry):
+        if self._latency == 'recorded':
+            delay = entry['elapsed'] if entry else 0
+        else:
+            delay = self._latency
+        if delay and self._jitter:
+            with self._lock:
+                delay *= 1 + self._random.uniform(-self._jitter, self._jitter)
+        if delay > 0:
+            sleep(delay)
+
+
+# Helper functions.
+# .............................................................................
+
+def _key(url):
+    return url.raw_path.decode('ascii')
+
+
+def _kind(key):
+    for kind, pattern in _KINDS:
+        if pattern.search(key):
+            return kind
+    return None
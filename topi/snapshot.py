@@ -0,0 +1,237 @@
+'''
+snapshot.py: read-only, memory-mapped snapshots of TIND records
+
+A snapshot is a pair of files holding a set of TindRecord objects and their
+items, written by write_snapshot() and read by the Snapshot class.  The data
+file holds one JSON-encoded record after another; the index file (the data
+file name plus ".idx") holds two sorted tables of fixed-size entries, one
+keyed by TIND id and one by barcode, giving the location of each record in
+the data file.  Both files are memory-mapped when opened, so opening a
+snapshot takes the same short time regardless of its size, records are only
+decoded when they are looked up, and processes that open the same snapshot
+share the operating system's cached pages of the files.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import json
+import mmap
+import os
+from   struct import Struct
+from   time import time
+
+if __debug__:
+    from .debug import log
+
+from .item import TindItem
+from .record import TindRecord
+
+
+# Constants.
+# .............................................................................
+
+_DATA_MAGIC  = b'TOPISNP1'
+_INDEX_MAGIC = b'TOPIIDX1'
+
+# Data file: magic, length of the JSON header that follows, then the records.
+_DATA_HEADER = Struct('<8sI')
+
+# Index file: magic, data file size, number of TIND id and barcode entries,
+# followed by the entries for TIND ids and then those for barcodes, each
+# table sorted by key.  An entry is the key (NUL-padded), and the offset and
+# length of the record in the data file.
+_INDEX_HEADER = Struct('<8sQQQ')
+_ENTRY = Struct('<24sQI')
+_KEY_SIZE = 24
+
+
+# Principal functions.
+# .............................................................................
+
+def write_snapshot(path, records, server_url = None):
+    '''Write the TindRecord objects in "records" to a snapshot at "path".
+
+    The index is written to "path" plus ".idx".  If "server_url" is not
+    given, the server URL of the first record is used.  Records without a
+    TIND id are skipped.  Thumbnail URLs are stored only for records whose
+    thumbnail has already been obtained.  The files are written under
+    temporary names and then renamed, so that processes reading an older
+    snapshot at the same path are not disturbed.  Returns the number of
+    records written.
+    '''
+    by_id, by_barcode = [], []
+    data_tmp, index_tmp = path + '.tmp', _index_path(path) + '.tmp'
+    with open(data_tmp, 'wb') as data:
+        data.write(_DATA_HEADER.pack(_DATA_MAGIC, 0))
+        offset = data.tell()
+        for record in records:
+            if not record.tind_id:
+                continue
+            if server_url is None:
+                server_url = record._server_url
+            encoded = json.dumps(record.as_dict(), ensure_ascii = False,
+                                 separators = (',', ':')).encode()
+            data.write(encoded)
+            location = (offset, len(encoded))
+            by_id.append((_key(record.tind_id), location))
+            by_barcode += [(_key(item.barcode), location)
+                           for item in record.items if item.barcode]
+            offset += len(encoded)
+        header = json.dumps({'server_url' : server_url,
+                             'created'    : time(),
+                             'records'    : len(by_id)}).encode()
+        data.write(header)
+        data.seek(0)
+        data.write(_DATA_HEADER.pack(_DATA_MAGIC, len(header)))
+        data_size = offset + len(header)
+
+    with open(index_tmp, 'wb') as index:
+        index.write(_INDEX_HEADER.pack(_INDEX_MAGIC, data_size,
+                                       len(by_id), len(by_barcode)))
+        for key, (offset, length) in sorted(by_id) + sorted(by_barcode):
+            index.write(_ENTRY.pack(key, offset, length))
+    os.replace(data_tmp, path)
+    os.replace(index_tmp, _index_path(path))
+    if __debug__: log(f'wrote snapshot of {len(by_id)} records to {path}')
+    return len(by_id)
+
+
+# Class definitions.
+# .............................................................................
+
+class Snapshot():
+    '''A read-only, memory-mapped snapshot of TIND records.
+
+    The methods record() and item() decode and return new TindRecord and
+    TindItem objects each time they are called, or return None if the
+    snapshot has no value for the given TIND id or barcode.  The attribute
+    "created" is the time (as returned by time.time()) when the snapshot was
+    written, and "server_url" is the URL of the server the records came from.
+    '''
+
+    def __init__(self, path, server_url = None):
+        '''Open the snapshot at "path".
+
+        If "server_url" is given, it is used as the server URL of the
+        records returned, instead of the URL stored in the snapshot.
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        with open(_index_path(path), 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, header_size = _DATA_HEADER.unpack_from(self._data)
+        index_magic, data_size, self._ids, self._barcodes \
+            = _INDEX_HEADER.unpack_from(self._index)
+        if (magic != _DATA_MAGIC or index_magic != _INDEX_MAGIC
+                or data_size != len(self._data)):
+            self.close()
+            raise ValueError(f'{path} is not a Topi snapshot or its index is stale')
+        header = json.loads(self._data[len(self._data) - header_size:])
+        self.created = header['created']
+        self.server_url = server_url or header['server_url']
+        if __debug__: log(f'opened snapshot {path} of {self._ids} records')
+
+
+    def __len__(self):
+        return self._ids
+
+
+    def __contains__(self, tind_id):
+        return self._find(0, self._ids, str(tind_id)) is not None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        '''Unmap the files of this snapshot.'''
+        self._data.close()
+        self._index.close()
+
+
+    def tind_ids(self):
+        '''Return a list of the TIND ids in this snapshot, in sorted order.'''
+        start = _INDEX_HEADER.size
+        return [_ENTRY.unpack_from(self._index, start + i * _ENTRY.size)[0]
+                .rstrip(b'\0').decode() for i in range(self._ids)]
+
+
+    def record(self, tind_id):
+        '''Return a TindRecord for "tind_id", or None if it is not here.'''
+        location = self._find(0, self._ids, str(tind_id))
+        return self._decoded(*location) if location else None
+
+
+    def item(self, barcode):
+        '''Return a TindItem for "barcode", or None if it is not here.
+
+        The "parent" field of the item is the TindRecord containing it.
+        '''
+        barcode = str(barcode)
+        location = self._find(self._ids, self._barcodes, barcode)
+        if not location:
+            return None
+        for item in self._decoded(*location).items:
+            if item.barcode == barcode:
+                return item
+        return None
+
+
+    def _find(self, first, count, key):
+        '''Return (offset, length) for "key" in an index table, or None.'''
+        if len(key) > _KEY_SIZE:
+            return None
+        padded = key.encode().ljust(_KEY_SIZE, b'\0')
+        start = _INDEX_HEADER.size + first * _ENTRY.size
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            position = start + middle * _ENTRY.size
+            found = self._index[position : position + _KEY_SIZE]
+            if found < padded:
+                low = middle + 1
+            elif found > padded:
+                high = middle
+            else:
+                return _ENTRY.unpack_from(self._index, position)[1:]
+        return None
+
+
+    def _decoded(self, offset, length):
+        fields = json.loads(self._data[offset : offset + length])
+        items = fields.pop('items')
+        thumbnail_url = fields.pop('thumbnail_url')
+        record = TindRecord(server_url = self.server_url, **fields)
+        record._saved_thumbnail_url = thumbnail_url
+        record.items = [TindItem(parent = record, **item) for item in items]
+        return record
+
+
+# Helper functions.
+# .............................................................................
+
+def _index_path(path):
+    return path + '.idx'
+
+
+def _key(value):
+    encoded = str(value).encode()
+    if len(encoded) > _KEY_SIZE:
+        raise ValueError(f'Identifier too long for a snapshot index: {value}')
+    return encoded.ljust(_KEY_SIZE, b'\0')
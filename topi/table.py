@@ -0,0 +1,232 @@
+'''
+table.py: columnar representation of many TIND records and their items
+
+The TindTable class in this module stores the field values of many records
+as columns (one Python list per field) instead of as TindRecord and TindItem
+objects.  The items of all the records are stored in a second, child table
+whose "tind_id" column refers to the record each item belongs to.  Tables are
+created by Tind.records_table(), which fills the columns directly from the
+parsed MARC XML and item JSON, and can be converted to Apache Arrow tables,
+written to Parquet files (both require the package "pyarrow"), or converted
+to NumPy structured arrays (requires the package "numpy").
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   itertools import islice
+
+if __debug__:
+    from .debug import log
+
+from .exceptions import NotFound
+from .item import TindItem
+from .record import TindRecord
+from .tind import _MARCXML_FOR_TIND_ID, _NOT_FOUND, _clean_fields
+
+
+# Constants.
+# .............................................................................
+
+RECORD_COLUMNS = ['tind_id', 'tind_url', 'title', 'subtitle', 'author',
+                  'edition', 'publisher', 'year', 'isbn_issn', 'description',
+                  'bib_note']
+
+ITEM_COLUMNS = ['tind_id', 'barcode', 'type', 'volume', 'call_number',
+                'description', 'library', 'location', 'status']
+
+# Number of records requested at a time per worker thread.
+_CHUNK_PER_JOB = 16
+
+
+# Class definitions.
+# .............................................................................
+
+class TindTable():
+    '''Column-oriented storage of TIND records and their items.
+
+    The attribute "records" is a dictionary mapping each name in
+    RECORD_COLUMNS to a list of values, one per record; "isbn_issn" values
+    are lists of strings and the other values are strings or None.  The
+    attribute "items" is a similar dictionary for ITEM_COLUMNS, with one
+    value per item.  The attribute "failures" is a dictionary of the
+    exceptions for the ids that could not be retrieved, keyed by the id.
+    The length of a TindTable is the number of records in it.
+    '''
+
+    def __init__(self):
+        self.records = {column: [] for column in RECORD_COLUMNS}
+        self.items = {column: [] for column in ITEM_COLUMNS}
+        self.failures = {}
+
+
+    def __len__(self):
+        return len(self.records['tind_id'])
+
+
+    def __repr__(self):
+        return (f'TindTable({len(self)} records, '
+                f'{len(self.items["tind_id"])} items)')
+
+
+    def to_arrow(self):
+        '''Return the records and the items as a pair of pyarrow Tables.'''
+        pa = _imported('pyarrow')
+        string = pa.string()
+        schema = pa.schema([(column, pa.list_(string) if column == 'isbn_issn'
+                             else string) for column in RECORD_COLUMNS])
+        records = pa.table(self.records, schema = schema)
+        items = pa.table(self.items, schema = pa.schema([(column, string)
+                                                         for column in ITEM_COLUMNS]))
+        return records, items
+
+
+    def to_parquet(self, records_file, items_file, **kwargs):
+        '''Write the records and the items to two Parquet files.
+
+        Additional keyword arguments are passed to pyarrow's write_table().
+        '''
+        parquet = _imported('pyarrow.parquet')
+        records, items = self.to_arrow()
+        parquet.write_table(records, records_file, **kwargs)
+        parquet.write_table(items, items_file, **kwargs)
+
+
+    def to_numpy(self):
+        '''Return the records and the items as a pair of NumPy arrays.
+
+        The arrays are structured arrays with one fixed-width string field
+        per column.  None values become empty strings, and the values in
+        the "isbn_issn" column are joined using semicolons.
+        '''
+        np = _imported('numpy')
+        return _structured(np, self.records), _structured(np, self.items)
+
+
+    def _add(self, fields, items, server_url):
+        '''Append a record and its items given dictionaries of field values.'''
+        tind_id = fields.get('tind_id', '')
+        if tind_id and 'tind_url' not in fields:
+            fields['tind_url'] = f'{server_url}/record/{tind_id}'
+        for column in RECORD_COLUMNS:
+            default = [] if column == 'isbn_issn' else ''
+            self.records[column].append(fields.get(column, default))
+        for item in items:
+            item['tind_id'] = tind_id
+            for column in ITEM_COLUMNS:
+                self.items[column].append(item.get(column, ''))
+
+
+# Principal functions.
+# .............................................................................
+
+def table_from_server(tind, tind_ids, jobs = None):
+    '''Return a TindTable for the records "tind_ids" using the Tind "tind".
+
+    Up to "jobs" records are retrieved in parallel (by default, the number
+    given by the Tind object's _bulk_workers() method).  The rows are in the
+    order of "tind_ids"; ids that cannot be retrieved are left out and
+    recorded in the "failures" dictionary of the table.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    if jobs is None:
+        jobs = tind._bulk_workers()
+    if jobs < 1:
+        raise ValueError('The number of jobs must be at least 1.')
+    table = TindTable()
+    ids = (str(id) for id in tind_ids)
+    with ThreadPoolExecutor(jobs) as executor:
+        while chunk := list(islice(ids, jobs * _CHUNK_PER_JOB)):
+            rows = []
+            for id, outcome in zip(chunk, executor.map(_columns_for(tind), chunk)):
+                if isinstance(outcome, Exception):
+                    table.failures[id] = outcome
+                else:
+                    rows.append(outcome)
+            # Records from the negative cache are blank or have a title of
+            # None, so cleaning them up again leaves them unchanged.
+            _clean_fields([fields for fields, _ in rows])
+            for fields, items in rows:
+                table._add(fields, items, tind.server_url)
+    if __debug__: log(f'built table of {len(table)} records;'
+                      f' {len(table.failures)} failures')
+    return table
+
+
+# Helper functions.
+# .............................................................................
+
+def _columns_for(tind):
+    '''Return a function that gets (fields, items) for an id, or an error.'''
+    def columns(id):
+        try:
+            if not id.isdigit():
+                raise ValueError(f'Invalid argument: {id} is not a number.')
+            # The negative cache is shared with Tind.record() and the pipeline.
+            cached = tind._negative_lookup('tind_id', id)
+            if cached is not None:
+                fields = cached.as_dict()
+                items = fields.pop('items')
+                return fields, items
+            xml = tind._marc_from_server(_MARCXML_FOR_TIND_ID, id)
+            if not xml:
+                tind._remember_missing('tind_id', id, _NOT_FOUND)
+                raise NotFound(f'No record found for {id} in {tind.server_url}')
+            # The fields are cleaned up later, together with the rest of the chunk.
+            fields = tind._raw_fields_from_xml(xml)
+            items = tind._item_fields_from_json(tind._items_json_for_tind_id(id))
+            if not fields.get('tind_id') or fields.get('title', '') is None:
+                # Remember blank records as Tind.record() does.  Their fields
+                # are not changed by the later cleanup.
+                tind._remember_missing('tind_id', id, _record(tind, fields, items))
+            return fields, items
+        except Exception as ex:
+            if __debug__: log(f'failed to get columns for {id}: {ex}')
+            return ex
+    return columns
+
+
+def _record(tind, fields, items):
+    '''Return a TindRecord holding "fields", with TindItems holding "items".'''
+    record = TindRecord._from_fields(tind.server_url, fields)
+    record._tind = tind
+    record.items = [TindItem._from_fields(item) for item in items]
+    for item in record.items:
+        item.parent = record
+    return record
+
+
+def _structured(np, columns):
+    '''Return a NumPy structured array holding the values in "columns".'''
+    names = list(columns)
+    values = {}
+    for name in names:
+        values[name] = [(';'.join(v) if isinstance(v, list) else (v or ''))
+                        for v in columns[name]]
+    dtype = [(name, f'U{max([1] + [len(v) for v in values[name]])}')
+             for name in names]
+    rows = len(values[names[0]]) if names else 0
+    array = np.empty(rows, dtype = dtype)
+    for name in names:
+        array[name] = values[name]
+    return array
+
+
+def _imported(module):
+    '''Import and return "module", which is an optional dependency.'''
+    from importlib import import_module
+    try:
+        return import_module(module)
+    except ImportError:
+        package = module.split('.')[0]
+        raise ImportError(f'This feature requires the package "{package}"')
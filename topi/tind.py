@@ -20,19 +20,19 @@ is open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
-from   collections import namedtuple
-from   commonpy.network_utils import net
-from   commonpy.exceptions import NoContent, ServiceFailure, RateLimitExceeded
-import json
-from   json import JSONDecodeError
-from   lxml import etree
+import re
+from   threading import BoundedSemaphore, Lock
+from   time import monotonic, time
 
 if __debug__:
-    from sidetrack import log
+    from .debug import log
 
 from .exceptions import *
 from .item import TindItem
-from .tind_utils import result_from_api
+from .cache import TTLCache
+from .profile import phase
+from .tind_utils import result_from_api, background_executor, refresh_executor
+from .tind_utils import AdaptiveLimit, Deadline, LatencyTracker, RateLimiter
 from .record import TindRecord
 
 
@@ -56,19 +56,138 @@ _MARCXML_FOR_TIND_ID = '{}/search?recid={}&of=xm'
 # Use Python .format() to substitute the relevant values into the string.
 _ITEMS_FOR_TIND_ID = '{}/nanna/bibcirc/{}/details'
 
+# Tags of the MARC data fields that _raw_fields_from_xml() uses.
+_DATAFIELD_TAGS = frozenset(['020', '050', '100', '245', '250', '260', '300',
+                             '504'])
+
+# Fields of records that are cleaned up after all the fields are parsed.
+_CLEANED_FIELDS = ['author', 'title', 'edition', 'subtitle', 'description',
+                   'publisher']
+
+# Pattern matching every separator that parsed_title_and_author() looks for,
+# and the separators in order of preference, with the number of characters
+# skipped from the start of each to the author.
+_TITLE_SEPARATORS = re.compile(r'/|\[by\]|, by')
+_TITLE_SEPARATOR_SKIPS = [('/', 3), ('[by]', 5), (', by', 5)]
+
+# Default highest limit on concurrent requests with adaptive_concurrency.
+_ADAPTIVE_MAX_CONCURRENCY = 32
+
+# Value stored in the negative cache for ids for which TIND has no record.
+_NOT_FOUND = 'not found'
+
 
 # Class definitions.
 # .............................................................................
 
 class Tind():
-    '''Interface to a TIND.io server.'''
-
-    def __init__(self, server_url):
-        '''Create an interface to the TIND server at "server_url".'''
+    '''Interface to a TIND.io server.
+
+    A Tind object can be shared by multiple threads, for example by the
+    worker threads of a web application.  Its caches, counters and rate
+    limiter use their own locks, which are held only briefly and never
+    during network requests, so requests made by different threads proceed
+    in parallel.  TindRecord and TindItem objects returned to one thread can
+    be read by others; the thumbnail URL of a record is requested at most
+    once even if several threads access it at the same time.  The exception
+    is load_snapshot(), which must not be called while other threads are
+    using the object.
+    '''
+
+    def __init__(self, server_url, max_rate = None, negative_cache_size = 10000,
+                 negative_ttl = 300, hedge = False, recent_cache_size = 1000,
+                 soft_ttl = None, hard_ttl = None, max_concurrency = None,
+                 adaptive_concurrency = False, client = None):
+        '''Create an interface to the TIND server at "server_url".
+
+        If "max_rate" is given, it limits the number of network requests per
+        second made to the server by this object, across all threads.  If
+        "max_concurrency" is given, it limits the number of requests in
+        progress at the same time.  If "adaptive_concurrency" is True, the
+        number of requests in progress is instead limited by an AdaptiveLimit,
+        which raises the limit while response times stay flat and halves it
+        when the server says its rate limit has been exceeded; the limit
+        starts at 4 and goes no higher than "max_concurrency" (default 32).
+        This lets the bulk methods records() and records_table() use as
+        many requests at a time as the server can take without waiting on
+        it; stats() reports the limit and the changes made to it.  If
+        "client" is given, it must be an httpx.Client object, which is used
+        for all network requests so that connections to the server are
+        reused; otherwise, a new connection is made for every request.  (See
+        also TindPool.)  Records made by this object use the same client and
+        limits when their thumbnail_url field is first read.
+
+        Ids for which TIND returns nothing, and TIND ids whose records are
+        blank (see record()), are remembered in a negative cache for
+        "negative_ttl" seconds, so that repeated lookups of the same ids do
+        not go back to the server.  The cache holds at most
+        "negative_cache_size" ids; a size of 0 disables it.  The cache is
+        available as the attribute "negative_cache"; use its stats() method
+        to get its counters, and use purge_negative_cache() to empty it.
+
+        If "hedge" is True, requests made by record(), item() and
+        prefetch_thumbnails() are hedged by default: if a response has not
+        arrived after the 95th percentile of recent response times, an
+        identical request is sent, and whichever response arrives first is
+        used.  This reduces the effect of occasional slow responses.  It can
+        also be turned on or off for individual calls.
+
+        The "recent_cache_size" most recently retrieved records and items are
+        kept, so that record() and item() can return them if a call with a
+        "timeout" runs out of time and the caller accepts stale values.
+
+        If "soft_ttl" is given, this object operates in stale-while-revalidate
+        mode: record() and item() return a recently retrieved record or item
+        immediately, without contacting TIND.  If the value is older than
+        "soft_ttl" seconds, it is still returned immediately, but a refresh
+        from TIND is started in the background; there is at most one refresh
+        in progress for any given id.  If refreshes fail (for example because
+        TIND is returning errors or rate-limiting requests), the last good
+        value continues to be served until it is "hard_ttl" seconds old,
+        after which record() and item() contact TIND directly again.  The
+        default "hard_ttl" is 10 times "soft_ttl".  The counts of fresh and
+        stale hits, refreshes and failed refreshes are reported by stats().
+        '''
+        if soft_ttl is not None:
+            if not recent_cache_size:
+                raise ValueError('soft_ttl requires a nonzero recent_cache_size.')
+            if hard_ttl is None:
+                hard_ttl = 10 * soft_ttl
+            elif hard_ttl < soft_ttl:
+                raise ValueError('hard_ttl must not be less than soft_ttl.')
         self.server_url = server_url
-
-
-    def record(self, tind_id = None, marc_xml = None):
+        self.hedge = hedge
+        self._limiter = RateLimiter(max_rate) if max_rate else None
+        self._concurrency = None
+        if adaptive_concurrency:
+            maximum = max_concurrency or _ADAPTIVE_MAX_CONCURRENCY
+            self._concurrency = AdaptiveLimit(initial = min(4, maximum),
+                                              maximum = maximum)
+        elif max_concurrency:
+            self._concurrency = BoundedSemaphore(max_concurrency)
+        self._client = client
+        self._closed = False            # Set by TindPool.close().
+        self._latency = {'marc'      : LatencyTracker(),
+                         'items'     : LatencyTracker(),
+                         'thumbnail' : LatencyTracker()}
+        self.negative_cache = None
+        if negative_cache_size:
+            self.negative_cache = TTLCache(negative_cache_size, negative_ttl)
+        self._recent = None
+        if recent_cache_size:
+            self._recent = TTLCache(recent_cache_size, hard_ttl)
+        self.soft_ttl = soft_ttl
+        self._hard_ttl = hard_ttl
+        self._snapshot = None
+        self._refreshing = set()
+        self._serving_lock = Lock()
+        self._serving_counts = {'fresh_hits': 0, 'stale_hits': 0, 'misses': 0,
+                                'refreshes': 0, 'refresh_failures': 0,
+                                'deduplicated': 0, 'snapshot_hits': 0}
+
+
+    def record(self, tind_id = None, marc_xml = None, thumbnails = False,
+               timeout = None, hedge = None, stale = False):
         '''Create a TindRecord object given either a TIND id or MARC XML.
 
         Keyword arguments "tind_id" and "marc_xml" are mutually exclusive.
@@ -89,33 +208,55 @@ class Tind():
 
         If neither "tind_id" nor "marc_xml" is given, this method returns an
         empty TindRecord object.
+
+        If "thumbnails" is True, the thumbnail URL of the record is obtained
+        at the same time as the items, instead of when the field
+        "thumbnail_url" is first accessed.
+
+        If "timeout" is given, it is the total time in seconds allowed for
+        all the network requests needed to create the record.  If they are
+        not done in time, this method raises TimedOut, unless "stale" is True
+        and a record for the same tind_id was retrieved earlier, in which
+        case it returns that record.  If "hedge" is given, it overrides the
+        default set by the constructor (see the description there).  If the
+        Tind object was created with a "soft_ttl", recently-retrieved
+        records are returned as described for the constructor.
+
+        Some records in TIND are not for reading materials; for those, the
+        returned record has None as the value of the fields "title",
+        "author", "year" and "edition".  Such blank records, and NotFound
+        results, are kept in the negative cache (see the constructor), and
+        further calls for the same tind_id return the same blank record or
+        raise NotFound without contacting TIND until the entry expires.
         '''
         if tind_id and marc_xml:
             raise ValueError(f'"tind_id" and "marc_xml" are mutually exclusive.')
 
+        hedge = self.hedge if hedge is None else hedge
         if tind_id:
             tind_id = str(tind_id)
             if not tind_id.isdigit():
                 raise ValueError(f'Invalid argument: {tind_id} is not a number.')
-            record = self._record_from_server(_MARCXML_FOR_TIND_ID, tind_id)
+            cached = self._negative_lookup('tind_id', tind_id)
+            if cached is not None:
+                return cached
+            return self._served('tind_id', tind_id, self._record_by_id,
+                                thumbnails, timeout, hedge, stale)
         elif marc_xml:
             if not marc_xml.startswith(b'<?xml'):
                 raise ValueError(f'marc_xml argument does not appear to be XML.')
             record = self._record_from_xml(marc_xml)
-        else:
-            return TindRecord(server_url = self.server_url)
-
-        if record:
-            record.items = self._items_for_tind_id(tind_id or record.tind_id)
-            for item in record.items:
-                item.parent = record
+            deadline = Deadline(timeout) if timeout else None
+            self._add_items(record, record.tind_id, thumbnails, deadline, hedge)
             return record
         else:
-            arg = tind_id if tind_id else 'given XML data'
-            raise NotFound(f'No record found for {arg} in {self.server_url}')
+            record = TindRecord(server_url = self.server_url)
+            record._tind = self
+            return record
 
 
-    def item(self, barcode = None):
+    def item(self, barcode = None, thumbnails = False, timeout = None,
+             hedge = None, stale = False):
         '''Create a TindItem object given a barcode value.
 
         This will contact the TIND server and perform a search using the
@@ -126,171 +267,706 @@ class Tind():
         given the TindItem object.)
 
         If the TIND server does not return a result for the barcode, this
-        method raises a NotFound exception.
+        method raises a NotFound exception.  The barcode is then remembered
+        in the negative cache (see the constructor), and further calls for
+        the same barcode raise NotFound without contacting TIND until the
+        entry expires.
 
         If no barcode is given, this returns an empty TindItem object.
+
+        If "thumbnails" is True, the thumbnail URL of the parent record is
+        obtained at the same time as the items.  The arguments "timeout",
+        "hedge" and "stale" have the same meaning as for record().
         '''
         if not barcode:
             return TindItem()
         barcode = str(barcode)
         if not barcode.isdigit():
             raise ValueError(f'Invalid argument: {barcode} is not a number.')
-        record = self._record_from_server(_MARCXML_FOR_BARCODE, barcode)
-        if record:
-            record.items = self._items_for_tind_id(record.tind_id)
-            for item in record.items:
-                item.parent = record
-            for item in record.items:
-                if item.barcode == barcode:
-                    return item
-            raise DataMismatchError('Unable to match item to record from TIND.')
+        self._negative_lookup('barcode', barcode)
+        hedge = self.hedge if hedge is None else hedge
+        return self._served('barcode', barcode, self._item_by_barcode,
+                            thumbnails, timeout, hedge, stale)
+
+
+    def records(self, tind_ids, **kwargs):
+        '''Yield TindRecord objects for all the TIND ids in "tind_ids".
+
+        This is a convenience method that creates a TindPipeline using the
+        keyword arguments given (if any) and returns the result of calling
+        its records() method.  The retrieval of one record overlaps with the
+        retrieval and parsing of others, which makes this much faster than
+        calling record() in a loop.  Records are produced in the order they
+        are completed.  Ids for which no record can be obtained are skipped;
+        to find out which ones failed, or to get performance statistics,
+        create a pipeline using the method pipeline() and use it directly.
+        '''
+        return self.pipeline(**kwargs).records(tind_ids)
+
+
+    def records_table(self, tind_ids, jobs = None):
+        '''Return a TindTable holding the records "tind_ids" and their items.
+
+        Unlike records(), this does not create TindRecord and TindItem
+        objects: the field values are stored directly in columns, with the
+        items in a child table keyed by tind_id.  The table can be converted
+        to Arrow tables, Parquet files or NumPy arrays; see TindTable.  Up to
+        "jobs" records are retrieved in parallel; the default is 4, or with
+        adaptive concurrency, the highest limit it can reach.  Thumbnail
+        URLs are not included.
+        '''
+        from .table import table_from_server
+        return table_from_server(self, tind_ids, jobs = jobs)
+
+
+    def pipeline(self, **kwargs):
+        '''Return a TindPipeline for bulk retrieval from this server.
+
+        The keyword arguments are passed to the TindPipeline constructor.
+        '''
+        from .pipeline import TindPipeline
+        return TindPipeline(self, **kwargs)
+
+
+    def watch_items(self, tind_ids, callback = None, **kwargs):
+        '''Return an ItemWatcher that polls the items of records "tind_ids".
+
+        The watcher reports changes in the items of the records, such as
+        changes in circulation status or location, as ItemChange objects.
+        Records whose items change are polled more often than records whose
+        items stay the same.  If "callback" is given, it is called with every
+        change.  Other keyword arguments are passed to the ItemWatcher
+        constructor.  Example of use:
+
+            with tind.watch_items(ids, min_interval = 30) as watcher:
+                for change in watcher:
+                    print(change.barcode, change.new.status if change.new else '')
+        '''
+        from .watch import ItemWatcher
+        return ItemWatcher(self, tind_ids, callback = callback, **kwargs)
+
+
+    def prefetch_thumbnails(self, records, timeout = None, hedge = None):
+        '''Obtain the thumbnail URLs of the TindRecord objects in "records".
+
+        The thumbnail URL of a record is normally requested from TIND the
+        first time the field "thumbnail_url" of the record is accessed, which
+        means that accessing the field on many records makes many requests
+        one after another.  This method instead makes the requests for all
+        the records concurrently, so that later accesses of the field do not
+        contact TIND.  Thumbnail URLs are cached and shared between all
+        TindRecord objects for the same record id.  If the lookup fails for
+        a record, its thumbnail is requested again when the field is
+        accessed.  Returns the list of records.
+
+        If "timeout" is given, it is the time in seconds allowed for all the
+        lookups; thumbnails that are not obtained in time are left to be
+        requested when the field is accessed.  If "hedge" is given, it
+        overrides the default set by the constructor.
+        '''
+        records = list(records)
+        pending = [r for r in records if r.tind_id and r._saved_thumbnail_url is None]
+        if not pending:
+            return records
+        if __debug__: log(f'prefetching thumbnails for {len(pending)} records')
+        deadline = Deadline(timeout) if timeout else None
+        options = self._net_options('thumbnail', deadline, hedge)
+        executor = background_executor()
+        futures = [executor.submit(r._thumbnail_for_record, **options)
+                   for r in pending]
+        for record, future in zip(pending, futures):
+            try:
+                _save_thumbnail(record, future, deadline)
+            except TimedOut:
+                if __debug__: log(f'out of time for thumbnail of {record.tind_id}')
+        return records
+
+
+    def save_snapshot(self, path, records):
+        '''Write the TindRecord objects in "records" to a snapshot file.
+
+        The snapshot consists of the file "path" and an index file named
+        "path" plus ".idx".  It can be opened by load_snapshot() in this or
+        other processes.  Example of use:
+
+            tind.save_snapshot('hot.snap', tind.records(hot_ids))
+
+        Returns the number of records written.
+        '''
+        from .snapshot import write_snapshot
+        return write_snapshot(path, records, server_url = self.server_url)
+
+
+    def load_snapshot(self, path):
+        '''Use the snapshot at "path" as a source of records and items.
+
+        The snapshot files are memory-mapped, so this takes little time and
+        memory, and processes that load the same snapshot share the pages
+        cached by the operating system.  Afterwards, record() and item()
+        return records and items from the snapshot (decoding only the ones
+        requested) instead of contacting TIND.  In stale-while-revalidate
+        mode (see the constructor), values from the snapshot are treated as
+        having been retrieved when the snapshot was written: values older
+        than "soft_ttl" are refreshed in the background, and values older
+        than "hard_ttl" are not used.  Passing None removes the snapshot.
+        Returns the Snapshot object, or None.
+        '''
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+        if path is not None:
+            from .snapshot import Snapshot
+            self._snapshot = Snapshot(path, server_url = self.server_url)
+        return self._snapshot
+
+
+    def profile(self, memory = True, cprofile = None, stacks = None,
+                interval = 0.005):
+        '''Return a Profile context manager for measuring Topi's work.
+
+        While the profile is active, the time spent and the memory allocated
+        in each phase of the work (waiting for the network, pausing for rate
+        limits, parsing, decoding, cleaning up values and creating objects)
+        are recorded.  If "cprofile" is a file name, cProfile statistics of
+        the calling thread (only) are written to it, which suits calls such
+        as record() that do their work in the calling thread; for the bulk
+        methods, which work in other threads, use "stacks".  If "stacks" is
+        a file name, stack samples of all threads taken every "interval"
+        seconds are written to it in the folded format used by flame graph
+        tools.  If "memory" is False, allocations are not traced, which
+        reduces the overhead of profiling.  Example of use:
+
+            with tind.profile(stacks = 'batch.folded') as p:
+                records = list(tind.records(ids))
+            print(p.report())
+
+        Note that the profile records the work done by all Tind objects
+        while it is active, not only this one.
+        '''
+        from .profile import Profile
+        return Profile(memory = memory, cprofile = cprofile, stacks = stacks,
+                       interval = interval)
+
+
+    def purge_negative_cache(self, tind_ids = None, barcodes = None):
+        '''Remove entries from the negative cache.
+
+        If neither "tind_ids" nor "barcodes" is given, all entries are
+        removed; otherwise, only the entries for the given ids are removed.
+        '''
+        if self.negative_cache is None:
+            return
+        if tind_ids is None and barcodes is None:
+            self.negative_cache.clear()
+            return
+        for id in (tind_ids or []):
+            self.negative_cache.discard(('tind_id', str(id)))
+        for barcode in (barcodes or []):
+            self.negative_cache.discard(('barcode', str(barcode)))
+
+
+    def stats(self):
+        '''Return a dictionary of statistics about this Tind object.
+
+        The dictionary contains the counts of hits, stale hits and refreshes
+        in stale-while-revalidate mode (see the constructor), the statistics
+        of the negative cache and of the cache of recent records, and for
+        each kind of request ("marc", "items" and "thumbnail"), the 50th,
+        95th and 99th percentiles of recent response times and the number of
+        hedged requests sent.  If adaptive_concurrency is on, the key
+        "concurrency" gives the statistics of the AdaptiveLimit.
+        '''
+        with self._serving_lock:
+            serving = dict(self._serving_counts)
+        return {'serving'        : serving,
+                'negative_cache' : (self.negative_cache.stats()
+                                    if self.negative_cache is not None else None),
+                'recent_cache'   : (self._recent.stats()
+                                    if self._recent is not None else None),
+                'latency'        : {kind: tracker.stats()
+                                    for kind, tracker in self._latency.items()},
+                'concurrency'    : (self._concurrency.stats()
+                                    if isinstance(self._concurrency, AdaptiveLimit)
+                                    else None)}
+
+
+    def _bulk_workers(self):
+        '''Return the default number of worker threads of the bulk methods.'''
+        if isinstance(self._concurrency, AdaptiveLimit):
+            return self._concurrency.maximum
+        return 4
+
+
+    def _net_options(self, kind, deadline = None, hedge = None):
+        '''Return keyword arguments for result_from_api() for this server.'''
+        if self._closed:
+            raise TindError(f'The connections to {self.server_url} have been closed')
+        return {'limiter'     : self._limiter,
+                'deadline'    : deadline,
+                'latency'     : self._latency[kind],
+                'hedge'       : self.hedge if hedge is None else hedge,
+                'client'      : self._client,
+                'concurrency' : self._concurrency}
+
+
+    def _record_by_id(self, tind_id, thumbnails, timeout, hedge):
+        '''Get the record for "tind_id" from TIND and update the caches.'''
+        deadline = Deadline(timeout) if timeout else None
+        record = self._record_from_server(_MARCXML_FOR_TIND_ID, tind_id,
+                                          deadline, hedge)
+        if not record:
+            self._remember_missing('tind_id', tind_id, _NOT_FOUND)
+            raise NotFound(f'No record found for {tind_id} in {self.server_url}')
+        self._add_items(record, tind_id, thumbnails, deadline, hedge)
+        if _is_blank(record):
+            self._remember_missing('tind_id', tind_id, record)
         else:
+            self._remember_recent('tind_id', tind_id, record)
+        return record
+
+
+    def _item_by_barcode(self, barcode, thumbnails, timeout, hedge):
+        '''Get the item for "barcode" from TIND and update the caches.'''
+        deadline = Deadline(timeout) if timeout else None
+        record = self._record_from_server(_MARCXML_FOR_BARCODE, barcode,
+                                          deadline, hedge)
+        if not record:
+            self._remember_missing('barcode', barcode, _NOT_FOUND)
             raise NotFound(f'No record found for {barcode} in {self.server_url}')
+        self._add_items(record, record.tind_id, thumbnails, deadline, hedge)
+        for item in record.items:
+            if item.barcode == barcode:
+                self._remember_recent('barcode', barcode, item)
+                return item
+        raise DataMismatchError('Unable to match item to record from TIND.')
+
+
+    def _served(self, kind, id, fetch, thumbnails, timeout, hedge, stale):
+        '''Return the value for "id", calling "fetch" to get it if necessary.
+
+        In stale-while-revalidate mode (see the constructor), this returns a
+        recent value or a value from the snapshot if there is one, starting a
+        background refresh if the value is older than the soft TTL.  In the
+        other mode, it returns the value from the snapshot if there is one.
+        Otherwise, it calls "fetch".
+        '''
+        if self.soft_ttl is not None:
+            entry = self._recent_entry(kind, id) or self._snapshot_entry(kind, id)
+            if entry:
+                value, age = entry
+                if age < self.soft_ttl:
+                    self._count('fresh_hits')
+                else:
+                    self._count('stale_hits')
+                    self._refresh(kind, id, fetch, hedge)
+                return value
+            self._count('misses')
+        else:
+            # Values from the snapshot are kept among the recent values, so
+            # that each is decoded once; values fetched from TIND are not
+            # served from there in this mode.
+            entry = (self._recent_entry(kind, id, from_snapshot = True)
+                     or self._snapshot_entry(kind, id))
+            if entry:
+                return entry[0]
+        try:
+            return fetch(id, thumbnails, timeout, hedge)
+        except TimedOut:
+            return self._recent_or_raise(kind, id, stale)
+
+
+    def _refresh(self, kind, id, fetch, hedge):
+        '''Start a background refresh of "id", unless one is in progress.'''
+        key = (kind, id)
+        with self._serving_lock:
+            if key in self._refreshing:
+                self._serving_counts['deduplicated'] += 1
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                # Thumbnails are not requested here, because doing so would
+                # make this task wait on another task in the same pool.
+                fetch(id, False, None, hedge)
+                self._count('refreshes')
+            except NotFound:
+                # The record is gone from TIND; stop serving the old value.
+                self._recent.discard(key)
+                self._count('refresh_failures')
+            except Exception as ex:
+                if __debug__: log(f'failed to refresh {kind} {id}: {str(ex)}')
+                self._count('refresh_failures')
+            finally:
+                with self._serving_lock:
+                    self._refreshing.discard(key)
+
+        if __debug__: log(f'refreshing {kind} {id} in the background')
+        refresh_executor().submit(refresh)
+
+
+    def _count(self, counter):
+        with self._serving_lock:
+            self._serving_counts[counter] += 1
+
+
+    def _recent_entry(self, kind, id, from_snapshot = False):
+        '''Return (value, age in seconds) for "id" if there is one, or None.
+
+        If "from_snapshot" is True, only a value that was read from the
+        snapshot currently loaded is returned.
+        '''
+        if self._recent is None:
+            return None
+        entry = self._recent.get((kind, id))
+        if entry is None:
+            return None
+        if from_snapshot and (len(entry) < 3 or entry[2] is not self._snapshot):
+            return None
+        return (entry[0], monotonic() - entry[1])
 
 
-    def _record_from_server(self, url_template, id):
+    def _snapshot_entry(self, kind, id):
+        '''Return (value, age in seconds) for "id" from the snapshot, or None.
+
+        The value is also stored in the cache of recent values, so that the
+        snapshot is read at most once for a given id.
+        '''
+        if self._snapshot is None:
+            return None
+        age = max(0, time() - self._snapshot.created)
+        if self._hard_ttl is not None and age >= self._hard_ttl:
+            return None
+        if kind == 'tind_id':
+            value = self._snapshot.record(id)
+        else:
+            value = self._snapshot.item(id)
+        if value is None:
+            return None
+        (value if kind == 'tind_id' else value.parent)._tind = self
+        self._count('snapshot_hits')
+        if self._recent is not None:
+            ttl = None if self._hard_ttl is None else self._hard_ttl - age
+            # The third element records which snapshot the value came from.
+            entry = (value, monotonic() - age, self._snapshot)
+            self._recent.set((kind, id), entry, ttl)
+        return (value, age)
+
+
+    def _recent_or_raise(self, kind, id, stale):
+        '''Return the recent value for "id" if "stale", else raise TimedOut.'''
+        entry = self._recent_entry(kind, id) if stale else None
+        if entry:
+            if __debug__: log(f'out of time; returning stale value for {id}')
+            return entry[0]
+        raise TimedOut(f'Out of time getting {id} from {self.server_url}')
+
+
+    def _remember_recent(self, kind, id, value):
+        '''Store a successfully-retrieved record or item.'''
+        if self._recent is not None:
+            _compress_xml(value)
+            self._recent.set((kind, id), (value, monotonic()))
+
+
+    def _negative_lookup(self, kind, id):
+        '''Check the negative cache for the "id" of the given "kind".
+
+        Raises NotFound if TIND is known to have nothing for the id, returns
+        the blank TindRecord if the record is known to be blank, and returns
+        None if the negative cache has no entry for the id.
+        '''
+        if self.negative_cache is None:
+            return None
+        value = self.negative_cache.get((kind, id))
+        if value is _NOT_FOUND:
+            if __debug__: log(f'negative cache hit for {kind} {id}')
+            raise NotFound(f'No record found for {id} in {self.server_url}')
+        return value
+
+
+    def _remember_missing(self, kind, id, value):
+        '''Store _NOT_FOUND or a blank record in the negative cache.'''
+        if self.negative_cache is not None:
+            if __debug__: log(f'adding {kind} {id} to negative cache')
+            _compress_xml(value)
+            self.negative_cache.set((kind, id), value)
+
+
+    def _add_items(self, record, tind_id, thumbnails = False, deadline = None,
+                   hedge = None):
+        '''Add the items of "tind_id" to "record", and maybe its thumbnail.'''
+        if thumbnails and record.tind_id:
+            # Overlap the thumbnail request with the request for the items.
+            options = self._net_options('thumbnail', deadline, hedge)
+            future = background_executor().submit(record._thumbnail_for_record,
+                                                  **options)
+            record.items = self._items_for_tind_id(tind_id, deadline, hedge)
+            try:
+                _save_thumbnail(record, future, deadline)
+            except TimedOut:
+                # The thumbnail is requested again if the field is accessed.
+                if __debug__: log(f'out of time for thumbnail of {record.tind_id}')
+        else:
+            record.items = self._items_for_tind_id(tind_id, deadline, hedge)
+        for item in record.items:
+            item.parent = record
+
+
+    def _record_from_server(self, url_template, id, deadline = None, hedge = None):
         '''Create a TindRecord by contacting "url_template" with the "id".'''
+        xml = self._marc_from_server(url_template, id, deadline, hedge)
+        return self._record_from_xml(xml) if xml else None
+
+
+    def _marc_from_server(self, url_template, id, deadline = None, hedge = None):
+        '''Return the raw MARC XML obtained from "url_template" with the "id".'''
         def response_handler(resp):
             if not resp or not resp.content:
                 if __debug__: log(f'got no response for {endpoint}')
-                return
-            record = self._record_from_xml(resp.content)
-            return record
+                return None
+            return resp.content
 
         endpoint = url_template.format(self.server_url, id)
-        return result_from_api(endpoint, response_handler)
+        return result_from_api(endpoint, response_handler,
+                               **self._net_options('marc', deadline, hedge))
 
 
     def _record_from_xml(self, xml):
         '''Initialize this record given MARC XML as a string.'''
-
-        record = TindRecord(server_url = self.server_url)
+        fields = self._fields_from_xml(xml)
+        with phase('construct'):
+            record = TindRecord._from_fields(self.server_url, fields)
+        record._tind = self
         # Save the XML internally in case it's useful.
         record._xml = xml
+        return record
 
-        # Parse the XML.
-        if __debug__: log(f'parsing MARC XML {len(xml)} chars long')
-        try:
-            parser = etree.XMLParser(recover = True)
-            tree = etree.fromstring(xml, parser = parser)
-        except Exception as ex:
-            raise ValueError(f'Bad XML')
-        if len(tree) == 0:             # Blank record.
-            if __debug__: log(f'blank record -- no values parsed')
-            return record
-        elements = tree.find(ELEM_RECORD)
-        subtitle = None
-        for element in elements.findall(ELEM_CONTROLFIELD):
-            if element.attrib['tag'] == '001':
-                record.tind_id = element.text.strip()
-            elif element.attrib['tag'] == '008':
-                record.year = element.text[7:11].strip()
-                if not record.year.isdigit():
-                    record.year = ''
-
-        main_author = None
-        for element in elements.findall(ELEM_DATAFIELD):
-            if element.attrib['tag'] == '250':
-                record.edition = element.find(ELEM_SUBFIELD).text.strip()
-            elif element.attrib['tag'] == '050':
-                record.call_no = ''
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    record.call_no += subfield.text.strip() + ' '
-            elif element.attrib['tag'] == '100':
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    if subfield.attrib['code'] == 'a':
-                        main_author = subfield.text.strip()
-            elif element.attrib['tag'] == '245':
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    if subfield.attrib['code'] == 'a':
-                        text = subfield.text.strip()
-                        # The title sometimes contains the author names too.
-                        record.title, record.author = parsed_title_and_author(text)
-                    elif subfield.attrib['code'] == 'b':
-                        record.subtitle = subfield.text.strip()
-                    elif subfield.attrib['code'] == 'c':
-                        record.author = subfield.text.strip()
-            elif element.attrib['tag'] == '020':
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    # Value is sometimes of the form "1429224045 (hbk.)"
-                    value = subfield.text.split()[0]
-                    if value.isdigit():
-                        record.isbn_issn.append(value)
-            elif element.attrib['tag'] == '300':
-                parts = [sub.text.strip() for sub in element.findall(ELEM_SUBFIELD)]
-                record.description = ' '.join(parts)
-            elif element.attrib['tag'] == '504':
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    if subfield.attrib['code'] == 'a':
-                        record.note = subfield.text.strip()
-            elif element.attrib['tag'] == '260':
-                for subfield in element.findall(ELEM_SUBFIELD):
-                    if subfield.attrib['code'] == 'b':
-                        record.publisher = subfield.text.strip()
+
+    def _fields_from_xml(self, xml):
+        '''Return a dictionary of record field values parsed from MARC XML.
+
+        Fields for which the XML has no value are omitted from the result.
+        This does the parsing for _record_from_xml().  (records_table() uses
+        _raw_fields_from_xml() instead, and cleans up the fields of a whole
+        chunk of records together.)
+        '''
+        fields = self._raw_fields_from_xml(xml)
+        with phase('cleanup'):
+            _clean_fields([fields])
+        return fields
+
+
+    def _raw_fields_from_xml(self, xml):
+        '''Return the fields parsed from MARC XML, before their cleanup.'''
+        fields = {}
+
+        with phase('parse'):
+            # Parse the XML.  (lxml is imported here to make "import topi" fast.)
+            from lxml import etree
+            if __debug__: log(f'parsing MARC XML {len(xml)} chars long')
+            try:
+                parser = etree.XMLParser(recover = True)
+                tree = etree.fromstring(xml, parser = parser)
+            except Exception as ex:
+                raise ValueError(f'Bad XML')
+            if len(tree) == 0:             # Blank record.
+                if __debug__: log(f'blank record -- no values parsed')
+                return fields
+
+            # Visit the fields in a single pass, in document order.  Values
+            # set by a later field of the same tag replace earlier ones.
+            main_author = None
+            for element in tree.find(ELEM_RECORD):
+                kind = element.tag
+                tag = element.get('tag')
+                if kind == ELEM_CONTROLFIELD:
+                    if tag == '001':
+                        fields['tind_id'] = element.text.strip()
+                    elif tag == '008':
+                        year = element.text[7:11].strip()
+                        fields['year'] = year if year.isdigit() else ''
+                    continue
+                if kind != ELEM_DATAFIELD or tag not in _DATAFIELD_TAGS:
+                    continue
+                subfields = element.findall(ELEM_SUBFIELD)
+                if tag == '250':
+                    fields['edition'] = subfields[0].text.strip()
+                elif tag == '050':
+                    fields['call_no'] = ''.join(sub.text.strip() + ' '
+                                                for sub in subfields)
+                elif tag == '100':
+                    for subfield in subfields:
+                        if subfield.get('code') == 'a':
+                            main_author = subfield.text.strip()
+                elif tag == '245':
+                    for subfield in subfields:
+                        code = subfield.get('code')
+                        if code == 'a':
+                            text = subfield.text.strip()
+                            # The title sometimes contains the author names too.
+                            fields['title'], fields['author'] = parsed_title_and_author(text)
+                        elif code == 'b':
+                            fields['subtitle'] = subfield.text.strip()
+                        elif code == 'c':
+                            fields['author'] = subfield.text.strip()
+                elif tag == '020':
+                    for subfield in subfields:
+                        # Value is sometimes of the form "1429224045 (hbk.)"
+                        value = subfield.text.split()[0]
+                        if value.isdigit():
+                            fields.setdefault('isbn_issn', []).append(value)
+                elif tag == '300':
+                    fields['description'] = ' '.join(sub.text.strip()
+                                                      for sub in subfields)
+                elif tag == '504':
+                    for subfield in subfields:
+                        if subfield.get('code') == 'a':
+                            fields['note'] = subfield.text.strip()
+                elif tag == '260':
+                    for subfield in subfields:
+                        if subfield.get('code') == 'b':
+                            fields['publisher'] = subfield.text.strip()
 
         # We get author from 245 because in our entries, it's frequently part
         # of the title statement. If it's not, but we got an author from 100
         # use that.  100 only lists first author, but it's better than nothing.
-        if record.author:
-            if record.author.startswith('by'):
-                record.author = record.author[2:].strip()
-            elif record.author.startswith('edited by'):
-                record.author = record.author[10:].strip()
+        author = fields.get('author')
+        if author:
+            if author.startswith('by'):
+                fields['author'] = author[2:].strip()
+            elif author.startswith('edited by'):
+                fields['author'] = author[10:].strip()
         elif main_author:
-            record.author = main_author
+            fields['author'] = main_author
 
         # Caltech's TIND database contains some things that are not reading
         # materials per se. The following is an attempt to weed those out.
-        if sum([not record.author, not record.year, not record.title]) > 1:
+        if sum([not fields.get('author'), not fields.get('year'),
+                not fields.get('title')]) > 1:
             for field in ['title', 'author', 'year', 'call_no', 'edition']:
-                setattr(record, field, None)
-            return record
+                fields[field] = None
+        return fields
 
-        # Some cleanup work is better left until after we obtain all values.
-        record.author      = cleaned(record.author)
-        record.title       = cleaned(record.title)
-        record.edition     = cleaned(record.edition)
-        record.subtitle    = cleaned(record.subtitle)
-        record.description = cleaned(record.description)
-        record.publisher   = cleaned(record.publisher)
 
-        return record
+    def _items_for_tind_id(self, id, deadline = None, hedge = None):
+        '''Return a list of TindItem objects for the TIND record "id".'''
+        return self._items_from_json(self._items_json_for_tind_id(id, deadline, hedge))
 
 
-    def _items_for_tind_id(self, id):
-        '''Return a list of TindItem objects for the TIND record "id".'''
+    def _items_json_for_tind_id(self, id, deadline = None, hedge = None):
+        '''Return the raw JSON (as bytes) of the item data for TIND record "id".'''
         def response_handler(resp):
-            results = []
-            if not resp or not resp.text:
-                return []
-            try:
-                data = json.loads(resp.text)
-            except JSONDecodeError as ex:
-                raise TindError(f'Malformed result from {self.server_url}: str(ex)')
-            except TypeError as ex:
-                raise DataMismatchError(f'Unexpected data returned by {self.server_url}.')
-
-            if 'items' not in data:
-                if __debug__: log(f'results from server missing "items" key')
-                raise TindError(f'Unexpected result from {self.server_url}')
-            for item in data['items']:
-                results.append(TindItem(barcode     = item.get('barcode', ''),
-                                        type        = item.get('item_type', ''),
-                                        volume      = item.get('item_volume', ''),
-                                        call_number = item.get('call_number', ''),
-                                        description = item.get('description', ''),
-                                        library     = item.get('library', '',),
-                                        location    = item.get('location', ''),
-                                        status      = item.get('status', '')))
-            return results
+            # commonpy's net() reads resp.text, so the response has usually
+            # been decoded to a string already and the bytes are no faster
+            # to parse; only requests with a time limit or hedging are not
+            # decoded first, and for them the bytes save decoding.
+            if not resp or not resp.content:
+                return None
+            return resp.content
 
         endpoint = _ITEMS_FOR_TIND_ID.format(self.server_url, id)
-        return result_from_api(endpoint, response_handler)
+        return result_from_api(endpoint, response_handler,
+                               **self._net_options('items', deadline, hedge))
+
+
+    def _items_from_json(self, text):
+        '''Return a list of TindItem objects created from the JSON "text".'''
+        items = self._item_fields_from_json(text)
+        with phase('construct'):
+            return [TindItem._from_fields(fields) for fields in items]
+
+
+    def _item_fields_from_json(self, text):
+        '''Return a list of dictionaries of item field values from "text".
+
+        The value of "text" can be a string or bytes.
+        '''
+        if not text:
+            return []
+        try:
+            with phase('decode'):
+                data = _json_loads()(text)
+        except ValueError as ex:
+            raise TindError(f'Malformed result from {self.server_url}: str(ex)')
+        except TypeError as ex:
+            raise DataMismatchError(f'Unexpected data returned by {self.server_url}.')
+
+        if 'items' not in data:
+            if __debug__: log(f'results from server missing "items" key')
+            raise TindError(f'Unexpected result from {self.server_url}')
+        return [{'barcode'     : item.get('barcode', ''),
+                 'type'        : item.get('item_type', ''),
+                 'volume'      : item.get('item_volume', ''),
+                 'call_number' : item.get('call_number', ''),
+                 'description' : item.get('description', ''),
+                 'library'     : item.get('library', '',),
+                 'location'    : item.get('location', ''),
+                 'status'      : item.get('status', '')}
+                for item in data['items']]
+
 
-
 # Miscellaneous helpers.
 # .............................................................................
 
+def _save_thumbnail(record, future, deadline = None):
+    '''Store the thumbnail URL computed by "future" in "record", if possible.
+
+    If "deadline" is given, this waits for the future only until then, and
+    raises TimedOut if the future has not finished.
+    '''
+    timeout = deadline.remaining() if deadline else None
+    try:
+        record._saved_thumbnail_url = future.result(timeout = timeout)
+    except Exception as ex:
+        if not future.done():
+            raise TimedOut(f'No thumbnail for {record.tind_id} within {deadline.seconds}s')
+        if __debug__: log(f'failed to get thumbnail for {record.tind_id}: {ex}')
+
+
+def _compress_xml(value):
+    '''Compress the MARC XML of "value" (a record or an item) to keep it.'''
+    record = value.parent if isinstance(value, TindItem) else value
+    if isinstance(record, TindRecord):
+        record._compress_xml()
+
+
+def _json_loads():
+    '''Return the fastest available function for decoding JSON.'''
+    global _loads
+    if _loads is None:
+        # orjson is optional; it decodes TIND's item data about twice as fast.
+        try:
+            from orjson import loads
+        except ImportError:
+            from json import loads
+        _loads = loads
+    return _loads
+
+_loads = None
+
+
+def _is_blank(record):
+    '''Return True if "record" has no data or is not for reading material.'''
+    return not record.tind_id or record.title is None
+
+
+def _clean_fields(records):
+    '''Clean up the values of _CLEANED_FIELDS in the dictionaries "records".
+
+    This does what calling cleaned() on each value would, but one field at a
+    time across all the records, without a function call per value.  Blank
+    records and records that are not for reading material (whose title is
+    None) are left alone.
+    '''
+    records = [fields for fields in records
+               if fields and fields.get('title', '') is not None]
+    for field in _CLEANED_FIELDS:
+        for fields in records:
+            text = fields.get(field, '')
+            fields[field] = text.rstrip('./,').strip() if text else text
+
+
 def cleaned(text):
     '''Mildly clean up the given text string.'''
     if not text:
@@ -301,22 +977,21 @@ def cleaned(text):
 
 def parsed_title_and_author(text):
     '''Extract a title and authors (if present) from the given text string.'''
-    title = None
+    title = text
     author = None
-    if text.find('/') > 0:
-        start = text.find('/')
-        title = text[:start].strip()
-        author = text[start + 3:].strip()
-    elif text.find('[by]') > 0:
-        start = text.find('[by]')
-        title = text[:start].strip()
-        author = text[start + 5:].strip()
-    elif text.rfind(', by') > 0:
-        start = text.rfind(', by')
-        title = text[:start].strip()
-        author = text[start + 5:].strip()
-    else:
-        title = text
+    # One scan finds the first "/", the first "[by]" and the last ", by".
+    found = {}
+    for match in _TITLE_SEPARATORS.finditer(text):
+        separator = match.group()
+        if separator not in found or separator == ', by':
+            found[separator] = match.start()
+    # The separators are used in order of preference, if not at the start.
+    for separator, skip in _TITLE_SEPARATOR_SKIPS:
+        start = found.get(separator, 0)
+        if start > 0:
+            title = text[:start].strip()
+            author = text[start + skip:].strip()
+            break
     if title.endswith(':'):
         title = title[:-1].strip()
     return title, author
@@ -14,14 +14,15 @@ is open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
-from   commonpy.interrupt import wait
-from   commonpy.network_utils import net
-from   commonpy.exceptions import NoContent, ServiceFailure, RateLimitExceeded
+from   collections import deque
+from   threading import Condition, Lock
+from   time import monotonic, sleep, time
 
 if __debug__:
-    from sidetrack import log
+    from .debug import log
 
 from .exceptions import *
+from .profile import phase
 
 
 # Internal Constants.
@@ -32,13 +33,89 @@ from .exceptions import *
 _RATE_LIMIT_SLEEP = 15
 _MAX_SLEEP_CYCLES = 8
 
+# Network timeout in seconds for requests made without commonpy's net().
+# This is the same as the one net() uses when it creates its own clients.
+_NETWORK_TIMEOUT = 15
+
+# Maximum number of threads in each of the thread pools used by Topi.  The
+# "background" pool runs tasks such as thumbnail lookups for callers; the
+# "requests" pool runs the individual network requests of calls that have a
+# deadline or use hedging.  Tasks in the first pool may wait on tasks in the
+# second, but not vice versa, so they must be separate pools.  The "refresh"
+# pool runs the background refreshes of stale-while-revalidate serving; it is
+# small and separate, so that slow refreshes (which retry and pause like any
+# request without a deadline) cannot hold up lookups that callers wait for.
+_MAX_POOL_THREADS = {'background': 16, 'requests': 32, 'refresh': 4}
+
+# Lazily-created thread pools, keyed by name.
+_pools = {}
+_pools_lock = Lock()
+
+# Settings of AdaptiveLimit.  The limit grows while fewer than _VEGAS_ALPHA
+# requests are estimated to be queued at the server, shrinks when more than
+# _VEGAS_BETA are, and is multiplied by _BACKOFF on a rate-limit response.
+# Every _PROBE_WINDOWS windows, the base latency is measured afresh.
+_VEGAS_ALPHA = 2
+_VEGAS_BETA = 4
+_BACKOFF = 0.5
+_PROBE_WINDOWS = 20
+_MAX_DECISIONS = 100
+
+# Rate-limit gates, keyed by the host part of endpoint URLs.
+_gates = {}
+_gates_lock = Lock()
+
 
 # Exported functions.
 # .............................................................................
 
-def result_from_api(endpoint, result_producer, retry = 0):
-    '''Do HTTP GET on "endpoint" & return results of calling result_producer.'''
-    (resp, error) = net('get', endpoint)
+def result_from_api(endpoint, result_producer, retry = 0, limiter = None,
+                    deadline = None, latency = None, hedge = False,
+                    client = None, concurrency = None):
+    '''Do HTTP GET on "endpoint" & return results of calling result_producer.
+
+    If "limiter" is not None, it must be a RateLimiter object; its wait()
+    method is called before every network request made by this function.
+
+    If "deadline" is not None, it must be a Deadline object.  If the result
+    is not obtained before the deadline, this raises TimedOut instead of
+    continuing to wait for the server; in particular, it will not pause for
+    a rate limit if the pause would go past the deadline.
+
+    When a server responds that its rate limit has been exceeded, the
+    RateLimitGate for the server is closed, so that all threads pause their
+    requests to that server (not only the one that got the response), and
+    the request is tried again when the gate opens.
+
+    If "latency" is not None, it must be a LatencyTracker object; the time
+    taken by every request is recorded in it.  If "hedge" is True as well,
+    and the request has not finished after the 95th percentile of recorded
+    latencies, a second, identical request is sent, and the result of
+    whichever request finishes first is used.
+
+    If "client" is not None, it must be an httpx.Client object, which is used
+    for the network requests so that its connections can be reused.  If
+    "concurrency" is not None, it must be a semaphore or an AdaptiveLimit;
+    it is held while the request is in progress, to limit the number of
+    concurrent requests.  A request abandoned at the deadline holds it until
+    the request ends.  An AdaptiveLimit is also told the outcome of the
+    request, which it uses to adjust the limit.
+    '''
+    # This is imported here, when first needed, to make "import topi" fast.
+    from commonpy.exceptions import NoContent, RateLimitExceeded
+
+    gate = rate_limit_gate(endpoint)
+    with phase('rate_limit'):
+        gate.wait(deadline)
+        if limiter:
+            limiter.wait()
+        if concurrency:
+            timeout = deadline.remaining() if deadline else None
+            if not concurrency.acquire(timeout = timeout):
+                raise TimedOut(f'Out of time waiting to contact {endpoint}')
+    # _get() releases the concurrency slot when the request has ended.
+    with phase('network'):
+        (resp, error) = _get(endpoint, deadline, latency, hedge, client, concurrency)
     if not error:
         if __debug__: log(f'got result from {endpoint}')
         return result_producer(resp)
@@ -49,9 +126,493 @@ def result_from_api(endpoint, result_producer, retry = 0):
         retry += 1
         if retry > _MAX_SLEEP_CYCLES:
             raise TindError(f'Rate limit exceeded for {endpoint}')
-        else:
-            if __debug__: log(f'hit rate limit; pausing {_RATE_LIMIT_SLEEP}s')
-            wait(_RATE_LIMIT_SLEEP)
-            return result_from_api(endpoint, result_producer, retry = retry)
+        gate.close(_RATE_LIMIT_SLEEP)
+        if deadline and deadline.remaining() <= gate.remaining():
+            raise TimedOut(f'Rate limited by server and out of time for {endpoint}')
+        # The recursive call waits at the gate before trying again.
+        return result_from_api(endpoint, result_producer, retry = retry,
+                               limiter = limiter, deadline = deadline,
+                               latency = latency, hedge = hedge,
+                               client = client, concurrency = concurrency)
     else:
         raise TindError(f'Problem contacting {endpoint}: {str(error)}')
+
+
+def background_executor():
+    '''Return a thread pool shared by Topi for concurrent network requests.'''
+    return _thread_pool('background')
+
+
+def refresh_executor():
+    '''Return the thread pool shared by Topi for background refreshes.'''
+    return _thread_pool('refresh')
+
+
+def rate_limit_gate(endpoint):
+    '''Return the RateLimitGate shared by all requests to endpoint's host.'''
+    from urllib.parse import urlsplit
+    host = urlsplit(endpoint).netloc
+    with _gates_lock:
+        if host not in _gates:
+            _gates[host] = RateLimitGate()
+        return _gates[host]
+
+
+# Exported classes.
+# .............................................................................
+
+class RateLimiter():
+    '''Token-bucket limit on the rate at which requests are made.
+
+    Each call to wait() takes one token from the bucket, first pausing until
+    one is available.  Tokens are added at "rate" per second, and the bucket
+    holds at most "burst" tokens, so that short bursts of up to "burst"
+    requests can go through without pausing.  The limiter can be shared by
+    multiple threads; the lock is only held while computing the pause, not
+    while pausing.
+    '''
+
+    def __init__(self, rate, burst = 1):
+        if rate <= 0:
+            raise ValueError('Rate must be a positive number.')
+        self.rate = rate
+        self._capacity = max(1, burst)
+        self._tokens = self._capacity
+        self._last = monotonic()
+        self._lock = Lock()
+
+
+    def wait(self):
+        '''Pause as long as necessary to stay within the rate limit.'''
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self._capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                pause = (1 - self._tokens) / self.rate
+            sleep(pause)
+
+
+class RateLimitGate():
+    '''A pause, shared by all threads, in the requests made to one server.
+
+    When a server reports that its rate limit has been exceeded, close() is
+    called with the length of the pause.  Until then, wait() returns right
+    away; afterwards, every thread that calls wait() pauses until the gate
+    reopens.  Closing a gate that is already closed does not lengthen the
+    pause, so that many threads that get rate-limit responses at the same
+    time cause only one pause.  Gates of different servers are independent.
+    '''
+
+    def __init__(self):
+        self._opens = 0
+        self._lock = Lock()
+        self.closures = 0
+
+
+    def close(self, seconds):
+        '''Make requests pause for "seconds", unless already paused.'''
+        with self._lock:
+            now = monotonic()
+            if now >= self._opens:
+                if __debug__: log(f'closing rate limit gate for {seconds}s')
+                self._opens = now + seconds
+                self.closures += 1
+
+
+    def remaining(self):
+        '''Return the number of seconds until the gate opens.'''
+        return max(0, self._opens - monotonic())
+
+
+    def wait(self, deadline = None):
+        '''Pause until the gate is open.
+
+        If "deadline" is given and the gate will not open before it, this
+        raises TimedOut instead of pausing.
+        '''
+        pause = self.remaining()
+        if not pause:
+            return
+        if deadline and deadline.remaining() <= pause:
+            raise TimedOut('Rate limited by server and out of time')
+        sleep(pause)
+
+
+class AdaptiveLimit():
+    '''A limit on concurrent requests that adjusts itself to the server.
+
+    This can be used in place of a semaphore: acquire() waits until fewer
+    than the current limit of requests are in progress, and release() ends
+    a request.  After each request, observe() is given the time the request
+    took and whether the server said its rate limit was exceeded.
+
+    The limit is adjusted like the congestion window of TCP Vegas.  The
+    lowest latency seen is taken as the time a request takes when the
+    server is not busy.  Once per window of samples (as many as the limit),
+    the average latency of the window is compared to it to estimate how
+    many requests are waiting at the server.  If that is fewer than
+    _VEGAS_ALPHA, and the requests in progress reached the limit during the
+    window, the limit goes up by one; if it is more than _VEGAS_BETA, the
+    limit goes down by one; otherwise it stays.  A rate-limit response
+    (HTTP 429) cuts the limit in half at once, but only once per round trip,
+    so that a burst of such responses counts as one.  The limit is never
+    below "minimum" or above "maximum".
+
+    The method stats() returns the current limit and the counts of the
+    decisions made, and the most recent decisions with their reasons.
+    '''
+
+    def __init__(self, initial = 4, minimum = 1, maximum = 32):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError('Limits must satisfy 1 <= minimum <= initial <= maximum.')
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._base_latency = None
+        self._window = []
+        self._window_peak = 0
+        self._windows = 0
+        self._smoothed = None
+        self._backoff_time = None
+        self._counts = {'increases': 0, 'decreases': 0, 'backoffs': 0, 'holds': 0}
+        self._decisions = deque(maxlen = _MAX_DECISIONS)
+        self._condition = Condition()
+
+
+    @property
+    def limit(self):
+        '''The current maximum number of concurrent requests.'''
+        return int(self._limit)
+
+
+    def acquire(self, timeout = None):
+        '''Wait until a request can start; return False if out of time.'''
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < int(self._limit),
+                                            timeout = timeout):
+                return False
+            self._in_flight += 1
+            self._window_peak = max(self._window_peak, self._in_flight)
+            return True
+
+
+    def release(self):
+        '''Note that a request has finished.'''
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+
+    def observe(self, latency, rate_limited = False):
+        '''Adjust the limit given the outcome of a finished request.'''
+        with self._condition:
+            now = monotonic()
+            if rate_limited:
+                # Responses to requests sent before the last backoff took
+                # effect say nothing new about the current limit.
+                rtt = self._smoothed or latency
+                if self._backoff_time is None or now - self._backoff_time > rtt:
+                    self._backoff_time = now
+                    self._adjust(max(self.minimum, self._limit * _BACKOFF),
+                                 'backoff', 'rate limit exceeded', latency)
+                return
+            self._smoothed = (latency if self._smoothed is None
+                              else 0.8 * self._smoothed + 0.2 * latency)
+            self._window.append(latency)
+            if len(self._window) >= self.limit:
+                self._end_window()
+
+
+    def stats(self):
+        '''Return a dictionary of the current state and the decisions made.
+
+        The dictionary contains the current limit, the number of requests
+        in progress, the base latency and the smoothed recent latency (in
+        seconds), the counts of increases, decreases, backoffs and holds,
+        and a list of the most recent changes of the limit, each a dictionary
+        with the time (as returned by time.time()), the decision, the new
+        limit, the average latency that led to it and the reason.
+        '''
+        with self._condition:
+            return {'limit'        : self.limit,
+                    'in_flight'    : self._in_flight,
+                    'base_latency' : self._base_latency,
+                    'latency'      : self._smoothed,
+                    **self._counts,
+                    'decisions'    : list(self._decisions)}
+
+
+    def _end_window(self):
+        # Called with the lock held.
+        window, peak = self._window, self._window_peak
+        self._window = []
+        self._window_peak = self._in_flight
+        self._windows += 1
+        average = sum(window) / len(window)
+        if self._base_latency is None or self._windows % _PROBE_WINDOWS == 0:
+            # Start afresh now and then, in case the server has got slower.
+            self._base_latency = min(window)
+        else:
+            self._base_latency = min(self._base_latency, min(window))
+        queued = self._limit * (1 - self._base_latency / average) if average else 0
+        if queued < _VEGAS_ALPHA:
+            if peak < self.limit:
+                self._counts['holds'] += 1   # The limit was not the constraint.
+            elif self._limit < self.maximum:
+                self._adjust(self._limit + 1, 'increase',
+                             f'latency flat ({queued:.1f} queued)', average)
+            else:
+                self._counts['holds'] += 1
+        elif queued > _VEGAS_BETA and self._limit > self.minimum:
+            self._adjust(self._limit - 1, 'decrease',
+                         f'latency rising ({queued:.1f} queued)', average)
+        else:
+            self._counts['holds'] += 1
+
+
+    def _adjust(self, limit, decision, reason, latency):
+        # Called with the lock held.
+        if __debug__: log(f'concurrency limit {int(self._limit)} -> {int(limit)}: {reason}')
+        self._limit = limit
+        self._counts[decision + 's'] += 1
+        self._decisions.append({'time'     : time(),
+                                'decision' : decision,
+                                'limit'    : int(limit),
+                                'latency'  : latency,
+                                'reason'   : reason})
+        self._condition.notify_all()
+
+
+class Deadline():
+    '''A point in time by which an operation must be finished.'''
+
+    def __init__(self, seconds):
+        '''Create a deadline "seconds" from now.'''
+        self.seconds = seconds
+        self._expires = monotonic() + seconds
+
+
+    def remaining(self):
+        '''Return the number of seconds left before the deadline.'''
+        return max(0, self._expires - monotonic())
+
+
+    def expired(self):
+        '''Return True if the deadline has passed.'''
+        return monotonic() >= self._expires
+
+
+class LatencyTracker():
+    '''Keep track of recent request latencies.
+
+    The tracker remembers the "size" most recent latencies (in seconds)
+    given to observe().  The method hedge_delay() returns the latency at
+    the "quantile" of those values, once at least "min_samples" latencies
+    have been recorded; this is the time after which a hedged request is
+    sent.  The tracker also counts the hedged requests sent and the number
+    of times the hedged request finished first.
+    '''
+
+    def __init__(self, size = 256, min_samples = 20, quantile = 0.95):
+        self._samples = deque(maxlen = size)
+        self._min_samples = min_samples
+        self._quantile = quantile
+        self._lock = Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+
+    def observe(self, seconds):
+        '''Record a request latency of "seconds".'''
+        with self._lock:
+            self._samples.append(seconds)
+            self.requests += 1
+
+
+    def percentile(self, quantile):
+        '''Return the latency at the given quantile (0-1), or None.'''
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+    def hedge_delay(self):
+        '''Return the time to wait before hedging, or None if unknown yet.'''
+        if len(self._samples) < self._min_samples:
+            return None
+        return self.percentile(self._quantile)
+
+
+    def stats(self):
+        '''Return a dictionary of latency percentiles and hedging counts.'''
+        return {'requests'   : self.requests,
+                'p50'        : self.percentile(0.50),
+                'p95'        : self.percentile(0.95),
+                'p99'        : self.percentile(0.99),
+                'hedges'     : self.hedges,
+                'hedge_wins' : self.hedge_wins}
+
+
+# Internal helper functions.
+# .............................................................................
+
+def _thread_pool(name):
+    '''Return the thread pool called "name", creating it if necessary.'''
+    with _pools_lock:
+        if name not in _pools:
+            from concurrent.futures import ThreadPoolExecutor
+            _pools[name] = ThreadPoolExecutor(_MAX_POOL_THREADS[name],
+                                              thread_name_prefix = f'topi-{name}')
+        return _pools[name]
+
+
+def _get(endpoint, deadline, latency, hedge, client = None, concurrency = None):
+    '''Do HTTP GET on "endpoint" and return the (response, error) tuple.
+
+    If "concurrency" is not None, the caller has acquired one of its slots
+    for this request; the slot is released when the request ends, which can
+    be after this function returns if the request was abandoned at the
+    deadline.  A hedged request acquires a slot of its own, and is not sent
+    if none is free.  Requests without a deadline, and hedged requests for
+    which no hedge delay is known yet, are made using commonpy's net().
+    '''
+    from commonpy.network_utils import net
+
+    # Pauses for rate limits are coordinated by result_from_api().
+    def timed_get(timeout = None):
+        start = monotonic()
+        if background:
+            result = _direct_get(endpoint, client, timeout)
+        else:
+            result = net('get', endpoint, client = client, handle_rate = False)
+        if latency:
+            latency.observe(monotonic() - start)
+        return result
+
+    delay = latency.hedge_delay() if (hedge and latency) else None
+    background = deadline or delay is not None
+    if not background:
+        start = monotonic()
+        result = None
+        try:
+            result = timed_get()
+            return result
+        finally:
+            _release(concurrency, start, result)
+
+    # Run the request(s) in background threads, so that we can stop waiting
+    # when the deadline is reached without depending on network timeouts.
+    # The requests themselves make no retries and time out at the deadline,
+    # so that abandoned requests do not hold threads of the pool for long.
+    from concurrent.futures import wait as wait_for, FIRST_COMPLETED
+    from commonpy.exceptions import NoContent
+    timeout = _NETWORK_TIMEOUT
+    if deadline:
+        timeout = min(timeout, max(deadline.remaining(), 0.001))
+    executor = _thread_pool('requests')
+
+    def submit():
+        start = monotonic()
+        future = executor.submit(timed_get, timeout)
+        future.add_done_callback(lambda f: _release(concurrency, start,
+                                                    None if f.exception() else f.result()))
+        return future
+
+    first = submit()
+    pending = {first}
+    if delay is not None:
+        if deadline:
+            delay = min(delay, deadline.remaining())
+        done, _ = wait_for(pending, timeout = delay)
+        if not done and not (deadline and deadline.expired()):
+            if concurrency and not concurrency.acquire(timeout = 0):
+                if __debug__: log(f'no free slot to hedge {endpoint}')
+            else:
+                if __debug__: log(f'no response after {delay:.3f}s; hedging {endpoint}')
+                with latency._lock:
+                    latency.hedges += 1
+                pending.add(submit())
+    while pending:
+        timeout = deadline.remaining() if deadline else None
+        done, pending = wait_for(pending, timeout = timeout,
+                                 return_when = FIRST_COMPLETED)
+        if not done:
+            if __debug__: log(f'deadline of {deadline.seconds}s reached for {endpoint}')
+            raise TimedOut(f'No response within {deadline.seconds}s from {endpoint}')
+        for future in done:
+            (resp, error) = future.result()
+            # NoContent is an answer; another request would get the same.
+            if not error or isinstance(error, NoContent) or not pending:
+                if future is not first and latency:
+                    with latency._lock:
+                        latency.hedge_wins += 1
+                for other in pending:
+                    other.cancel()
+                return (resp, error)
+
+
+def _direct_get(endpoint, client = None, timeout = None):
+    '''Do a single HTTP GET on "endpoint"; return the (response, error) tuple.
+
+    Unlike commonpy's net(), this does not retry or pause after failures, so
+    the request ends within about "timeout" seconds.  Errors are reported
+    the way net() reports them.
+    '''
+    import httpx
+    from commonpy.exceptions import (NoContent, RateLimitExceeded,
+                                     ServiceFailure, NetworkFailure)
+    from commonpy.network_utils import on_localhost, network_available
+
+    options = {'follow_redirects': True,
+               'timeout': httpx.Timeout(timeout or _NETWORK_TIMEOUT)}
+    try:
+        if client:
+            resp = client.get(endpoint, **options)
+        else:
+            with httpx.Client(http2 = True, verify = False) as new_client:
+                resp = new_client.get(endpoint, **options)
+    except httpx.TimeoutException as ex:
+        return (None, NetworkFailure(f'Timed out contacting {endpoint}'))
+    except (httpx.NetworkError, httpx.ProtocolError) as ex:
+        if isinstance(ex, httpx.ConnectError) and on_localhost(endpoint):
+            return (None, ServiceFailure(f'Access failure for {endpoint} ({str(ex)})'))
+        elif on_localhost(endpoint) or network_available():
+            return (None, ServiceFailure(f'Server error for {endpoint} ({str(ex)})'))
+        else:
+            return (None, NetworkFailure(f'Network failure for {endpoint} ({str(ex)})'))
+    except Exception as ex:
+        # Like net(), return other exceptions instead of raising them.
+        if __debug__: log(f'exception contacting {endpoint}: {str(ex)}')
+        return (None, ex)
+    code = resp.status_code
+    if code in [404, 410]:
+        return (resp, NoContent(f'No content found for {endpoint}'))
+    elif code == 429:
+        return (resp, RateLimitExceeded(f'Rate limit exceeded for {endpoint}'))
+    elif not (200 <= code < 400):
+        return (resp, ServiceFailure(f'Server returned code {code} for {endpoint}'))
+    return (resp, None)
+
+
+def _release(concurrency, start, result = None):
+    '''Release a slot of "concurrency" held by a request begun at "start".
+
+    An AdaptiveLimit is also given the time taken and whether the server
+    said its rate limit was exceeded, if the request produced a "result".
+    '''
+    if not concurrency:
+        return
+    concurrency.release()
+    if isinstance(concurrency, AdaptiveLimit) and result is not None:
+        from commonpy.exceptions import RateLimitExceeded
+        concurrency.observe(monotonic() - start,
+                            rate_limited = isinstance(result[1], RateLimitExceeded))
@@ -0,0 +1,232 @@
+'''
+watch.py: watch the items of TIND records for changes in circulation status
+
+The ItemWatcher class in this module repeatedly polls TIND for the item data
+of a set of records and reports changes (for example, in the "status" or
+"location" fields of items) as ItemChange events.  Each record is polled on
+its own schedule: a record whose items changed recently is polled again after
+the minimum interval, and every poll that finds no change lengthens the
+interval for that record, up to a maximum.  The raw response for each record
+is hashed, and when the hash is unchanged from the previous poll, the
+response is not parsed and no TindItem objects are created.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import namedtuple
+from   concurrent.futures import ThreadPoolExecutor
+from   hashlib import blake2b
+from   heapq import heappush, heappop
+from   threading import Event
+from   time import monotonic
+
+if __debug__:
+    from .debug import log
+
+
+# Exported data types.
+# .............................................................................
+
+ItemChange = namedtuple('ItemChange', 'tind_id barcode kind fields old new')
+ItemChange.__doc__ = '''A change in an item of a TIND record.
+
+The value of "kind" is "added", "removed" or "changed".  The value of
+"fields" is a tuple of the names of the item fields whose values differ.
+The values of "old" and "new" are the TindItem objects before and after the
+change; "old" is None for added items and "new" is None for removed items.
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+class ItemWatcher():
+    '''Poll TIND for changes in the items of a set of records.
+
+    Iterating over an ItemWatcher object polls the records as they become
+    due and yields an ItemChange object for every change found, pausing
+    between polls as necessary, until stop() is called.  Alternatively,
+    calling run() does the same but only delivers the changes to the
+    callback function given to the constructor.  The method poll() polls the
+    records that are currently due, once, without pausing.
+
+    The first poll of each record establishes the baseline against which
+    later polls are compared; it does not produce change events.  The
+    threads used for polling are kept between polls; call close(), or use
+    the watcher in a "with" statement, to end them when done.
+    '''
+
+    def __init__(self, tind, tind_ids, callback = None, min_interval = 60,
+                 max_interval = 3600, backoff = 1.5, workers = 4):
+        '''Create a watcher for the records "tind_ids" in the Tind "tind".
+
+        Each record is polled after at most "max_interval" and at least
+        "min_interval" seconds.  Every poll that finds no change multiplies
+        the interval for the record by "backoff"; a change resets it to
+        "min_interval".  If "callback" is given, it is called with each
+        ItemChange object.  Polls of different records are done in parallel
+        using up to "workers" threads, which are kept until close() is called.
+        '''
+        if min_interval < 0 or max_interval < min_interval or backoff < 1:
+            raise ValueError('Invalid interval or backoff values.')
+        self._tind = tind
+        self._callback = callback
+        self._min = min_interval
+        self._max = max_interval
+        self._backoff = backoff
+        self._workers = workers
+        self._executor = None
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix = 'topi-watch')
+        self._closed = False
+        self._stop = Event()
+        self._state = {}
+        self._schedule = []
+        self._counts = {'polls': 0, 'unchanged': 0, 'changes': 0, 'errors': 0}
+        now = monotonic()
+        for id in tind_ids:
+            id = str(id)
+            if id not in self._state:
+                self._state[id] = _WatchState(min_interval)
+                heappush(self._schedule, (now, id))
+
+
+    def __iter__(self):
+        self._stop.clear()
+        while not self._stop.is_set():
+            for change in self.poll():
+                yield change
+            if self._schedule:
+                self._stop.wait(max(0, self._schedule[0][0] - monotonic()))
+            else:
+                break
+
+
+    def run(self):
+        '''Poll until stop() is called, delivering changes to the callback.'''
+        for _ in self:
+            pass
+
+
+    def stop(self):
+        '''Make a run or iteration in progress stop after the current poll.'''
+        self._stop.set()
+
+
+    def close(self):
+        '''Stop polling and end the threads used for polls.'''
+        self._closed = True
+        self.stop()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def poll(self):
+        '''Poll the records that are due now and return a list of changes.'''
+        if self._closed:
+            raise ValueError('Watcher has been closed')
+        now = monotonic()
+        due = []
+        while self._schedule and self._schedule[0][0] <= now:
+            due.append(heappop(self._schedule)[1])
+        if not due:
+            return []
+        if self._executor is not None and len(due) > 1:
+            outcomes = list(self._executor.map(self._poll_record, due))
+        else:
+            outcomes = [self._poll_record(id) for id in due]
+
+        changes = []
+        now = monotonic()
+        for id, outcome in zip(due, outcomes):
+            state = self._state[id]
+            self._counts['polls'] += 1
+            if outcome is None:
+                self._counts['errors'] += 1
+            elif outcome:
+                self._counts['changes'] += len(outcome)
+                changes += outcome
+                state.interval = self._min
+            else:
+                self._counts['unchanged'] += 1
+                state.interval = min(self._max, state.interval * self._backoff)
+            heappush(self._schedule, (now + state.interval, id))
+        if self._callback:
+            for change in changes:
+                self._callback(change)
+        return changes
+
+
+    def stats(self):
+        '''Return a dictionary of polling statistics.
+
+        The dictionary contains the total number of polls, the number of
+        polls that found no change, the number of changes found, the number
+        of polls that failed, and the current polling interval of every
+        record (under the key "intervals").
+        '''
+        result = dict(self._counts)
+        result['intervals'] = {id: s.interval for id, s in self._state.items()}
+        return result
+
+
+    def _poll_record(self, id):
+        '''Return a list of changes for record "id", or None on error.'''
+        state = self._state[id]
+        try:
+            text = self._tind._items_json_for_tind_id(id)
+            digest = blake2b(text or b'', digest_size = 16).digest()
+            if digest == state.digest:
+                return []
+            items = self._tind._items_from_json(text)
+        except Exception as ex:
+            if __debug__: log(f'failed to poll items of {id}: {str(ex)}')
+            return None
+        state.digest = digest
+        current = {item.barcode: item for item in items}
+        previous, state.items = state.items, current
+        if previous is None:
+            return []
+        changes = []
+        for barcode, old in previous.items():
+            new = current.get(barcode)
+            if new is None:
+                changes.append(ItemChange(id, barcode, 'removed', (), old, None))
+                continue
+            old_values, new_values = old.as_dict(), new.as_dict()
+            fields = tuple(f for f in new_values if new_values[f] != old_values[f])
+            if fields:
+                changes.append(ItemChange(id, barcode, 'changed', fields, old, new))
+        for barcode, new in current.items():
+            if barcode not in previous:
+                changes.append(ItemChange(id, barcode, 'added', (), None, new))
+        if __debug__: log(f'found {len(changes)} changes in items of {id}')
+        return changes
+
+
+class _WatchState():
+    '''What the watcher knows about one record.'''
+    __slots__ = ('interval', 'digest', 'items')
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.digest = None
+        self.items = None